@@ -11,10 +11,6 @@ sudo apt update
 echo "Installing LaTeX (texlive-full)..."
 sudo apt install -y texlive-full
 
-# Install ImageMagick for converting LaTeX PDFs to images
-echo "Installing ImageMagick..."
-sudo apt install -y imagemagick
-
 # Check if Conda is installed
 if ! command -v conda &> /dev/null; then
     echo "Conda not found. Please install Miniconda or Anaconda first."
@@ -28,7 +24,7 @@ conda create -n synthlatex python=3.8 -y
 source "$(conda info --base)/etc/profile.d/conda.sh"  # Ensure conda is available in script
 conda activate synthlatex
 
-# Install Python dependencies from requirements.txt
+# Install Python dependencies from requirements.txt (pypdfium2 and Pillow rasterize the PDFs in-process)
 echo "Installing Python dependencies..."
 pip install -r requirements.txt
 
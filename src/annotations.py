@@ -0,0 +1,164 @@
+import os
+import argparse
+from array import array
+
+import numpy as np
+
+from .template_generator import CATEGORIES, PLAIN_STYLE, STRUCTURE_CATEGORIES, STYLE_NAMES
+
+ANNOTATIONS_NAME = "annotations.npz"
+
+# Per-sample columns, and ragged per-structure and per-slot columns stored CSR-style:
+# the values of sample k are values[offsets[k]:offsets[k + 1]]
+SAMPLE_COLUMNS = ("index", "base_id")
+RAGGED_COLUMNS = {"structure_ids": "structure_offsets", "slot_spans": "slot_offsets", "style_ids": "slot_offsets"}
+
+# Prefix of the optional per-sample columns holding the parameters of augmented page images
+AUGMENT_PREFIX = "augment_"
+
+class AnnotationBuilder:
+    """Accumulates the ground-truth labels of TemplateRecords in typed columns.
+
+    Values go into compact array buffers as records stream past, so labels for
+    millions of samples cost a few bytes each rather than Python objects.
+    """
+
+    def __init__(self):
+        self._index = array("q")
+        self._base_id = array("h")
+        self._structure_ids = array("h")
+        self._structure_counts = array("q")
+        self._slot_spans = array("q")
+        self._style_ids = array("b")
+        self._slot_counts = array("q")
+
+    def __len__(self):
+        return len(self._index)
+
+    def add(self, record):
+        self._index.append(-1 if record.index is None else record.index)
+        self._base_id.append(record.base_id)
+        self._structure_ids.extend(record.structure_ids)
+        self._structure_counts.append(len(record.structure_ids))
+        for start, end in record.slots:
+            self._slot_spans.append(start)
+            self._slot_spans.append(end)
+        self._style_ids.extend(record.styles)
+        self._slot_counts.append(len(record.slots))
+
+    def tap(self, records):
+        """Yield records unchanged, adding each one on the way."""
+        for record in records:
+            self.add(record)
+            yield record
+
+    def columns(self):
+        """The labels as a dict of NumPy arrays."""
+        return {
+            "index": np.frombuffer(self._index, dtype=np.int64).copy(),
+            "base_id": np.frombuffer(self._base_id, dtype=np.int16).copy(),
+            "structure_ids": np.frombuffer(self._structure_ids, dtype=np.int16).copy(),
+            "structure_offsets": _offsets(self._structure_counts),
+            "slot_spans": np.frombuffer(self._slot_spans, dtype=np.int64).reshape(-1, 2).copy(),
+            "style_ids": np.frombuffer(self._style_ids, dtype=np.int8).copy(),
+            "slot_offsets": _offsets(self._slot_counts),
+        }
+
+def _offsets(counts):
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(np.frombuffer(counts, dtype=np.int64), out=offsets[1:])
+    return offsets
+
+def merge_columns(parts):
+    """Concatenate the columns of consecutive batches, rebasing their offsets.
+
+    Augmentation parameter columns are kept if the first batch has them.
+    """
+    parts = [part for part in parts if part is not None]
+    if not parts:
+        return AnnotationBuilder().columns()
+    merged = {}
+    augment = tuple(sorted(name for name in parts[0] if name.startswith(AUGMENT_PREFIX)))
+    for name in SAMPLE_COLUMNS + tuple(RAGGED_COLUMNS) + augment:
+        merged[name] = np.concatenate([part[name] for part in parts])
+    for name in set(RAGGED_COLUMNS.values()):
+        bases = np.cumsum([0] + [part[name][-1] for part in parts[:-1]])
+        merged[name] = np.concatenate([parts[0][name][:1]] + [part[name][1:] + base for part, base in zip(parts, bases)])
+    return merged
+
+def save_annotations(path, columns):
+    """Write label columns plus the id-to-name tables needed to decode them."""
+    np.savez(
+        path,
+        style_names=np.array([PLAIN_STYLE] + STYLE_NAMES),
+        category_names=np.array(CATEGORIES),
+        structure_categories=np.array([CATEGORIES.index(c) for c in STRUCTURE_CATEGORIES], dtype=np.int8),
+        **columns,
+    )
+
+def write_annotations(records, path):
+    """Collect the labels of records and save them to path; return the count."""
+    builder = AnnotationBuilder()
+    for record in records:
+        builder.add(record)
+    save_annotations(path, builder.columns())
+    return len(builder)
+
+class Annotations:
+    """Columnar ground-truth labels loaded from an annotations file.
+
+    Whole columns are plain NumPy arrays (annotations.base_id, .style_ids, ...)
+    for vectorized use; annotations[k] gives the labels of one sample.
+    """
+
+    def __init__(self, path):
+        with np.load(path) as data:
+            self.columns = {name: data[name] for name in data.files}
+        for name, values in self.columns.items():
+            setattr(self, name, values)
+
+    def __len__(self):
+        return len(self.index)
+
+    def _ragged(self, name, k):
+        offsets = self.columns[RAGGED_COLUMNS[name]]
+        return self.columns[name][offsets[k]:offsets[k + 1]]
+
+    def __getitem__(self, k):
+        labels = {
+            "index": int(self.index[k]),
+            "base_id": int(self.base_id[k]),
+            "structure_ids": self._ragged("structure_ids", k).tolist(),
+            "slots": [tuple(span) for span in self._ragged("slot_spans", k).tolist()],
+            "styles": self._ragged("style_ids", k).tolist(),
+        }
+        augment = {name[len(AUGMENT_PREFIX):]: values[k].item() for name, values in self.columns.items()
+                   if name.startswith(AUGMENT_PREFIX)}
+        if augment:
+            labels["augment"] = augment
+        return labels
+
+    def categories(self):
+        """Category id of every structure in structure_ids order."""
+        return self.structure_categories[self.structure_ids]
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a ground-truth annotations file.")
+    parser.add_argument("path", help="annotations.npz file or a directory containing one")
+    args = parser.parse_args()
+    path = os.path.join(args.path, ANNOTATIONS_NAME) if os.path.isdir(args.path) else args.path
+
+    annotations = Annotations(path)
+    print(f"{len(annotations)} samples, {len(annotations.structure_ids)} structures, "
+          f"{len(annotations.style_ids)} slots")
+    counts = np.bincount(annotations.categories(), minlength=len(annotations.category_names))
+    print("Structures by category: " + ", ".join(f"{name} {count}" for name, count in zip(annotations.category_names, counts)))
+    counts = np.bincount(annotations.style_ids, minlength=len(annotations.style_names))
+    print("Slots by style: " + ", ".join(f"{name} {count}" for name, count in zip(annotations.style_names, counts)))
+    augmented = [(name[len(AUGMENT_PREFIX):], np.count_nonzero(values)) for name, values in annotations.columns.items()
+                 if name.startswith(AUGMENT_PREFIX)]
+    if augmented:
+        print("Augmented samples by parameter: " + ", ".join(f"{name} {count}" for name, count in augmented))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+import numpy as np
+
+# Augmentations in the order they are applied: printing (paper, ink), then scanning and compression
+AUGMENTATIONS = ("texture", "bleed", "rotate", "blur", "noise", "jpeg")
+
+# Per-sample parameters and the augmentation each belongs to, recorded as annotation columns; 0 means not applied
+PARAMETERS = {"texture_strength": "texture", "bleed": "bleed", "rotate_degrees": "rotate", "skew": "rotate",
+              "blur_sigma": "blur", "noise_std": "noise", "jpeg_quality": "jpeg"}
+
+# Chance that an enabled augmentation is applied to a sample
+PROBABILITIES = {"texture": 0.5, "bleed": 0.3, "rotate": 0.5, "blur": 0.4, "noise": 0.6, "jpeg": 0.5}
+
+# Streams of the per-page generators of random fields, next to seed, sample index and page
+_TEXTURE_STREAM = 0x7E7
+_NOISE_STREAM = 0x401
+
+# Coarse texture cells are this many pixels apart
+_TEXTURE_CELL = 48
+
+# IJG luminance quantization table at quality 50
+_JPEG_TABLE = np.array([
+    [16, 11, 10, 16, 24, 40, 51, 61],
+    [12, 12, 14, 19, 26, 58, 60, 55],
+    [14, 13, 16, 24, 40, 57, 69, 56],
+    [14, 17, 22, 29, 51, 87, 80, 62],
+    [18, 22, 37, 56, 68, 109, 103, 77],
+    [24, 35, 55, 64, 81, 104, 113, 92],
+    [49, 64, 78, 87, 103, 121, 120, 101],
+    [72, 92, 95, 98, 112, 100, 103, 99],
+], dtype=np.float32)
+
+def _dct_matrix():
+    k = np.arange(8)
+    matrix = np.cos((2 * k[None, :] + 1) * k[:, None] * np.pi / 16) * np.sqrt(2 / 8)
+    matrix[0] /= np.sqrt(2)
+    return matrix.astype(np.float32)
+
+_DCT = _dct_matrix()
+
+_MASK = 2 ** 64 - 1
+
+def _mix(x):
+    """splitmix64 finalizer over a uint64 array; wraps around like the 64-bit original."""
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+def uniforms(seed, indices, k):
+    """(len(indices), k) floats in [0, 1), a pure function of seed, sample index and column.
+
+    Hashed rather than drawn from a generator, so parameters of any set of
+    samples come out of a few array operations, in any order or batching.
+    """
+    key = _mix(np.array([seed & _MASK], dtype=np.uint64))
+    x = _mix(np.asarray(indices, dtype=np.int64).astype(np.uint64) ^ key)
+    x = _mix(x[:, None] + np.arange(1, k + 1, dtype=np.uint64) * np.uint64(0xD1B54A32D192ED03))
+    return (x >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+
+def _jpeg_table(quality):
+    """8x8 IJG quantization steps of a JPEG quality from 1 to 100."""
+    scale = 5000 / quality if quality < 50 else 200 - 2 * quality
+    return np.clip(np.floor((_JPEG_TABLE * scale + 50) / 100), 1, 255)
+
+class Augmenter:
+    """Vectorized degradation of rendered pages: paper texture, ink bleed, rotation and skew, blur, noise and JPEG.
+
+    Pages are converted to grayscale and processed batch_size at a time in
+    float32 buffers that are allocated once and only grow for a larger page.
+    Ink bleed is a whole-batch NumPy operation; texture, rotation, blur,
+    noise and JPEG, which only some pages get, run on just those pages in
+    the same buffers. No step loops over pixels or allocates per image.
+    Random fields are drawn at each page's own size and the padding is kept
+    white, so a page comes out the same whatever else shares its batch.
+
+    Parameters of sample k are a pure function of seed and k (see params), so
+    they can be recorded with the labels without touching a page; all pages
+    of a sample share them. Random fields (paper texture, pixel noise) are
+    drawn per page from generators seeded by seed, k and the page number.
+    strength scales every magnitude.
+    """
+
+    def __init__(self, seed=0, augmentations=AUGMENTATIONS, strength=1.0, batch_size=4):
+        unknown = set(augmentations) - set(AUGMENTATIONS)
+        if unknown:
+            raise ValueError(f"Unknown augmentations: {', '.join(sorted(unknown))}")
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self.seed = seed
+        self.augmentations = tuple(name for name in AUGMENTATIONS if name in augmentations)
+        self.strength = strength
+        self.batch_size = batch_size
+        self._buffers = {}
+
+    @property
+    def key(self):
+        return self.seed, self.augmentations, self.strength, self.batch_size
+
+    def __getstate__(self):
+        # Buffers are not worth sending to a worker; they are allocated there on first use
+        return dict(self.__dict__, _buffers={})
+
+    def params(self, indices):
+        """Dict of PARAMETERS to arrays holding the parameters of the samples in indices."""
+        u = uniforms(self.seed, indices, 2 * len(AUGMENTATIONS) + 1)
+        applied = {
+            name: (u[:, 2 * k] < PROBABILITIES[name]) & (name in self.augmentations)
+            for k, name in enumerate(AUGMENTATIONS)
+        }
+        magnitude = {name: u[:, 2 * k + 1] for k, name in enumerate(AUGMENTATIONS)}
+        s = self.strength
+        params = {
+            "texture_strength": (0.05 + 0.2 * magnitude["texture"]) * s,
+            "bleed": np.minimum((0.2 + 0.6 * magnitude["bleed"]) * s, 1),
+            "rotate_degrees": (4 * magnitude["rotate"] - 2) * s,
+            "skew": (0.06 * u[:, -1] - 0.03) * s,
+            "blur_sigma": (0.4 + 1.2 * magnitude["blur"]) * s,
+            "noise_std": (2 + 12 * magnitude["noise"]) * s,
+            "jpeg_quality": np.clip(np.rint(90 - 60 * magnitude["jpeg"] * s), 5, 95),
+        }
+        params = {name: np.where(applied[PARAMETERS[name]], values, 0).astype(np.float32)
+                  for name, values in params.items()}
+        params["jpeg_quality"] = params["jpeg_quality"].astype(np.int16)
+        return params
+
+    def columns(self, indices):
+        """Annotation columns of the parameters of the samples in indices."""
+        from .annotations import AUGMENT_PREFIX
+
+        return {AUGMENT_PREFIX + name: values for name, values in self.params(indices).items()}
+
+    def matrix(self, params, k, height, width):
+        """3x3 forward affine map of sample k of params, from page pixels (x, y) to augmented pixels."""
+        angle = np.deg2rad(float(params["rotate_degrees"][k]))
+        cx, cy = (width - 1) / 2, (height - 1) / 2
+        c, s = np.cos(angle), np.sin(angle)
+        to_center = np.array([[1, 0, -cx], [0, 1, -cy], [0, 0, 1]])
+        rotate = np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+        skew = np.array([[1, float(params["skew"][k]), 0], [0, 1, 0], [0, 0, 1]])
+        back = np.array([[1, 0, cx], [0, 1, cy], [0, 0, 1]])
+        return back @ rotate @ skew @ to_center
+
+    def augment(self, pages):
+        """Augment (index, page_number, image) triples; yield (index, page_number, image, matrix).
+
+        Images come back as grayscale Pillow images of the same size. They
+        may share a buffer that the next batch overwrites, so save or copy()
+        them before advancing past the batch. matrix is the forward affine map
+        of the page (see matrix), or None when the page was not rotated or
+        skewed.
+        """
+        batch = []
+        for page in pages:
+            batch.append(page)
+            if len(batch) >= self.batch_size:
+                yield from self._augment_batch(batch)
+                batch = []
+        if batch:
+            yield from self._augment_batch(batch)
+
+    def _buffer(self, name, shape, dtype=np.float32):
+        """Contiguous view of shape over the named buffer, which grows to fit and never shrinks."""
+        size = int(np.prod(shape))
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.size < size or buffer.dtype != dtype:
+            buffer = self._buffers[name] = np.empty(size, dtype=dtype)
+        return buffer[:size].reshape(shape)
+
+    def _augment_batch(self, batch):
+        from PIL import Image
+
+        n = len(batch)
+        sizes = [image.size[::-1] for _, _, image in batch]
+        height = -(-max(h for h, _ in sizes) // 8) * 8
+        width = -(-max(w for _, w in sizes) // 8) * 8
+        pages = self._buffer("pages", (n, height, width))
+        for k, (_, _, image) in enumerate(batch):
+            h, w = sizes[k]
+            pages[k, :h, :w] = np.asarray(image if image.mode == "L" else image.convert("L"))
+        _whiten_padding(pages, sizes)
+        params = self.params([index for index, _, _ in batch])
+        self._texture(pages, params, batch, sizes)
+        self._bleed(pages, params)
+        # Bleed spreads edge ink into the padding, whose extent depends on the rest of the batch
+        _whiten_padding(pages, sizes)
+        matrices = self._rotate(pages, params, sizes)
+        # Rotated content lands in the padding too, where blur would pull it back in
+        _whiten_padding(pages, sizes)
+        self._blur(pages, params)
+        self._noise(pages, params, batch, sizes)
+        self._jpeg(pages, params)
+        out = self._buffer("out", (n, height, width), np.uint8)
+        np.clip(pages, 0, 255, out=pages)
+        np.rint(pages, out=pages)
+        np.copyto(out, pages, casting="unsafe")
+        for k, (index, page_number, _) in enumerate(batch):
+            h, w = sizes[k]
+            yield index, page_number, Image.fromarray(out[k, :h, :w]), matrices[k]
+
+    def _texture(self, pages, params, batch, sizes):
+        """Multiply the textured pages by smooth paper: coarse random cells interpolated bilinearly to page size."""
+        strength = params["texture_strength"]
+        if not strength.any():
+            return
+        for k in np.flatnonzero(strength):
+            index, page_number, _ = batch[k]
+            h, w = sizes[k]
+            rows, cols = h // _TEXTURE_CELL + 2, w // _TEXTURE_CELL + 2
+            cells = self._buffer("cells", (rows, cols))
+            rng = np.random.default_rng([self.seed, _TEXTURE_STREAM, max(index, 0), page_number])
+            rng.random(dtype=np.float32, out=cells)
+            paper = self._buffer("work", (h, w))
+            np.matmul(np.matmul(_interpolation(h, rows), cells), _interpolation(w, cols).T, out=paper)
+            paper *= -strength[k]
+            paper += 1
+            pages[k, :h, :w] *= paper
+
+    def _bleed(self, pages, params):
+        """Spread ink: blend every pixel towards the darkest of its 3x3 neighbourhood."""
+        bleed = params["bleed"]
+        if not bleed.any():
+            return
+        column = self._buffer("work", pages.shape)
+        spread = self._buffer("scratch", pages.shape)
+        np.copyto(column, pages)
+        np.minimum(column[:, 1:], pages[:, :-1], out=column[:, 1:])
+        np.minimum(column[:, :-1], pages[:, 1:], out=column[:, :-1])
+        np.copyto(spread, column)
+        np.minimum(spread[:, :, 1:], column[:, :, :-1], out=spread[:, :, 1:])
+        np.minimum(spread[:, :, :-1], column[:, :, 1:], out=spread[:, :, :-1])
+        spread -= pages
+        spread *= bleed[:, None, None]
+        pages += spread
+
+    def _rotate(self, pages, params, sizes):
+        """Rotate and skew each page about its centre with bilinear resampling; return the forward matrices."""
+        n, height, width = pages.shape
+        matrices = [None] * n
+        for k in np.flatnonzero(params["rotate_degrees"] + params["skew"]):
+            h, w = sizes[k]
+            forward = self.matrix(params, k, h, w)
+            matrices[k] = forward
+            (a, b, c), (d, e, f), _ = np.linalg.inv(forward)
+            xs = np.arange(width, dtype=np.float32)
+            ys = np.arange(height, dtype=np.float32)[:, None]
+            sx = self._buffer("sx", (height, width))
+            sy = self._buffer("sy", (height, width))
+            np.add(a * xs, b * ys + c, out=sx)
+            np.add(d * xs, e * ys + f, out=sy)
+            outside = self._buffer("outside", (height, width), np.bool_)
+            x0 = self._buffer("x0", (height, width), np.intp)
+            y0 = self._buffer("y0", (height, width), np.intp)
+            floor = self._buffer("floor", (height, width))
+            np.floor(sx, out=floor)
+            np.copyto(x0, floor, casting="unsafe")
+            sx -= floor
+            np.floor(sy, out=floor)
+            np.copyto(y0, floor, casting="unsafe")
+            sy -= floor
+            # Bounded by the page itself, not the batch: the padding never leaks into a page
+            np.less(x0, 0, out=outside)
+            outside |= x0 > w - 2
+            outside |= y0 < 0
+            outside |= y0 > h - 2
+            y0 *= width
+            y0 += x0
+            source = pages[k].ravel()
+            flat = source.size - width - 1
+            top = self._buffer("top", (height, width))
+            right = self._buffer("right", (height, width))
+            bottom = self._buffer("work", (height, width))
+            np.take(source[:flat], y0, out=top, mode="clip")
+            np.take(source[1:flat + 1], y0, out=right, mode="clip")
+            right -= top
+            right *= sx
+            top += right
+            np.take(source[width:width + flat], y0, out=bottom, mode="clip")
+            np.take(source[width + 1:], y0, out=right, mode="clip")
+            right -= bottom
+            right *= sx
+            bottom += right
+            bottom -= top
+            bottom *= sy
+            top += bottom
+            top[outside] = 255
+            np.copyto(pages[k], top)
+        return matrices
+
+    def _blur(self, pages, params):
+        """Separable Gaussian blur of the blurred pages, beyond the page edges as white paper."""
+        for k in np.flatnonzero(params["blur_sigma"]):
+            sigma = float(params["blur_sigma"][k])
+            offsets = np.arange(-np.ceil(3 * sigma), np.ceil(3 * sigma) + 1, dtype=np.float32)
+            kernel = np.exp(-offsets ** 2 / (2 * sigma ** 2))
+            kernel /= kernel.sum()
+            page = pages[k:k + 1]
+            work = self._buffer("work", page.shape)
+            scratch = self._buffer("scratch", page.shape)
+            _convolve(page, work, scratch, kernel, axis=2)
+            _convolve(work, page, scratch, kernel, axis=1)
+
+    def _noise(self, pages, params, batch, sizes):
+        """Add pixel noise to the noisy pages: the sum of two uniform fields, near Gaussian with noise_std.
+
+        Two float32 uniform draws cost about half of one standard_normal draw.
+        """
+        std = params["noise_std"]
+        for k in np.flatnonzero(std):
+            index, page_number, _ = batch[k]
+            rng = np.random.default_rng([self.seed, _NOISE_STREAM, max(index, 0), page_number])
+            h, w = sizes[k]
+            noise = self._buffer("scratch", (h, w))
+            other = self._buffer("work", (h, w))
+            rng.random(dtype=np.float32, out=noise)
+            rng.random(dtype=np.float32, out=other)
+            noise += other
+            noise -= 1
+            noise *= std[k] * np.sqrt(6)  # the sum of two U(0, 1) has variance 1/6
+            pages[k, :h, :w] += noise
+
+    def _jpeg(self, pages, params):
+        """Quantize the 8x8 block DCT of the compressed pages as a JPEG encoder at their quality would."""
+        quality = params["jpeg_quality"]
+        _, height, width = pages.shape
+        shape = (height // 8, width // 8, 8, 8)
+        for k in np.flatnonzero(quality):
+            page = pages[k]
+            blocks = page.reshape(height // 8, 8, width // 8, 8).transpose(0, 2, 1, 3)
+            work = self._buffer("work", shape)
+            coefficients = self._buffer("scratch", shape)
+            table = _jpeg_table(quality[k])
+            page -= 128
+            np.matmul(_DCT, blocks, out=work)
+            np.matmul(work, _DCT.T, out=coefficients)
+            coefficients /= table
+            np.rint(coefficients, out=coefficients)
+            coefficients *= table
+            np.matmul(_DCT.T, coefficients, out=work)
+            np.matmul(work, _DCT, out=blocks)
+            page += 128
+
+def _whiten_padding(pages, sizes):
+    """Set the padding of each page beyond its own (height, width) to white paper."""
+    for k, (h, w) in enumerate(sizes):
+        pages[k, h:, :] = 255
+        pages[k, :h, w:] = 255
+
+def _interpolation(size, cells):
+    """(size, cells) matrix interpolating cells values spread evenly over size pixels linearly."""
+    position = np.arange(size, dtype=np.float32) / _TEXTURE_CELL
+    lower = np.minimum(position.astype(np.intp), cells - 2)
+    weight = position - lower
+    matrix = np.zeros((size, cells), dtype=np.float32)
+    matrix[np.arange(size), lower] = 1 - weight
+    matrix[np.arange(size), lower + 1] = weight
+    return matrix
+
+def _convolve(source, out, scratch, kernel, axis):
+    """out = source convolved with kernel along axis, counting pixels beyond the edges as 255."""
+    radius = len(kernel) // 2
+    length = source.shape[axis]
+
+    def part(array, start, stop):
+        index = [slice(None)] * array.ndim
+        index[axis] = slice(start, stop)
+        return array[tuple(index)]
+
+    np.multiply(source, kernel[radius], out=out)
+    for offset in range(1, min(radius, length - 1) + 1):
+        for weight, target, origin in ((kernel[radius - offset], (offset, length), (0, length - offset)),
+                                       (kernel[radius + offset], (0, length - offset), (offset, length))):
+            product = part(scratch, *target)
+            np.multiply(part(source, *origin), weight, out=product)
+            part(out, *target)[...] += product
+            part(out, *((0, offset) if target[0] else (length - offset, length)))[...] += 255 * weight
+
+_SHARED = {}
+
+def shared(augmenter):
+    """The Augmenter of this process with the settings of augmenter, so worker buffers survive across tasks."""
+    return _SHARED.setdefault(augmenter.key, augmenter)
@@ -0,0 +1,221 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+
+from .template_generator import (
+    BASE_TEMPLATES,
+    CATEGORIES,
+    COMPATIBLE_STRUCTURES,
+    STRUCTURE_CATEGORIES,
+    generate_packed,
+    generate_templates,
+    iter_templates,
+    sample_template,
+    shard_rng,
+)
+
+WORKLOADS = ("generate", "generate_batch", "generate_sharded", "fill", "compile_bases", "compile_families",
+             "rasterize")
+COMPILE_WORKLOADS = ("compile_bases", "compile_families", "rasterize")
+
+def _peak_rss_mb():
+    """Peak resident set size of this process and its finished children, in MiB."""
+    scale = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is bytes on macOS, KiB on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return round(max(own, children) / 2 ** 20, 1)
+
+def _rate(count, seconds, unit="templates"):
+    return {"count": count, "seconds": round(seconds, 4), f"{unit}_per_second": round(count / max(seconds, 1e-9), 1)}
+
+def bench_generate(args):
+    """Single-process sampling, one record at a time."""
+    rng = shard_rng(args.seed, 0)
+    started = time.perf_counter()
+    for index in range(args.count):
+        sample_template(rng, index)
+    return _rate(args.count, time.perf_counter() - started)
+
+def bench_generate_batch(args):
+    """Batch generation into one .tex file per template, in one process."""
+    with tempfile.TemporaryDirectory() as out_dir:
+        started = time.perf_counter()
+        generate_templates(args.count, out_dir, seed=args.seed, workers=1)
+        return _rate(args.count, time.perf_counter() - started)
+
+def bench_generate_sharded(args):
+    """Sharded generation over worker processes, as .tex files and as packed bin shards."""
+    results = {"workers": args.workers}
+    with tempfile.TemporaryDirectory() as out_dir:
+        started = time.perf_counter()
+        generate_templates(args.count, out_dir, seed=args.seed, workers=args.workers)
+        results["tex"] = _rate(args.count, time.perf_counter() - started)
+    with tempfile.TemporaryDirectory() as out_dir:
+        started = time.perf_counter()
+        generate_packed(args.count, out_dir, seed=args.seed, workers=args.workers,
+                        records_per_shard=max(1, args.count // args.workers))
+        results["bin"] = _rate(args.count, time.perf_counter() - started)
+    return results
+
+def bench_fill(args):
+    """Slot filling of pre-generated records from an in-memory corpus."""
+    from .fill import ListCorpus, fill_records
+
+    records = list(iter_templates(args.seed, args.count))
+    corpus = ListCorpus(f"snippet {i} with {{special}} & characters_{i % 97}" for i in range(10000))
+    slots = sum(len(record.slots) for record in records)
+    started = time.perf_counter()
+    for _ in fill_records(records, corpus, args.seed):
+        pass
+    seconds = time.perf_counter() - started
+    return dict(_rate(len(records), seconds), slots_per_second=round(slots / max(seconds, 1e-9), 1))
+
+def _compile_latency(records, engine, timeout):
+    """Compile records one at a time and summarize their latencies."""
+    from .render import CompilePool
+
+    with tempfile.TemporaryDirectory() as out_dir, CompilePool(1, engine, timeout) as pool:
+        results = list(pool.compile(records, out_dir))
+    seconds = sorted(result.seconds for result in results)
+    return {
+        "count": len(results),
+        "ok": sum(result.status == "ok" for result in results),
+        "mean_seconds": round(sum(seconds) / max(len(seconds), 1), 4),
+        "median_seconds": round(seconds[len(seconds) // 2], 4) if seconds else None,
+        "max_seconds": round(seconds[-1], 4) if seconds else None,
+    }
+
+def _records_for(sampler, args):
+    return list(iter_templates(args.seed, args.compile_count, sampler=sampler))
+
+def bench_compile_bases(args):
+    """Compile latency of every base template."""
+    from .sampling import WeightedSampler
+
+    results = {}
+    for base_id in range(len(BASE_TEMPLATES)):
+        weights = {str(i + 1): float(i == base_id) for i in range(len(BASE_TEMPLATES))}
+        records = _records_for(WeightedSampler(base_weights=weights), args)
+        results[str(base_id + 1)] = _compile_latency(records, args.engine, args.timeout)
+    return results
+
+def bench_compile_families(args):
+    """Compile latency per structure family, on base templates that support it."""
+    from .sampling import WeightedSampler
+
+    results = {}
+    for category in CATEGORIES:
+        members = {i for i, c in enumerate(STRUCTURE_CATEGORIES) if c == category}
+        bases = {str(b + 1): float(bool(members & set(c))) for b, c in enumerate(COMPATIBLE_STRUCTURES)}
+        structures = {c: float(c == category) for c in CATEGORIES}
+        records = _records_for(WeightedSampler(base_weights=bases, structure_weights=structures), args)
+        results[category] = _compile_latency(records, args.engine, args.timeout)
+    return results
+
+def bench_rasterize(args):
+    """Page rasterization throughput of freshly compiled PDFs."""
+    from .render import CompilePool
+    from .rasterize import RasterPool
+
+    records = list(iter_templates(args.seed, args.compile_count * 4))
+    with tempfile.TemporaryDirectory() as out_dir:
+        with CompilePool(args.workers, args.engine, args.timeout) as pool:
+            compiled = [result for result in pool.compile(records, out_dir) if result.status == "ok"]
+        with RasterPool(args.workers, args.dpi) as rasterizer:
+            started = time.perf_counter()
+            results = list(rasterizer.rasterize(compiled, os.path.join(out_dir, "images")))
+            seconds = time.perf_counter() - started
+    pages = sum(len(result.image_paths) for result in results)
+    errors = sum(result.status != "ok" for result in results)
+    return dict(_rate(pages, seconds, "pages"), documents=len(results), errors=errors, dpi=args.dpi)
+
+def _skip_reason(name, args):
+    if name not in COMPILE_WORKLOADS:
+        return None
+    if shutil.which(args.engine) is None:
+        return f"{args.engine} not found on PATH"
+    if name == "rasterize":
+        try:
+            import pypdfium2  # noqa: F401
+            import PIL  # noqa: F401
+        except ImportError as e:
+            return f"{e.name} is not installed"
+    return None
+
+def _run(name, args, queue):
+    """Child entry point: run one workload and send back its result with its peak RSS."""
+    try:
+        result = globals()["bench_" + name](args)
+    except Exception as e:  # report the failure instead of losing the whole run
+        result = {"error": f"{type(e).__name__}: {e}"}
+    result["peak_rss_mb"] = _peak_rss_mb()
+    queue.put(result)
+
+def run_benchmarks(args):
+    """Run the selected workloads, each in a fresh process so peak RSS is its own."""
+    context = multiprocessing.get_context("spawn")
+    report = {"environment": environment(args), "workloads": {}}
+    for name in args.workloads:
+        reason = _skip_reason(name, args)
+        if reason is not None:
+            report["workloads"][name] = {"skipped": reason}
+            print(f"{name}: skipped ({reason})", file=sys.stderr)
+            continue
+        # A plain process rather than a pool worker: sharded workloads start their own pools
+        queue = context.Queue()
+        process = context.Process(target=_run, args=(name, args, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+        report["workloads"][name] = result
+        print(f"{name}: {json.dumps(result)}", file=sys.stderr)
+    return report
+
+def environment(args):
+    """What the numbers depend on: code version, interpreter, machine and parameters."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "parameters": {key: value for key, value in vars(args).items() if key != "output"},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark template generation, filling, compiling and rasterizing.")
+    parser.add_argument("--workloads", nargs="+", choices=WORKLOADS, default=list(WORKLOADS),
+                        help="Workloads to run")
+    parser.add_argument("--count", type=int, default=20000, help="Templates per generation and fill workload")
+    parser.add_argument("--compile-count", type=int, default=3,
+                        help="Templates compiled per base template and per structure family")
+    parser.add_argument("--seed", type=int, default=0, help="Master seed of the benchmarked templates")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Processes for sharded workloads")
+    parser.add_argument("--engine", default="pdflatex", help="TeX engine for compile workloads")
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds before a compile is killed")
+    parser.add_argument("--dpi", type=int, default=150, help="Rasterization resolution")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args)
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import json
+from collections import defaultdict
+
+# Suffix of the bounding box file written next to a sample's PDF or page images
+BOXES_SUFFIX = ".boxes.json"
+
+# Suffix of the position file the markers write, relative to the job name
+POSITIONS_SUFFIX = ".pos"
+
+# Inserted before \begin{document}. \SLmark{sample}{slot}{b|e} saves the current
+# position and writes it, together with the 0-based page, the strut height and
+# depth, the line width and the page size (all in sp), when the page is shipped.
+# A begin marker in vertical mode starts the paragraph its slot would start anyway.
+# Slots stored in the preamble (\title, \fancyhead, ...) are marked with \SLsample,
+# which every document body sets, so batched samples sharing a preamble each get them.
+BOX_PREAMBLE = r"""\makeatletter
+\def\SLsample{}
+\newwrite\SL@pos
+\immediate\openout\SL@pos=\jobname.pos
+\newcount\SL@page
+\AddToHook{shipout/after}{\global\advance\SL@page\@ne}
+\protected\def\SLmark#1#2#3{\if b#3\ifvmode\leavevmode\fi\fi\pdfsavepos
+  \edef\SL@line{\number\ht\strutbox\space\number\dp\strutbox\space\number\linewidth}%
+  \expandafter\SL@mark\expandafter{\SL@line}{#1 #2 #3}}
+\def\SL@mark#1#2{\write\SL@pos{#2 \the\SL@page\space\the\pdflastxpos\space\the\pdflastypos\space#1
+  \space\number\pdfpagewidth\space\number\pdfpageheight}}
+\makeatother
+"""
+
+BEGIN_DOCUMENT = r"\begin{document}"
+
+# TeX points per PDF point
+_SP_PER_BP = 65536 * 72.27 / 72
+
+def mark_slots(text, slots, sample=0):
+    """Wrap every slot of a template in position markers and add their definitions.
+
+    Returns the marked text; it still shares its static preamble with the
+    unmarked text, so cached formats keep working.
+    """
+    begin = text.find(BEGIN_DOCUMENT)
+    parts, position = [], 0
+    for k, (start, end) in enumerate(slots):
+        owner = r"\SLsample" if start < begin else sample
+        parts.append(text[position:start])
+        parts.append(rf"\SLmark{{{owner}}}{{{k}}}{{b}}")
+        parts.append(text[start:end])
+        parts.append(rf"\SLmark{{{owner}}}{{{k}}}{{e}}")
+        position = end
+    parts.append(text[position:])
+    marked = "".join(parts)
+    begin = marked.find(BEGIN_DOCUMENT)
+    body = begin + len(BEGIN_DOCUMENT)
+    return marked[:begin] + BOX_PREAMBLE + marked[begin:body] + rf"\gdef\SLsample{{{sample}}}" + marked[body:]
+
+def parse_positions(path):
+    """Map (sample, slot) -> {"b"|"e": (page, x, y, height, depth, linewidth, page_width, page_height)}.
+
+    A slot typeset more than once, e.g. in a running head, keeps its first placement.
+    """
+    positions = defaultdict(dict)
+    try:
+        with open(path, encoding="ascii", errors="replace") as f:
+            lines = f.read().split("\n")
+    except OSError:
+        return {}
+    for line in lines:
+        fields = line.split()
+        if len(fields) != 11:
+            continue
+        sample, slot, kind = int(fields[0]), int(fields[1]), fields[2]
+        positions[sample, slot].setdefault(kind, tuple(int(value) for value in fields[3:]))
+    return positions
+
+def _bp(sp):
+    return round(sp / _SP_PER_BP, 2)
+
+def slot_boxes(positions, sample=0, first_page=0):
+    """Page-space boxes of the slots of one sample, in PDF points from the top-left corner.
+
+    A slot on one line gets its exact box. A slot that wraps gets a box that
+    encloses every line it can occupy; one that crosses a page break gets the
+    box of its first line and of its last line. Slots that were never
+    typeset (such as a \\title without \\maketitle) have no box.
+    """
+    boxes = []
+    for (owner, slot), marks in sorted(positions.items()):
+        if owner != sample or "b" not in marks or "e" not in marks:
+            continue
+        page, xb, yb, height, depth, linewidth, w, h = marks["b"]
+        end_page, xe, ye = marks["e"][:3]
+        # (page, x0, x1, top baseline, bottom baseline, page size), y up from the page bottom
+        if end_page != page:
+            parts = [(page, xb, xb + linewidth, yb, yb, w, h),
+                     (end_page, xe - linewidth, xe, ye, ye) + marks["e"][6:]]
+        elif ye == yb:
+            parts = [(page, xb, xe, yb, yb, w, h)]
+        else:
+            parts = [(page, max(xb, xe) - linewidth, min(xb, xe) + linewidth, yb, ye, w, h)]
+        for part_page, x0, x1, top, bottom, w, h in parts:
+            boxes.append({
+                "slot": slot,
+                "page": part_page - first_page,
+                "box": [_bp(max(x0, 0)), _bp(h - top - height), _bp(min(x1, w)), _bp(h - bottom + depth)],
+                "wrapped": len(parts) > 1 or top != bottom,
+            })
+    return boxes
+
+def page_sizes(positions, sample=0, first_page=0):
+    """(width, height) in PDF points of every page of a sample that holds a slot."""
+    sizes = {}
+    for (owner, _), marks in positions.items():
+        if owner == sample:
+            for page, *_, width, height in marks.values():
+                sizes[page - first_page] = [_bp(width), _bp(height)]
+    return sizes
+
+def write_boxes(path, positions, sample=0, first_page=0):
+    """Save the slot boxes of one sample as JSON; return the number of boxes."""
+    boxes = slot_boxes(positions, sample, first_page)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"unit": "bp", "origin": "top-left", "pages": page_sizes(positions, sample, first_page),
+                   "boxes": boxes}, f)
+    return len(boxes)
+
+def transform_box(box, matrix):
+    """Axis-aligned bounds of a pixel box [x0, y0, x1, y1] mapped by a 3x3 affine matrix."""
+    x0, y0, x1, y1 = box
+    xs, ys = [], []
+    for x, y in ((x0, y0), (x1, y0), (x0, y1), (x1, y1)):
+        xs.append(matrix[0][0] * x + matrix[0][1] * y + matrix[0][2])
+        ys.append(matrix[1][0] * x + matrix[1][1] * y + matrix[1][2])
+    return [min(xs), min(ys), max(xs), max(ys)]
+
+def scale_boxes(in_path, out_path, dpi, image_names, transforms=None):
+    """Convert a boxes file from PDF points to pixels of page images rendered at dpi.
+
+    transforms optionally holds, per page, the affine matrix an augmentation
+    moved the page image with (None for an unmoved page).
+    """
+    with open(in_path, encoding="utf-8") as f:
+        data = json.load(f)
+    scale = dpi / 72
+    for box in data["boxes"]:
+        pixels = [value * scale for value in box["box"]]
+        page = box["page"]
+        if transforms is not None and page < len(transforms) and transforms[page] is not None:
+            pixels = transform_box(pixels, transforms[page])
+        box["box"] = [round(value, 1) for value in pixels]
+        box["image"] = image_names[page] if page < len(image_names) else None
+    data["pages"] = {page: [round(value * scale) for value in size] for page, size in data["pages"].items()}
+    data.update(unit="px", dpi=dpi)
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
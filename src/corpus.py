@@ -0,0 +1,113 @@
+import os
+import mmap
+import argparse
+
+import numpy as np
+
+from .fill import escape_latex
+
+# Bytes scanned per step while building a line index
+_CHUNK_BYTES = 64 * 2 ** 20
+
+def index_path(path):
+    """Location of the line index that belongs to a corpus file."""
+    return path + ".lines.npy"
+
+def build_index(path):
+    """Scan a UTF-8 text file once and save the (start, end) byte span of every non-empty line.
+
+    Newlines are located with NumPy over large chunks, so indexing runs close
+    to disk speed. Returns the index array of shape (lines, 2).
+    """
+    newlines = []
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        base = 0
+        while True:
+            chunk = f.read(_CHUNK_BYTES)
+            if not chunk:
+                break
+            newlines.append(np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord("\n")) + base)
+            base += len(chunk)
+    ends = np.concatenate(newlines + [np.array([size], dtype=np.int64)]).astype(np.uint64)
+    starts = np.concatenate([np.array([0], dtype=np.uint64), ends[:-1] + 1])
+    spans = np.stack([starts, ends], axis=1)
+    spans = spans[spans[:, 1] > spans[:, 0]]
+    np.save(index_path(path), spans)
+    return spans
+
+def load_index(path):
+    """Memory-mapped line index of a corpus file, rebuilt if missing or stale."""
+    idx = index_path(path)
+    if not os.path.exists(idx) or os.path.getmtime(idx) < os.path.getmtime(path):
+        build_index(path)
+    return np.load(idx, mmap_mode="r")
+
+class MmapCorpus:
+    """Random snippets from a memory-mapped UTF-8 text file.
+
+    The file and its line index are mapped read-only, so every worker process
+    shares the same pages instead of holding its own copy of the corpus.
+    Snippets are length-bounded and escaped for LaTeX.
+    """
+
+    def __init__(self, path, max_chars=80, max_words=None):
+        self.path = path
+        self.max_chars = max_chars
+        self.max_words = max_words
+        self._open()
+
+    def _open(self):
+        self.spans = load_index(self.path)
+        if len(self.spans) == 0:
+            raise ValueError(f"corpus {self.path} has no non-empty lines")
+        with open(self.path, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __getstate__(self):
+        return {"path": self.path, "max_chars": self.max_chars, "max_words": self.max_words}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def __len__(self):
+        return len(self.spans)
+
+    def line(self, i):
+        """The i-th non-empty line, decoded but not escaped or cut."""
+        start, end = self.spans[i]
+        return self._data[start:end].decode("utf-8", errors="replace").strip()
+
+    def sample(self, rng, k):
+        """k snippets from lines drawn uniformly with a numpy Generator, O(1) each."""
+        lines = rng.integers(0, len(self.spans), size=k)
+        # Only the bytes a snippet can use are read from the mapping
+        spans = self.spans[lines]
+        starts = spans[:, 0]
+        ends = np.minimum(spans[:, 1], starts + 4 * self.max_chars)
+        if self.max_words is not None:
+            picks = rng.random((k, 2))
+        snippets = np.empty(k, dtype=object)
+        for j in range(k):
+            text = self._data[starts[j]:ends[j]].decode("utf-8", errors="ignore").strip()
+            if self.max_words is not None:
+                words = text.split()
+                count = 1 + int(picks[j, 0] * min(self.max_words, max(len(words), 1)))
+                first = int(picks[j, 1] * max(len(words) - count + 1, 1))
+                text = " ".join(words[first:first + count])
+            snippets[j] = escape_latex(text[:self.max_chars])
+        return snippets
+
+    def close(self):
+        self._data.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the line index of a text corpus for slot filling.")
+    parser.add_argument("path", help="UTF-8 text file, one snippet per line")
+    args = parser.parse_args()
+    spans = build_index(args.path)
+    print(f"Indexed {len(spans)} lines of {args.path} into {index_path(args.path)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import sys
+import json
+import argparse
+
+from .template_generator import BASE_TEMPLATES, COMPATIBLE_STRUCTURES, SHARD_SIZE, STRUCTURES, STYLE_NAMES, iter_templates
+
+# Odd 64-bit multipliers deriving one counter position per sketch row from a skeleton hash
+_ROW_MULTIPLIERS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93,
+                    0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53)
+_MASK = 2 ** 64 - 1
+
+def skeleton_key(record):
+    """64-bit hash of what makes a template's layout: base id, ordered structure ids and slot style ids.
+
+    Tuples of ints hash the same in every process, so keys are stable across runs.
+    """
+    return hash((record.base_id, tuple(record.structure_ids), tuple(record.styles))) & _MASK
+
+class SkeletonIndex:
+    """Approximate per-skeleton counts plus exact coverage tallies of a template stream.
+
+    Skeleton counts live in a count-min sketch of depth rows of 2**width_bits
+    byte counters (64 MiB by default), updated conservatively, so memory is
+    fixed however many templates pass. Counts may be overestimated, never
+    underestimated: with max_repeats, a rare template may be dropped as a
+    repeat it is not, at about false_positive_rate(). Coverage of bases,
+    structures, (base, structure) pairs and styles is counted exactly.
+    """
+
+    def __init__(self, max_repeats=None, width_bits=24, depth=4):
+        if max_repeats is not None and not 1 <= max_repeats <= 255:
+            raise ValueError("max_repeats must be between 1 and 255")
+        if not 1 <= depth <= len(_ROW_MULTIPLIERS):
+            raise ValueError(f"depth must be between 1 and {len(_ROW_MULTIPLIERS)}")
+        self.max_repeats = max_repeats
+        self.width_bits = width_bits
+        self._shift = 64 - width_bits
+        self._rows = [bytearray(2 ** width_bits) for _ in range(depth)]
+        self._used = [0] * depth
+        self.seen = 0
+        self.skipped = 0
+        self.distinct = 0
+        self.pairs = [[0] * len(STRUCTURES) for _ in BASE_TEMPLATES]
+        self.styles = [0] * (len(STYLE_NAMES) + 1)
+
+    def _positions(self, key):
+        return [((key * multiplier) & _MASK) >> self._shift for multiplier in _ROW_MULTIPLIERS[:len(self._rows)]]
+
+    def count(self, record):
+        """Estimated number of earlier admitted templates with the skeleton of record."""
+        return min(row[i] for row, i in zip(self._rows, self._positions(skeleton_key(record))))
+
+    def admit(self, record):
+        """Count record unless it would exceed max_repeats; return whether it was admitted."""
+        self.seen += 1
+        positions = self._positions(skeleton_key(record))
+        count = min(row[i] for row, i in zip(self._rows, positions))
+        if self.max_repeats is not None and count >= self.max_repeats:
+            self.skipped += 1
+            return False
+        if count == 0:
+            self.distinct += 1
+        if count < 255:
+            for k, (row, i) in enumerate(zip(self._rows, positions)):
+                if row[i] == count:  # conservative update: only the minimal counters grow
+                    if count == 0:
+                        self._used[k] += 1
+                    row[i] = count + 1
+        pairs = self.pairs[record.base_id]
+        for structure_id in record.structure_ids:
+            pairs[structure_id] += 1
+        for style_id in record.styles:
+            self.styles[style_id] += 1
+        return True
+
+    def filter(self, records):
+        """Yield the records admit() lets through."""
+        for record in records:
+            if self.admit(record):
+                yield record
+
+    def false_positive_rate(self):
+        """Chance that a new skeleton already looks seen, from how full the sketch rows are."""
+        rate = 1.0
+        for used in self._used:
+            rate *= used / 2 ** self.width_bits
+        return rate
+
+    def coverage(self):
+        """JSON-ready coverage statistics of the admitted templates."""
+        pairs = [(b, s) for b in range(len(BASE_TEMPLATES)) for s in range(len(STRUCTURES)) if self.pairs[b][s]]
+        compatible = sum(len(candidates) for candidates in COMPATIBLE_STRUCTURES)
+        compatible_seen = sum(1 for b, s in pairs if s in COMPATIBLE_STRUCTURES[b])
+        bases = sum(1 for counts in self.pairs if any(counts))
+        structures = sum(1 for s in range(len(STRUCTURES)) if any(counts[s] for counts in self.pairs))
+        return {
+            "seen": self.seen,
+            "admitted": self.seen - self.skipped,
+            "skipped_repeats": self.skipped,
+            "max_repeats": self.max_repeats,
+            "distinct_skeletons": self.distinct,
+            "false_positive_rate": self.false_positive_rate(),
+            "bases_seen": bases,
+            "bases_fraction": bases / len(BASE_TEMPLATES),
+            "structures_seen": structures,
+            "structures_fraction": structures / len(STRUCTURES),
+            "pairs_seen": len(pairs),
+            "pairs_fraction": len(pairs) / (len(BASE_TEMPLATES) * len(STRUCTURES)),
+            "compatible_pairs_fraction": compatible_seen / compatible,
+            "unseen_compatible_pairs": [[b + 1, s + 1] for b, candidates in enumerate(COMPATIBLE_STRUCTURES)
+                                        for s in candidates if not self.pairs[b][s]],
+            "slots_by_style": dict(zip(["plain"] + STYLE_NAMES, self.styles)),
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Report skeleton repeats and coverage of a template stream "
+                                                 "without writing or scanning any output.")
+    parser.add_argument("--count", type=int, default=100000, help="Templates to sample")
+    parser.add_argument("--seed", type=int, default=0, help="Master seed")
+    parser.add_argument("--start", type=int, default=0, help="Index of the first template")
+    parser.add_argument("--weights", help="JSON file of base, structure and style weights and category quotas; quotas are "
+                             f"exact per shard of {SHARD_SIZE} templates, so over --start/--count only when "
+                             "both are multiples of it")
+    parser.add_argument("--max-repeats", type=int, help="Drop templates whose skeleton was admitted this many times")
+    args = parser.parse_args()
+
+    sampler = None
+    if args.weights is not None:
+        from .sampling import load_sampler, quota_warning
+
+        sampler = load_sampler(args.weights)
+        warning = quota_warning(sampler, args.start, args.count)
+        if warning is not None:
+            print(warning, file=sys.stderr)
+    index = SkeletonIndex(args.max_repeats)
+    for _ in index.filter(iter_templates(args.seed, args.count, args.start, sampler)):
+        pass
+    print(json.dumps(index.coverage(), indent=2))
+
+if __name__ == "__main__":
+    main()
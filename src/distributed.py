@@ -0,0 +1,466 @@
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import argparse
+import subprocess
+
+# Commands a job can run over its shards, as modules of this package
+KINDS = {"templates": "template_generator", "render": "render"}
+
+# Options every shard run sets itself
+MANAGED_OPTIONS = ("--out-dir", "--start", "--count", "--seed", "--resume")
+
+# Aggregated description of a finished job, written to its output directory
+FINAL_MANIFEST_NAME = "job_manifest.json"
+
+# SQLite journal mode of the shard build manifests: WAL relies on shared memory, which the
+# shared file systems a job runs on (NFS and the like) do not provide across hosts
+SHARED_JOURNAL_MODE = "DELETE"
+
+# Attempts of a shard before it is given up as failed
+MAX_ATTEMPTS = 3
+
+def shard_dir(out_dir, shard):
+    """Output directory of one shard of a job."""
+    return os.path.join(out_dir, f"shard_{shard:06d}")
+
+def _write_json(path, data):
+    """Write JSON so that readers see either nothing or the whole file."""
+    partial = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(partial, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(partial, path)
+
+def _create_json(path, data):
+    """Create path holding data unless it exists; return whether this call created it.
+
+    The file is written under a unique name and hard-linked into place, which
+    is atomic and exclusive on local and NFS file systems alike.
+    """
+    partial = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(partial, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    try:
+        os.link(partial, path)
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        os.unlink(partial)
+
+def _read_json(path):
+    """Contents of a JSON file, or None if it does not exist (any more)."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+class Lease:
+    """Claim of one worker on one shard, kept alive by touching the lease file."""
+
+    def __init__(self, queue, shard, token):
+        self.queue = queue
+        self.shard = shard
+        self.token = token
+        self.path = queue.lease_path(shard)
+
+    def held(self):
+        record = _read_json(self.path)
+        return record is not None and record["token"] == self.token
+
+    def renew(self):
+        """Heartbeat: refresh the lease if it is still ours; return whether it is."""
+        if not self.held():
+            return False
+        try:
+            os.utime(self.path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def release(self):
+        if self.held():
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+class WorkQueue:
+    """Shard descriptors, leases and results of a job in a directory every node can reach.
+
+    Layout: job.json describes the job; shards/NNNNNN.json the seed range
+    of each shard; leases/NNNNNN.lease the worker holding a shard, whose
+    modification time is its last heartbeat; done/NNNNNN.json the outcome of
+    a finished shard; failures/ one file per failed attempt. Every file is
+    created by an atomic rename or link, so readers never see half of one.
+
+    A lease older than lease_seconds belongs to a stalled or dead worker
+    and may be reclaimed by anyone. Ages are measured on the clock of the
+    file system (through a touched file), so nodes need not agree on time.
+    """
+
+    def __init__(self, path, worker=None):
+        self.path = path
+        self.worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+        self._clock = os.path.join(path, "clocks", self.worker)
+
+    def _dir(self, name):
+        return os.path.join(self.path, name)
+
+    def shard_path(self, shard):
+        return os.path.join(self._dir("shards"), f"{shard:06d}.json")
+
+    def lease_path(self, shard):
+        return os.path.join(self._dir("leases"), f"{shard:06d}.lease")
+
+    def done_path(self, shard):
+        return os.path.join(self._dir("done"), f"{shard:06d}.json")
+
+    def log_path(self, shard):
+        return os.path.join(self._dir("logs"), f"{shard:06d}.{self.worker}.log")
+
+    def now(self):
+        """Current time of the shared file system."""
+        os.makedirs(os.path.dirname(self._clock), exist_ok=True)
+        with open(self._clock, "a"):
+            pass
+        os.utime(self._clock)
+        return os.stat(self._clock).st_mtime
+
+    def job(self):
+        """The job description, or None if no job was submitted yet."""
+        return _read_json(os.path.join(self.path, "job.json"))
+
+    def submit(self, job):
+        """Write the shard descriptors of job, then job.json; return the number of shards.
+
+        Submitting the job a queue already holds again is a no-op, so a
+        restarted coordinator picks up where it was.
+        """
+        current = self.job()
+        if current is not None:
+            if current != json.loads(json.dumps(job)):
+                raise ValueError(f"{self.path} already holds a different job: {json.dumps(current)}")
+            return current["shards"]
+        for name in ("shards", "leases", "done", "failures", "logs", "clocks"):
+            os.makedirs(self._dir(name), exist_ok=True)
+        stop = job["start"] + job["count"]
+        for shard, lo in enumerate(range(job["start"], stop, job["shard_size"])):
+            count = min(job["shard_size"], stop - lo)
+            _write_json(self.shard_path(shard), {
+                "shard": shard, "seed": job["seed"], "start": lo, "stop": lo + count, "count": count,
+                "kind": job["kind"], "args": job["args"], "out_dir": shard_dir(job["out_dir"], shard),
+            })
+        _write_json(os.path.join(self.path, "job.json"), job)
+        return job["shards"]
+
+    def descriptor(self, shard):
+        return _read_json(self.shard_path(shard))
+
+    def done(self):
+        """Map shard -> outcome record of every finished shard."""
+        done = {}
+        for name in os.listdir(self._dir("done")):
+            if name.endswith(".json"):
+                record = _read_json(os.path.join(self._dir("done"), name))
+                if record is not None:
+                    done[record["shard"]] = record
+        return done
+
+    def leases(self):
+        """Map shard -> (lease record, seconds since its last heartbeat)."""
+        now = self.now()
+        leases = {}
+        for name in os.listdir(self._dir("leases")):
+            if not name.endswith(".lease"):
+                continue
+            path = os.path.join(self._dir("leases"), name)
+            try:
+                age = now - os.stat(path).st_mtime
+            except FileNotFoundError:
+                continue
+            record = _read_json(path)
+            if record is not None:
+                leases[record["shard"]] = (record, age)
+        return leases
+
+    def attempts(self, shard):
+        prefix = f"{shard:06d}."
+        return sum(1 for name in os.listdir(self._dir("failures")) if name.startswith(prefix))
+
+    def claim(self, shard):
+        """Lease on shard if it is neither finished nor held by another worker, else None."""
+        if os.path.exists(self.done_path(shard)):
+            return None
+        token = uuid.uuid4().hex
+        record = {"shard": shard, "worker": self.worker, "token": token, "claimed": time.time()}
+        if not _create_json(self.lease_path(shard), record):
+            return None
+        lease = Lease(self, shard, token)
+        if os.path.exists(self.done_path(shard)):  # finished between the check and the claim
+            lease.release()
+            return None
+        return lease
+
+    def reclaim_stale(self, lease_seconds):
+        """Break the leases whose holders missed their heartbeats; return the shards freed.
+
+        A lease is moved aside by rename, which only one reclaimer can win.
+        If what was moved turns out to be a fresh lease taken in the
+        meantime, it is linked back; should that fail, its holder notices the
+        lost lease at its next heartbeat and gives the shard up.
+        """
+        freed = []
+        for shard, (record, age) in self.leases().items():
+            if age <= lease_seconds:
+                continue
+            path = self.lease_path(shard)
+            moved = f"{path}.{uuid.uuid4().hex}.stale"
+            try:
+                os.rename(path, moved)
+            except FileNotFoundError:
+                continue
+            taken = _read_json(moved)
+            if taken is not None and taken["token"] != record["token"]:
+                try:
+                    os.link(moved, path)
+                except FileExistsError:
+                    pass
+            else:
+                freed.append(shard)
+            os.unlink(moved)
+        return freed
+
+    def complete(self, lease, outcome):
+        """Record the outcome of a leased shard and drop the lease."""
+        _create_json(self.done_path(lease.shard), dict(outcome, shard=lease.shard, worker=self.worker))
+        lease.release()
+
+    def fail(self, lease, outcome):
+        """Record a failed attempt and drop the lease; the shard is given up after MAX_ATTEMPTS."""
+        path = os.path.join(self._dir("failures"), f"{lease.shard:06d}.{lease.token}.json")
+        _write_json(path, dict(outcome, shard=lease.shard, worker=self.worker))
+        if self.attempts(lease.shard) >= MAX_ATTEMPTS:
+            self.complete(lease, dict(outcome, status="failed"))
+        else:
+            lease.release()
+
+def shard_command(descriptor):
+    """Command line generating or rendering the samples of one shard."""
+    module = f"{__package__}.{KINDS[descriptor['kind']]}"
+    return [
+        sys.executable, "-m", module, "--out-dir", descriptor["out_dir"], "--start", str(descriptor["start"]),
+        "--count", str(descriptor["count"]), "--seed", str(descriptor["seed"]), "--resume", *descriptor["args"],
+    ]
+
+def _die_with_parent():
+    """Have the kernel kill a shard process when its worker dies, so no orphan writes into a reclaimed shard."""
+    try:
+        import ctypes
+
+        ctypes.CDLL(None).prctl(1, 9)  # PR_SET_PDEATHSIG, SIGKILL
+    except (OSError, AttributeError):  # not Linux
+        pass
+
+def _build_summary(out_dir):
+    """Samples by status in the build manifest of a shard."""
+    from .manifest import BuildManifest
+
+    config = BuildManifest.stored_config(out_dir)
+    if config is None:
+        return {}
+    with BuildManifest.open(out_dir, config, journal_mode=SHARED_JOURNAL_MODE) as manifest:
+        return manifest.summary()
+
+def run_shard(queue, lease, lease_seconds):
+    """Run one leased shard to completion, renewing the lease; the child is killed if the lease is lost.
+
+    Shards run with --resume, so a shard taken over from a dead worker
+    continues from what that worker had finished; their build manifests
+    use SHARED_JOURNAL_MODE. A stalled worker may
+    still be writing when its shard is taken over; both write the same
+    deterministic outputs, and only the first outcome is recorded.
+    """
+    from .manifest import JOURNAL_ENV
+
+    descriptor = queue.descriptor(lease.shard)
+    os.makedirs(descriptor["out_dir"], exist_ok=True)
+    env = dict(os.environ, **{JOURNAL_ENV: SHARED_JOURNAL_MODE})
+    started = time.time()
+    with open(queue.log_path(lease.shard), "w", encoding="utf-8") as log:
+        proc = subprocess.Popen(shard_command(descriptor), stdout=log, stderr=subprocess.STDOUT,
+                                stdin=subprocess.DEVNULL, env=env, preexec_fn=_die_with_parent)
+        lost = False
+        while True:
+            try:
+                proc.wait(timeout=lease_seconds / 4)
+                break
+            except subprocess.TimeoutExpired:
+                if not lease.renew():
+                    lost = True
+                    proc.kill()
+    outcome = {"returncode": proc.returncode, "seconds": round(time.time() - started, 3),
+               "attempt": queue.attempts(lease.shard) + 1, "log": queue.log_path(lease.shard)}
+    if lost:
+        return "lost"
+    if proc.returncode != 0:
+        queue.fail(lease, dict(outcome, status="error"))
+        return "error"
+    queue.complete(lease, dict(outcome, status="ok", samples=_build_summary(descriptor["out_dir"])))
+    return "ok"
+
+def work(queue, poll=1.0, max_shards=None):
+    """Claim and run shards until every shard is finished (or max_shards ran); return how many ran.
+
+    Workers wait for a job to be submitted, reclaim stalled leases
+    themselves and start their search at a worker-specific shard, so they
+    rarely race for the same lease.
+    """
+    while queue.job() is None:
+        time.sleep(poll)
+    job = queue.job()
+    shards = list(range(job["shards"]))
+    offset = hash(queue.worker) % max(len(shards), 1)
+    shards = shards[offset:] + shards[:offset]
+    ran = 0
+    while max_shards is None or ran < max_shards:
+        done = queue.done()
+        if len(done) == len(shards):
+            break
+        queue.reclaim_stale(job["lease_seconds"])
+        held = queue.leases()
+        for shard in shards:
+            if shard in done or shard in held:
+                continue
+            lease = queue.claim(shard)
+            if lease is not None:
+                status = run_shard(queue, lease, job["lease_seconds"])
+                print(f"{queue.worker}: shard {shard}: {status}", flush=True)
+                ran += 1
+                break
+        else:
+            time.sleep(poll)
+    return ran
+
+def aggregate(queue):
+    """Write and return the final manifest of a finished job, merging the shard annotations."""
+    job = queue.job()
+    done = queue.done()
+    shards, samples = [], {}
+    for shard in range(job["shards"]):
+        outcome = done[shard]
+        descriptor = queue.descriptor(shard)
+        shards.append(dict(outcome, start=descriptor["start"], stop=descriptor["stop"], out_dir=descriptor["out_dir"]))
+        for status, n in outcome.get("samples", {}).items():
+            samples[status] = samples.get(status, 0) + n
+    manifest = {
+        "job": job,
+        "samples": samples,
+        "failed_shards": [shard["shard"] for shard in shards if shard["status"] != "ok"],
+        "annotations": _merge_annotations(job, shards),
+        "shards": shards,
+    }
+    _write_json(os.path.join(job["out_dir"], FINAL_MANIFEST_NAME), manifest)
+    return manifest
+
+def _merge_annotations(job, shards):
+    """Concatenate the annotations.npz of every shard in index order; return the merged path, if any."""
+    from .annotations import ANNOTATIONS_NAME, Annotations, merge_columns, save_annotations
+
+    paths = [os.path.join(shard["out_dir"], ANNOTATIONS_NAME) for shard in shards]
+    if not paths or not all(os.path.exists(path) for path in paths):
+        return None
+    path = os.path.join(job["out_dir"], ANNOTATIONS_NAME)
+    save_annotations(path, merge_columns(Annotations(shard_path).columns for shard_path in paths))
+    return path
+
+def coordinate(queue, job, poll=5.0, stream=sys.stderr):
+    """Submit job, reclaim stalled shards until every shard is finished, then aggregate."""
+    total = queue.submit(job)
+    lease_seconds = queue.job()["lease_seconds"]
+    while True:
+        done = queue.done()
+        for shard in queue.reclaim_stale(lease_seconds):
+            print(f"reclaimed stalled shard {shard}", file=stream, flush=True)
+        if len(done) == total:
+            break
+        failed = sum(1 for outcome in done.values() if outcome["status"] != "ok")
+        print(f"{len(done)}/{total} shards done ({failed} failed), {len(queue.leases())} leased",
+              file=stream, flush=True)
+        time.sleep(poll)
+    return aggregate(queue)
+
+def main():
+    parser = argparse.ArgumentParser(description="Spread generation or rendering over machines through a "
+                                                 "shared directory of shard descriptors and leases.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    coordinator = commands.add_parser("coordinate", help="Submit a job, reclaim stalled shards and write the "
+                                                         "final manifest once every shard is done",
+                                      epilog="Options after -- are passed to the command of every shard, "
+                                             "e.g. -- --format jsonl --annotations")
+    coordinator.add_argument("queue_dir", help="Directory shared by the coordinator and every worker")
+    coordinator.add_argument("--kind", choices=KINDS, default="templates", help="Command run for each shard")
+    coordinator.add_argument("--out-dir", required=True, help="Shared output directory; shard k writes to "
+                                                              "shard_NNNNNN inside it")
+    coordinator.add_argument("--count", type=int, required=True, help="Number of samples of the job")
+    coordinator.add_argument("--start", type=int, default=0, help="Index of the first sample")
+    coordinator.add_argument("--seed", type=int, default=0, help="Master seed")
+    coordinator.add_argument("--shard-size", type=int, default=10000, help="Samples per shard")
+    coordinator.add_argument("--lease-seconds", type=float, default=60,
+                             help="Heartbeat age after which a shard counts as stalled and is reclaimed")
+    coordinator.add_argument("--poll", type=float, default=5.0, help="Seconds between progress checks")
+    worker = commands.add_parser("work", help="Claim and run shards until the job is done")
+    worker.add_argument("queue_dir", help="Directory shared by the coordinator and every worker")
+    worker.add_argument("--worker-id", help="Name of this worker (default: host-pid)")
+    worker.add_argument("--poll", type=float, default=1.0, help="Seconds between looks for claimable shards")
+    worker.add_argument("--max-shards", type=int, help="Exit after running this many shards")
+    status = commands.add_parser("status", help="Print the progress of a job")
+    status.add_argument("queue_dir", help="Directory shared by the coordinator and every worker")
+    argv, extra = sys.argv[1:], []
+    if "--" in argv:
+        argv, extra = argv[:argv.index("--")], argv[argv.index("--") + 1:]
+    args = parser.parse_args(argv)
+
+    if args.command == "coordinate":
+        managed = [option for option in extra if option.split("=")[0] in MANAGED_OPTIONS]
+        if managed:
+            parser.error(f"the coordinator sets {', '.join(managed)} for every shard itself")
+        if args.count < 0 or args.shard_size <= 0:
+            parser.error("--count must be non-negative and --shard-size positive")
+        job = {
+            "kind": args.kind, "seed": args.seed, "start": args.start, "count": args.count,
+            "shard_size": args.shard_size, "shards": -(-args.count // args.shard_size),
+            "lease_seconds": args.lease_seconds, "out_dir": os.path.abspath(args.out_dir), "args": extra,
+        }
+        queue = WorkQueue(args.queue_dir, "coordinator")
+        try:
+            manifest = coordinate(queue, job, args.poll)
+        except ValueError as e:
+            parser.error(str(e))
+        print(f"{len(manifest['shards'])} shards, samples by status: "
+              + (", ".join(f"{status} {n}" for status, n in manifest["samples"].items()) or "none"))
+        if manifest["failed_shards"]:
+            print(f"Failed shards: {manifest['failed_shards']}")
+        print(f"Final manifest: {os.path.join(job['out_dir'], FINAL_MANIFEST_NAME)}")
+    elif args.command == "work":
+        queue = WorkQueue(args.queue_dir, args.worker_id)
+        ran = work(queue, args.poll, args.max_shards)
+        print(f"{queue.worker}: ran {ran} shards")
+    else:
+        queue = WorkQueue(args.queue_dir, "status")
+        job = queue.job()
+        if job is None:
+            parser.error(f"no job in {args.queue_dir}")
+        done = queue.done()
+        failed = sum(1 for outcome in done.values() if outcome["status"] != "ok")
+        print(f"{job['kind']} job of {job['count']} samples in {job['shards']} shards: {len(done)} done "
+              f"({failed} failed)")
+        for shard, (record, age) in sorted(queue.leases().items()):
+            print(f"shard {shard}: {record['worker']}, heartbeat {age:.0f}s ago")
+
+if __name__ == "__main__":
+    main()
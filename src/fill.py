@@ -0,0 +1,93 @@
+from contextlib import nullcontext
+
+import numpy as np
+
+# LaTeX special characters and their escaped forms
+LATEX_ESCAPES = {
+    "\\": r"\textbackslash{}",
+    "&": r"\&",
+    "%": r"\%",
+    "$": r"\$",
+    "#": r"\#",
+    "_": r"\_",
+    "{": r"\{",
+    "}": r"\}",
+    "~": r"\textasciitilde{}",
+    "^": r"\textasciicircum{}",
+}
+_ESCAPE_TABLE = str.maketrans(LATEX_ESCAPES)
+
+# Records whose snippets are drawn together; batches start at multiples of it from the first record
+FILL_BATCH_SIZE = 1024
+
+def escape_latex(text):
+    """Escape LaTeX special characters so text can be placed in any slot."""
+    return text.translate(_ESCAPE_TABLE)
+
+class ListCorpus:
+    """In-memory corpus of escaped snippets, sampled with NumPy index draws."""
+
+    def __init__(self, snippets):
+        self.snippets = np.array([escape_latex(snippet) for snippet in snippets], dtype=object)
+        if len(self.snippets) == 0:
+            raise ValueError("corpus is empty")
+
+    @classmethod
+    def from_file(cls, path, max_chars=80):
+        """Corpus of the non-empty lines of a UTF-8 text file, cut to max_chars."""
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return cls(line.strip()[:max_chars] for line in f if line.strip())
+
+    def __len__(self):
+        return len(self.snippets)
+
+    def sample(self, rng, k):
+        """k snippets drawn uniformly with a numpy Generator, in one vectorized gather."""
+        return self.snippets[rng.integers(0, len(self.snippets), size=k)]
+
+def fill_template(text, slots, snippets):
+    """Replace every slot span of text with its snippet in a single pass.
+
+    Returns the filled text and the (start, end) spans of the snippets in it.
+    """
+    parts, spans = [], []
+    position = length = 0
+    for (start, end), snippet in zip(slots, snippets):
+        parts.append(text[position:start])
+        length += start - position
+        parts.append(snippet)
+        spans.append((length, length + len(snippet)))
+        length += len(snippet)
+        position = end
+    parts.append(text[position:])
+    return "".join(parts), tuple(spans)
+
+def _fill_batch(batch, corpus, seed):
+    rng = np.random.default_rng([seed, batch[0].index or 0])
+    counts = [len(record.slots) for record in batch]
+    snippets = corpus.sample(rng, sum(counts))
+    position = 0
+    for record, count in zip(batch, counts):
+        text, slots = fill_template(record.text, record.slots, snippets[position:position + count])
+        position += count
+        yield record._replace(text=text, slots=slots)
+
+def fill_records(records, corpus, seed=0, batch_size=FILL_BATCH_SIZE, metrics=None):
+    """Yield records with every slot filled from corpus.
+
+    Snippets for batch_size records are drawn in one call, seeded by seed and
+    the index of the first record, so a given record stream fills the same way
+    on every run. With metrics, every batch is timed as stage "fill_batch".
+    """
+    def filled(batch):
+        with metrics.timer("fill_batch") if metrics is not None else nullcontext():
+            return list(_fill_batch(batch, corpus, seed))
+
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield from filled(batch)
+            batch = []
+    if batch:
+        yield from filled(batch)
@@ -0,0 +1,278 @@
+import sys
+import json
+import math
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+from collections import defaultdict
+
+# Latency histogram buckets: bucket b counts durations in [2^(b-1), 2^b) microseconds
+_BUCKETS = 40
+
+PROFILERS = ("cprofile", "pyinstrument")
+
+class Histogram:
+    """Log2-bucketed latency histogram with count, sum and max."""
+
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * _BUCKETS
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        micros = seconds * 1e6
+        self.buckets[min(_BUCKETS - 1, 0 if micros < 1 else int(math.log2(micros)) + 1)] += 1
+
+    def merge(self, other):
+        self.count += other["count"]
+        self.total += other["total"]
+        self.max = max(self.max, other["max"])
+        self.buckets = [a + b for a, b in zip(self.buckets, other["buckets"])]
+
+    def quantile(self, q):
+        """Upper bound of the q-quantile in seconds, from the buckets."""
+        rank, seen = q * self.count, 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min(2 ** bucket / 1e6, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {"count": self.count, "total": self.total, "max": self.max, "buckets": list(self.buckets)}
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_seconds": self.total / self.count if self.count else None,
+            "p50_seconds": self.quantile(0.5),
+            "p90_seconds": self.quantile(0.9),
+            "p99_seconds": self.quantile(0.99),
+            "max_seconds": self.max,
+        }
+
+class Timing:
+    __slots__ = ("key",)
+
+    def __init__(self, key=None):
+        self.key = key
+
+class Metrics:
+    """Thread-safe counters, per-stage and per-key latency histograms, queue gauges and failures.
+
+    Instrumented functions take an optional metrics argument and skip every
+    hook when it is None, so disabled instrumentation costs one comparison.
+    Worker processes record into their own Metrics and send snapshot() back
+    to be merged.
+    """
+
+    def __init__(self, profile_stage=None, profiler="cprofile"):
+        self.started = time.perf_counter()
+        self.counters = defaultdict(int)
+        self.stages = defaultdict(Histogram)
+        self.keyed = defaultdict(Histogram)
+        self.gauges = {}
+        self.failures = defaultdict(int)
+        self.profile_stage = profile_stage
+        self.profiler = None if profile_stage is None else _Profiler(profiler)
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, key=None):
+        """Record one item of stage that took seconds; key is e.g. its base template."""
+        with self._lock:
+            self.stages[stage].add(seconds)
+            if key is not None:
+                self.keyed[stage, key].add(seconds)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def failure(self, stage, cause):
+        """Count a failed item of stage by a short cause such as its first error line."""
+        with self._lock:
+            self.failures[stage, str(cause).splitlines()[0][:80] if cause else "unknown"] += 1
+
+    def gauge(self, name, value):
+        """Set a level such as a queue depth, keeping its maximum."""
+        with self._lock:
+            _, peak = self.gauges.get(name, (0, 0))
+            self.gauges[name] = (value, max(peak, value))
+
+    @contextmanager
+    def timer(self, stage, key=None):
+        """Time the block as one item of stage, profiling it if stage is the profiled one.
+
+        Yields a Timing whose key may be set inside the block once it is known.
+        """
+        timing = Timing(key)
+        started = time.perf_counter()
+        with self.profiler.region() if stage == self.profile_stage else nullcontext():
+            yield timing
+        self.observe(stage, time.perf_counter() - started, timing.key)
+
+    def snapshot(self):
+        """Picklable state, for merging the metrics of worker processes."""
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "stages": {stage: h.snapshot() for stage, h in self.stages.items()},
+                "keyed": {key: h.snapshot() for key, h in self.keyed.items()},
+                "gauges": dict(self.gauges),
+                "failures": dict(self.failures),
+            }
+
+    def merge(self, snapshot):
+        if not snapshot:
+            return
+        with self._lock:
+            for name, n in snapshot["counters"].items():
+                self.counters[name] += n
+            for stage, h in snapshot["stages"].items():
+                self.stages[stage].merge(h)
+            for key, h in snapshot["keyed"].items():
+                self.keyed[key].merge(h)
+            for name, (value, peak) in snapshot["gauges"].items():
+                self.gauges[name] = (value, max(peak, self.gauges.get(name, (0, 0))[1]))
+            for key, n in snapshot["failures"].items():
+                self.failures[key] += n
+
+    def progress_line(self):
+        elapsed = time.perf_counter() - self.started
+        with self._lock:
+            parts = [f"{stage} {h.count} ({h.count / max(elapsed, 1e-9):.1f}/s)" for stage, h in self.stages.items()]
+            failed = sum(self.failures.values())
+            queues = [f"{name} {value}" for name, (value, _) in self.gauges.items()]
+        line = f"[{elapsed:7.0f}s] " + " | ".join(parts or ["starting"])
+        if failed:
+            line += f" | failed {failed}"
+        if queues:
+            line += " | queues " + ", ".join(queues)
+        return line
+
+    def report(self):
+        """JSON-ready summary of everything recorded so far."""
+        elapsed = time.perf_counter() - self.started
+        with self._lock:
+            per_key = defaultdict(dict)
+            for (stage, key), h in sorted(self.keyed.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+                per_key[stage][str(key)] = h.summary()
+            failures = defaultdict(dict)
+            for (stage, cause), n in self.failures.items():
+                failures[stage][cause] = n
+            return {
+                "elapsed_seconds": elapsed,
+                "stages": {
+                    stage: dict(h.summary(), per_second=h.count / max(elapsed, 1e-9))
+                    for stage, h in self.stages.items()
+                },
+                "per_key": dict(per_key),
+                "counters": dict(self.counters),
+                "queues": {name: {"current": value, "max": peak} for name, (value, peak) in self.gauges.items()},
+                "failures": dict(failures),
+            }
+
+class _Profiler:
+    """cProfile or pyinstrument around the regions of a single stage.
+
+    Regions entered by several threads at once are profiled one at a time;
+    the others run unprofiled.
+    """
+
+    def __init__(self, kind="cprofile"):
+        if kind not in PROFILERS:
+            raise ValueError(f"Unknown profiler: {kind}")
+        self.kind = kind
+        if kind == "pyinstrument":
+            from pyinstrument import Profiler
+
+            self._profiler = Profiler()
+        else:
+            import cProfile
+
+            self._profiler = cProfile.Profile()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def region(self):
+        if not self._lock.acquire(blocking=False):
+            yield
+            return
+        try:
+            if self.kind == "pyinstrument":
+                self._profiler.start()
+            else:
+                self._profiler.enable()
+            try:
+                yield
+            finally:
+                if self.kind == "pyinstrument":
+                    self._profiler.stop()
+                else:
+                    self._profiler.disable()
+        finally:
+            self._lock.release()
+
+    def save(self, path):
+        """Write pstats data (cprofile) or an HTML report (pyinstrument) to path."""
+        if self.kind == "pyinstrument":
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self._profiler.output_html())
+        else:
+            self._profiler.dump_stats(path)
+
+class ProgressReporter:
+    """Background thread printing the progress line of metrics every interval seconds."""
+
+    def __init__(self, metrics, interval=10.0, stream=sys.stderr):
+        self.metrics = metrics
+        self.interval = interval
+        self.stream = stream
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            print(self.metrics.progress_line(), file=self.stream, flush=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        print(self.metrics.progress_line(), file=self.stream, flush=True)
+
+def add_arguments(parser):
+    """Add the instrumentation options to an argparse parser."""
+    group = parser.add_argument_group("instrumentation")
+    group.add_argument("--progress", type=float, metavar="SECONDS",
+                       help="Print a throughput line every SECONDS (enables instrumentation)")
+    group.add_argument("--report", metavar="PATH", help="Write a JSON report of all stages (enables instrumentation)")
+    group.add_argument("--profile", metavar="STAGE",
+                       help="Profile one stage, e.g. generate or compile, in this process (use --workers 1)")
+    group.add_argument("--profiler", choices=PROFILERS, default="cprofile", help="Profiler used by --profile")
+    group.add_argument("--profile-out", metavar="PATH", default="profile.out",
+                       help="Where --profile writes pstats data (cprofile) or HTML (pyinstrument)")
+
+@contextmanager
+def from_args(args):
+    """Metrics as the options ask for (None if disabled) for the block, reported after it."""
+    if args.progress is None and args.report is None and args.profile is None:
+        yield None
+        return
+    metrics = Metrics(args.profile, args.profiler)
+    with ProgressReporter(metrics, args.progress) if args.progress else nullcontext():
+        yield metrics
+    if args.report is not None:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(metrics.report(), f, indent=2)
+    if metrics.profiler is not None:
+        metrics.profiler.save(args.profile_out)
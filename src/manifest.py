@@ -0,0 +1,159 @@
+import os
+import json
+import random
+import time
+import sqlite3
+import argparse
+from contextlib import closing
+
+# Build manifest kept in the output directory of a resumable build
+BUILD_MANIFEST_NAME = "build.sqlite"
+
+# Environment variable setting the SQLite journal mode of build manifests. WAL (the default)
+# needs shared memory that network filesystems do not provide; builds writing to one use DELETE.
+JOURNAL_ENV = "SYNTHLATEX_MANIFEST_JOURNAL"
+
+# Status of a sample whose outputs are all written; other statuses are redone on resume
+DONE = "ok"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS build (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS samples (
+    id INTEGER PRIMARY KEY,
+    seed INTEGER NOT NULL,
+    base_id INTEGER NOT NULL,
+    structure_ids TEXT NOT NULL,
+    output TEXT,
+    status TEXT NOT NULL,
+    error TEXT,
+    updated REAL NOT NULL
+);
+"""
+
+def build_seed(out_dir, seed=None):
+    """seed if given, else the seed of the build recorded in out_dir, else a fresh random one."""
+    if seed is not None:
+        return seed
+    config = BuildManifest.stored_config(out_dir)
+    if config is not None:
+        return config["seed"]
+    return random.randrange(2 ** 32)
+
+class BuildManifest:
+    """SQLite index of every sample a build has produced, for resuming it after a crash.
+
+    One row per sample id holds the master seed, base and structure ids,
+    output location and status. Rows are buffered and committed every
+    commit_every rows or commit_seconds, whichever comes first, so a crash
+    loses at most that much bookkeeping; outputs without a row are simply
+    written again.
+
+    config describes how the build draws its samples (seed, sampler, output
+    format). A manifest only resumes a build with the same config.
+
+    journal_mode is the SQLite journal mode, by default taken from the
+    JOURNAL_ENV environment variable, else WAL.
+    """
+
+    def __init__(self, path, config, commit_every=1000, commit_seconds=1.0, journal_mode=None):
+        self.path = path
+        self.commit_every = commit_every
+        self.commit_seconds = commit_seconds
+        if journal_mode is None:
+            journal_mode = os.environ.get(JOURNAL_ENV, "WAL")
+        if journal_mode.upper() not in ("WAL", "DELETE", "TRUNCATE", "PERSIST"):
+            raise ValueError(f"Unsupported journal mode: {journal_mode}")
+        self._db = sqlite3.connect(path)
+        self._db.execute(f"PRAGMA journal_mode={journal_mode}")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._pending = []
+        self._committed = time.monotonic()
+        row = self._db.execute("SELECT value FROM build WHERE key = 'config'").fetchone()
+        if row is None:
+            with self._db:
+                self._db.execute("INSERT INTO build VALUES ('config', ?)", (json.dumps(config, sort_keys=True),))
+        elif json.loads(row[0]) != json.loads(json.dumps(config)):
+            self._db.close()
+            raise ValueError(f"{path} belongs to a build with different settings: {row[0]}")
+        self.config = config
+
+    @classmethod
+    def open(cls, out_dir, config, journal_mode=None):
+        """Manifest of the build in out_dir, created if there is none yet."""
+        os.makedirs(out_dir, exist_ok=True)
+        return cls(os.path.join(out_dir, BUILD_MANIFEST_NAME), config, journal_mode=journal_mode)
+
+    @staticmethod
+    def stored_config(out_dir):
+        """Config of the build recorded in out_dir, or None if there is none."""
+        path = os.path.join(out_dir, BUILD_MANIFEST_NAME)
+        if not os.path.exists(path):
+            return None
+        with closing(sqlite3.connect(path)) as db:
+            row = db.execute("SELECT value FROM build WHERE key = 'config'").fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def add(self, index, base_id, structure_ids, output, status=DONE, error=None):
+        """Record the outcome of one sample, replacing any earlier one."""
+        self._pending.append((index, self.config["seed"], base_id, json.dumps(list(structure_ids)), output,
+                              status, error, time.time()))
+        if len(self._pending) >= self.commit_every or time.monotonic() - self._committed >= self.commit_seconds:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?, ?, ?, ?, ?)", self._pending)
+            self._pending = []
+        self._committed = time.monotonic()
+
+    def done(self, start, stop):
+        """Set of the sample ids in [start, stop) that are complete."""
+        self.flush()
+        rows = self._db.execute("SELECT id FROM samples WHERE id >= ? AND id < ? AND status = ?", (start, stop, DONE))
+        return {index for index, in rows}
+
+    def count_done(self, start, stop):
+        self.flush()
+        return self._db.execute("SELECT COUNT(*) FROM samples WHERE id >= ? AND id < ? AND status = ?",
+                                (start, stop, DONE)).fetchone()[0]
+
+    def failed(self):
+        """(id, status, error) of every recorded sample that did not complete."""
+        self.flush()
+        return self._db.execute("SELECT id, status, error FROM samples WHERE status != ? ORDER BY id", (DONE,)).fetchall()
+
+    def summary(self):
+        """Number of samples by status."""
+        self.flush()
+        return dict(self._db.execute("SELECT status, COUNT(*) FROM samples GROUP BY status ORDER BY status"))
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the build manifest of an output directory.")
+    parser.add_argument("out_dir", help="Output directory of a build run with --resume")
+    parser.add_argument("--failed", action="store_true", help="Also list the samples that did not complete")
+    args = parser.parse_args()
+
+    config = BuildManifest.stored_config(args.out_dir)
+    if config is None:
+        parser.error(f"no {BUILD_MANIFEST_NAME} in {args.out_dir}")
+    with BuildManifest.open(args.out_dir, config) as manifest:
+        print(f"Build settings: {json.dumps(config, sort_keys=True)}")
+        print("Samples by status: " + ", ".join(f"{status} {n}" for status, n in manifest.summary().items()))
+        if args.failed:
+            for index, status, error in manifest.failed():
+                print(f"{index}: {status}: {error}")
+
+if __name__ == "__main__":
+    main()
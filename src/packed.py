@@ -0,0 +1,138 @@
+import os
+import gzip
+import json
+import struct
+from contextlib import nullcontext
+
+# Packed output formats: newline-delimited JSON, or length-prefixed binary records
+FORMATS = ("jsonl", "bin")
+
+MANIFEST_NAME = "manifest.json"
+
+# Offsets in .idx files and record lengths in .bin files
+_OFFSET = struct.Struct("<Q")
+_LENGTH = struct.Struct("<I")
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError("zstd compression requires the 'zstandard' package") from e
+    return zstandard
+
+def _compressor(compression):
+    """Per-record compress function for a codec name (None for uncompressed)."""
+    if compression is None:
+        return lambda data: data
+    if compression == "gzip":
+        return lambda data: gzip.compress(data, mtime=0)
+    if compression == "zstd":
+        return _zstandard().ZstdCompressor().compress
+    raise ValueError(f"Unknown compression: {compression}")
+
+def _decompressor(compression):
+    """Per-record decompress function for a codec name (None for uncompressed)."""
+    if compression is None:
+        return lambda data: data
+    if compression == "gzip":
+        return gzip.decompress
+    if compression == "zstd":
+        return _zstandard().ZstdDecompressor().decompress
+    raise ValueError(f"Unknown compression: {compression}")
+
+def shard_names(shard, fmt):
+    """Data and offset index file names of the shard-th packed file."""
+    return f"shard_{shard:05d}.{fmt}", f"shard_{shard:05d}.idx"
+
+def encode_record(record):
+    """Serialize a TemplateRecord to compact JSON bytes."""
+    return json.dumps(record._asdict(), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def write_packed(records, data_path, index_path, fmt="bin", compression=None, metrics=None):
+    """Append records into one data file plus an offset index; return the count.
+
+    Records are compressed one by one so any of them can still be read without
+    decompressing its neighbours. Compression is only supported for "bin".
+    With metrics, encoding and writing each record is timed as stage "write".
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown packed format: {fmt}")
+    if fmt == "jsonl" and compression is not None:
+        raise ValueError("jsonl shards cannot be compressed; use the bin format")
+    compress = _compressor(compression)
+    count = 0
+    with open(data_path, "wb") as data, open(index_path, "wb") as index:
+        for record in records:
+            with metrics.timer("write") if metrics is not None else nullcontext():
+                index.write(_OFFSET.pack(data.tell()))
+                payload = encode_record(record)
+                if fmt == "jsonl":
+                    data.write(payload + b"\n")
+                else:
+                    payload = compress(payload)
+                    data.write(_LENGTH.pack(len(payload)))
+                    data.write(payload)
+            count += 1
+    return count
+
+def write_manifest(out_dir, manifest):
+    """Write the manifest describing a packed output directory."""
+    with open(os.path.join(out_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+class PackedReader:
+    """Random access to the k-th record of a packed output directory in O(1)."""
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        with open(os.path.join(out_dir, MANIFEST_NAME), encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self.format = self.manifest["format"]
+        self.records_per_shard = self.manifest["records_per_shard"]
+        self._decompress = _decompressor(self.manifest["compression"])
+        self._files = {}
+
+    def __len__(self):
+        return self.manifest["count"]
+
+    def _open(self, shard):
+        if shard not in self._files:
+            entry = self.manifest["shards"][shard]
+            self._files[shard] = (
+                open(os.path.join(self.out_dir, entry["data"]), "rb"),
+                open(os.path.join(self.out_dir, entry["index"]), "rb"),
+            )
+        return self._files[shard]
+
+    def read_bytes(self, k):
+        """Raw JSON payload of the k-th record."""
+        if not 0 <= k < len(self):
+            raise IndexError(k)
+        shard, local = divmod(k, self.records_per_shard)
+        data, index = self._open(shard)
+        index.seek(local * _OFFSET.size)
+        (offset,) = _OFFSET.unpack(index.read(_OFFSET.size))
+        data.seek(offset)
+        if self.format == "jsonl":
+            return data.readline()
+        (length,) = _LENGTH.unpack(data.read(_LENGTH.size))
+        return self._decompress(data.read(length))
+
+    def __getitem__(self, k):
+        return json.loads(self.read_bytes(k))
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self[k]
+
+    def close(self):
+        for data, index in self._files.values():
+            data.close()
+            index.close()
+        self._files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,229 @@
+import os
+import time
+import shutil
+import asyncio
+import tempfile
+import subprocess
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from .boxes import BOXES_SUFFIX, POSITIONS_SUFFIX, mark_slots, parse_positions, write_boxes
+from .fill import FILL_BATCH_SIZE, fill_records
+from .render import ENGINES, JOB_NAME, CompileResult, FormatCache, job_outcome, prepare_job, sample_name, with_format
+from .template_generator import iter_shard, shard_tasks
+
+async def compile_source_async(source, work_dir, engine="pdflatex", timeout=60, fmt=None, env=None):
+    """compile_source on the event loop: the engine runs as an asyncio subprocess."""
+    command = prepare_job(source, work_dir, engine, fmt)
+    proc = await asyncio.create_subprocess_exec(
+        *command, cwd=work_dir, env=env, stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        returncode = await asyncio.wait_for(proc.wait(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        return "timeout", f"{engine} exceeded {timeout}s", None
+    return job_outcome(work_dir, engine, returncode)
+
+def _generate_shard(task):
+    """Process pool entry point: the records of one shard task and a metrics snapshot."""
+    seed, shard, start, stop, sampler, instrumented = task
+    metrics = None
+    if instrumented:
+        from .instrument import Metrics
+
+        metrics = Metrics()
+    records = list(iter_shard(seed, shard, start, stop, sampler, metrics))
+    return records, metrics and metrics.snapshot()
+
+class RenderPipeline:
+    """Generate, fill, compile and rasterize templates as concurrent asyncio stages.
+
+    Shards are generated in generate_workers processes, tex_workers engine
+    subprocesses compile at once and raster_workers processes turn PDFs into
+    page images. Stages are joined by asyncio.Queues of queue_size items, so
+    memory stays bounded while every stage is kept busy. Slots are filled on
+    the event loop in the batches fill_records uses, so filled sources are
+    the same as with CompilePool.
+
+    With an augment.Augmenter, the pages of every raster batch are augmented
+    together before they are saved. Render caching and batched compiles are
+    CompilePool features only.
+    """
+
+    def __init__(self, out_dir, tex_workers=os.cpu_count(), generate_workers=1, raster_workers=0,
+                 engine="pdflatex", timeout=60, format_cache_dir=None, boxes=False, image_dir=None, dpi=150,
+                 image_format="png", raster_batch_size=8, queue_size=None, metrics=None, augmenter=None):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine: {engine}")
+        if shutil.which(engine) is None:
+            raise RuntimeError(f"{engine} not found on PATH; install TeX (see install.sh)")
+        if image_dir is not None and raster_workers < 1:
+            raise ValueError("rasterizing into image_dir needs raster_workers >= 1")
+        self.out_dir = out_dir
+        self.tex_workers = tex_workers
+        self.generate_workers = generate_workers
+        self.raster_workers = raster_workers
+        self.engine = engine
+        self.timeout = timeout
+        self.formats = None if format_cache_dir is None else FormatCache(format_cache_dir, engine)
+        self.boxes = boxes
+        self.image_dir = image_dir
+        self.dpi = dpi
+        self.image_format = image_format
+        self.raster_batch_size = raster_batch_size
+        self.queue_size = queue_size or 2 * tex_workers
+        self.metrics = metrics
+        self.augmenter = augmenter
+
+    def render(self, seed, n, start=0, sampler=None, corpus=None, on_records=None, on_result=None, wanted=None,
+               admit=None):
+        """Run the pipeline over templates [start, start + n) until every stage has drained.
+
+        Generated records for which admit(record) is false are dropped before
+        filling. on_records(records) is called with every filled batch in
+        index order; on_result(result) with every CompileResult and
+        RasterResult. Only records for which wanted(record) is true are
+        compiled.
+        """
+        asyncio.run(self.run(seed, n, start, sampler, corpus, on_records, on_result, wanted, admit))
+
+    async def run(self, seed, n, start=0, sampler=None, corpus=None, on_records=None, on_result=None,
+                  wanted=None, admit=None):
+        os.makedirs(self.out_dir, exist_ok=True)
+        if self.image_dir is not None:
+            os.makedirs(self.image_dir, exist_ok=True)
+        on_records = on_records or (lambda records: None)
+        on_result = on_result or (lambda result: None)
+        records = asyncio.Queue(self.queue_size)
+        compiled = asyncio.Queue(self.queue_size)
+        context = multiprocessing.get_context("spawn")
+        root = tempfile.mkdtemp(prefix="synthlatex-")
+        with ProcessPoolExecutor(self.generate_workers, mp_context=context) as generators, \
+                ProcessPoolExecutor(max(self.raster_workers, 1), mp_context=context) as rasterizers:
+            compilers = [
+                asyncio.ensure_future(self._compile_stage(records, compiled, tempfile.mkdtemp(dir=root), on_result))
+                for _ in range(self.tex_workers)
+            ]
+            tasks = [asyncio.ensure_future(self._generate_stage(generators, seed, n, start, sampler, corpus,
+                                                                records, on_records, wanted, admit))]
+            tasks.extend(compilers)
+            if self.image_dir is not None:
+                tasks.extend(
+                    asyncio.ensure_future(self._raster_stage(rasterizers, compiled, on_result))
+                    for _ in range(self.raster_workers)
+                )
+                tasks.append(asyncio.ensure_future(_close_after(compilers, compiled, self.raster_workers)))
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                shutil.rmtree(root, ignore_errors=True)
+
+    async def _put(self, queue, item, name):
+        await queue.put(item)
+        if self.metrics is not None:
+            self.metrics.gauge(name, queue.qsize())
+
+    async def _generate_stage(self, executor, seed, n, start, sampler, corpus, records, on_records, wanted,
+                              admit):
+        """Generate shards in the process pool, a few ahead, and queue their records in order."""
+        loop = asyncio.get_running_loop()
+        pending = deque()
+        batch = []
+
+        async def emit(batch):
+            if corpus is not None:
+                batch = list(fill_records(batch, corpus, seed, metrics=self.metrics))
+            on_records(batch)
+            for record in batch:
+                if wanted is None or wanted(record):
+                    await self._put(records, record, "record_queue")
+
+        async def drain():
+            shard, snapshot = await pending.popleft()
+            if self.metrics is not None:
+                self.metrics.merge(snapshot)
+            batch.extend(shard if admit is None else filter(admit, shard))
+            while len(batch) >= FILL_BATCH_SIZE:
+                await emit(batch[:FILL_BATCH_SIZE])
+                del batch[:FILL_BATCH_SIZE]
+
+        for task in shard_tasks(seed, start, start + n, sampler, self.metrics is not None):
+            pending.append(loop.run_in_executor(executor, _generate_shard, task))
+            if len(pending) >= 2 * self.generate_workers:
+                await drain()
+        while pending:
+            await drain()
+        if batch:
+            await emit(batch)
+        for _ in range(self.tex_workers):
+            await records.put(None)
+
+    async def _compile_stage(self, records, compiled, work_dir, on_result):
+        """One engine slot: compile queued records in work_dir until the queue is closed."""
+        loop = asyncio.get_running_loop()
+        while True:
+            record = await records.get()
+            if record is None:
+                return
+            started = time.perf_counter()
+            text = record.text
+            if self.boxes:
+                text = mark_slots(text, record.slots, record.index)
+            # Dumping a missing format blocks, so it runs on a thread
+            source, fmt, env = await loop.run_in_executor(None, with_format, self.formats, record.base_id, text)
+            status, error, pdf_path = await compile_source_async(source, work_dir, self.engine, self.timeout,
+                                                                 fmt, env)
+            if pdf_path is not None:
+                target = os.path.join(self.out_dir, sample_name(record.index) + ".pdf")
+                if self.boxes:
+                    positions = parse_positions(os.path.join(work_dir, JOB_NAME + POSITIONS_SUFFIX))
+                    write_boxes(os.path.join(self.out_dir, sample_name(record.index) + BOXES_SUFFIX), positions,
+                                record.index)
+                shutil.move(pdf_path, target)
+                pdf_path = target
+            result = CompileResult(record.index, pdf_path, status, error, time.perf_counter() - started)
+            if self.metrics is not None:
+                self.metrics.observe("compile", result.seconds, record.base_id)
+                if status != "ok":
+                    self.metrics.failure("compile", f"{status}: {error}")
+            on_result(result)
+            if pdf_path is not None and self.image_dir is not None:
+                await self._put(compiled, result, "compiled_queue")
+
+    async def _raster_stage(self, executor, compiled, on_result):
+        """Take up to raster_batch_size queued PDFs at a time and rasterize them in the process pool."""
+        from .rasterize import _rasterize_batch
+
+        loop = asyncio.get_running_loop()
+        done = False
+        while not done:
+            batch = []
+            result = await compiled.get()
+            while result is not None:
+                batch.append((result.index, result.pdf_path))
+                if len(batch) >= self.raster_batch_size or compiled.empty():
+                    break
+                result = compiled.get_nowait()
+            done = result is None
+            if not batch:
+                continue
+            task = (batch, self.image_dir, self.dpi, self.image_format, self.augmenter)
+            for raster_result in await loop.run_in_executor(executor, _rasterize_batch, task):
+                if self.metrics is not None:
+                    self.metrics.observe("rasterize", raster_result.seconds)
+                    if raster_result.status != "ok":
+                        self.metrics.failure("rasterize", raster_result.error)
+                on_result(raster_result)
+
+async def _close_after(tasks, queue, consumers):
+    """Close queue for its consumers once every producer task has finished."""
+    await asyncio.gather(*tasks)
+    for _ in range(consumers):
+        await queue.put(None)
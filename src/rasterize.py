@@ -0,0 +1,209 @@
+import os
+import time
+import argparse
+import multiprocessing
+from collections import deque, namedtuple
+
+IMAGE_FORMATS = ("png", "jpeg")
+
+# Outcome of rasterizing one compiled sample: status is "ok" or "error"
+RasterResult = namedtuple("RasterResult", ["index", "image_paths", "status", "error", "seconds"])
+
+def page_filename(stem, page, image_format="png"):
+    """File name of the page-th rendered page of a sample."""
+    extension = "jpg" if image_format == "jpeg" else image_format
+    return f"{stem}_p{page:03d}.{extension}"
+
+def iter_pages(pdf_path, dpi=150):
+    """Render the pages of a PDF in-process, yielding one Pillow image per page."""
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        for page_number in range(len(pdf)):
+            page = pdf[page_number]
+            image = page.render(scale=dpi / 72).to_pil()
+            page.close()
+            yield image
+    finally:
+        pdf.close()
+
+def save_page(image, path, image_format="png", quality=90):
+    if image_format == "jpeg":
+        (image if image.mode in ("L", "RGB") else image.convert("RGB")).save(path, "JPEG", quality=quality)
+    else:
+        image.save(path, "PNG")
+
+def rasterize_pdf(pdf_path, out_dir, dpi=150, image_format="png", quality=90):
+    """Render every page of a PDF in-process and save it with Pillow; return the image paths."""
+    stem = os.path.splitext(os.path.basename(pdf_path))[0]
+    paths = []
+    for page_number, image in enumerate(iter_pages(pdf_path, dpi)):
+        path = os.path.join(out_dir, page_filename(stem, page_number, image_format))
+        save_page(image, path, image_format, quality)
+        paths.append(path)
+    return paths
+
+def _scale_boxes(pdf_path, out_dir, dpi, paths, transforms=None):
+    """Convert slot boxes saved next to a PDF to pixels next to its images."""
+    from .boxes import BOXES_SUFFIX, scale_boxes
+
+    stem = os.path.splitext(pdf_path)[0]
+    if os.path.exists(stem + BOXES_SUFFIX):
+        scale_boxes(stem + BOXES_SUFFIX, os.path.join(out_dir, os.path.basename(stem) + BOXES_SUFFIX), dpi,
+                    [os.path.basename(path) for path in paths], transforms)
+
+def _rasterize_batch(task):
+    """Worker entry point: rasterize a batch of (index, pdf_path) pairs, augmenting the pages with an Augmenter."""
+    items, out_dir, dpi, image_format, augmenter = task
+    if augmenter is not None:
+        return _rasterize_augmented(items, out_dir, dpi, image_format, augmenter)
+    results = []
+    for index, pdf_path in items:
+        started = time.perf_counter()
+        try:
+            paths = rasterize_pdf(pdf_path, out_dir, dpi, image_format)
+            _scale_boxes(pdf_path, out_dir, dpi, paths)
+        except Exception as e:  # a broken PDF must not take down the worker
+            results.append(RasterResult(index, [], "error", f"{type(e).__name__}: {e}", time.perf_counter() - started))
+        else:
+            results.append(RasterResult(index, paths, "ok", None, time.perf_counter() - started))
+    return results
+
+def _rasterize_augmented(items, out_dir, dpi, image_format, augmenter):
+    """Render every page of the batch, augment them together and save them.
+
+    Slot boxes follow the rotation and skew of their pages. Augmenting and
+    saving time is shared among the PDFs by their page counts.
+    """
+    from .augment import shared
+
+    augmenter = shared(augmenter)
+    pdf_paths, errors, seconds, pages = dict(items), {}, {}, []
+    for index, pdf_path in items:
+        started = time.perf_counter()
+        try:
+            pages.extend((index, page_number, image) for page_number, image in enumerate(iter_pages(pdf_path, dpi)))
+        except Exception as e:  # a broken PDF must not take down the worker
+            errors[index] = f"{type(e).__name__}: {e}"
+        seconds[index] = time.perf_counter() - started
+    paths = {index: [] for index, _ in items}
+    transforms = {index: [] for index, _ in items}
+    started = time.perf_counter()
+    for index, page_number, image, matrix in augmenter.augment(pages):
+        stem = os.path.splitext(os.path.basename(pdf_paths[index]))[0]
+        path = os.path.join(out_dir, page_filename(stem, page_number, image_format))
+        save_page(image, path, image_format)
+        paths[index].append(path)
+        transforms[index].append(matrix)
+    per_page = (time.perf_counter() - started) / max(len(pages), 1)
+    results = []
+    for index, pdf_path in items:
+        if index not in errors:
+            started = time.perf_counter()
+            try:
+                _scale_boxes(pdf_path, out_dir, dpi, paths[index], transforms[index])
+            except Exception as e:
+                errors[index] = f"{type(e).__name__}: {e}"
+            seconds[index] += time.perf_counter() - started + per_page * len(paths[index])
+        if index in errors:
+            results.append(RasterResult(index, [], "error", errors[index], seconds[index]))
+        else:
+            results.append(RasterResult(index, paths[index], "ok", None, seconds[index]))
+    return results
+
+class RasterPool:
+    """Process pool turning compiled PDFs into page images.
+
+    Uses the spawn start method so it is safe to run next to the threaded
+    compile stage. metrics (instrument.Metrics) receives the per-PDF
+    "rasterize" latencies measured in the workers and the batch queue depth.
+    With an augment.Augmenter, the pages of each batch are augmented
+    together before they are saved.
+    """
+
+    def __init__(self, workers=os.cpu_count(), dpi=150, image_format="png", batch_size=8, max_pending=None,
+                 metrics=None, augmenter=None):
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unknown image format: {image_format}")
+        self.workers = workers
+        self.dpi = dpi
+        self.image_format = image_format
+        self.batch_size = batch_size
+        self.max_pending = max_pending or 2 * workers
+        self.metrics = metrics
+        self.augmenter = augmenter
+        self._pool = multiprocessing.get_context("spawn").Pool(workers)
+
+    def rasterize(self, compile_results, out_dir):
+        """Rasterize the PDFs of successful CompileResults, yielding RasterResults.
+
+        PDFs are sent to the workers batch_size at a time and at most
+        max_pending batches are in flight. compile_results is only advanced
+        when there is room, which applies back-pressure to a lazy compile
+        stage such as CompilePool.compile.
+        """
+        os.makedirs(out_dir, exist_ok=True)
+        pending = deque()
+        batch = []
+        for result in compile_results:
+            if result.pdf_path is None:
+                continue
+            batch.append((result.index, result.pdf_path))
+            if len(batch) >= self.batch_size:
+                pending.append(self._submit(batch, out_dir))
+                batch = []
+                if self.metrics is not None:
+                    self.metrics.gauge("raster_queue", len(pending))
+            if len(pending) >= self.max_pending:
+                yield from self._collect(pending.popleft())
+        if batch:
+            pending.append(self._submit(batch, out_dir))
+        while pending:
+            yield from self._collect(pending.popleft())
+
+    def _submit(self, batch, out_dir):
+        task = (batch, out_dir, self.dpi, self.image_format, self.augmenter)
+        return self._pool.apply_async(_rasterize_batch, (task,))
+
+    def _collect(self, pending):
+        results = pending.get()
+        if self.metrics is not None:
+            for result in results:
+                self.metrics.observe("rasterize", result.seconds)
+                if result.status != "ok":
+                    self.metrics.failure("rasterize", result.error)
+        return results
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Rasterize compiled PDFs into page images.")
+    parser.add_argument("pdf_dir", help="Directory of compiled PDFs")
+    parser.add_argument("--out-dir", required=True, help="Directory for the page images")
+    parser.add_argument("--dpi", type=int, default=150, help="Rendering resolution")
+    parser.add_argument("--image-format", choices=IMAGE_FORMATS, default="png", help="Output image format")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of rasterizer processes")
+    args = parser.parse_args()
+
+    from .render import CompileResult
+
+    names = sorted(name for name in os.listdir(args.pdf_dir) if name.endswith(".pdf"))
+    results = (
+        CompileResult(name, os.path.join(args.pdf_dir, name), "ok", None, 0.0) for name in names
+    )
+    with RasterPool(args.workers, args.dpi, args.image_format) as pool:
+        for result in pool.rasterize(results, args.out_dir):
+            if result.status != "ok":
+                print(f"{result.index}: {result.error}")
+
+if __name__ == "__main__":
+    main()
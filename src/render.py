@@ -0,0 +1,740 @@
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from contextlib import ExitStack, nullcontext
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from . import instrument
+from .boxes import BOXES_SUFFIX, POSITIONS_SUFFIX, mark_slots, parse_positions, write_boxes
+from .render_cache import DEFAULT_MAX_BYTES, RenderCache
+from .template_generator import BASE_TEMPLATES, SHARD_SIZE, iter_templates, template_filename
+
+ENGINES = ("pdflatex", "xelatex")
+
+# Job name used inside every worker directory
+JOB_NAME = "doc"
+
+# Files a previous job may leave behind in a reused worker directory
+_JOB_SUFFIXES = (".tex", ".pdf", ".log", ".aux", ".toc", ".out", ".nav", ".snm", POSITIONS_SUFFIX)
+
+# Written after \begin{document} of a batched document: a macro setting every counter (page,
+# section, equation, figure, theorems, ...) back to its value there, from LaTeX's list of them
+_SAVE_COUNTERS = ("\\makeatletter\\begingroup\\def\\@elt#1{\\noexpand\\setcounter{#1}{\\the\\value{#1}}}"
+                  "\\xdef\\SynthlatexCounters{\\cl@@ckpt}\\endgroup\\makeatother\n")
+
+# Written after each sample of a batched document: a log line with its index and the pages
+# shipped so far, then the counters are reset so the next sample numbers as if compiled alone
+_SAMPLE_MARK = "\\clearpage\\typeout{{SYNTHLATEX-SAMPLE {} \\the\\ReadonlyShipoutCounter}}\\SynthlatexCounters\n"
+_SAMPLE_LOG = re.compile(r"^SYNTHLATEX-SAMPLE (\d+) (\d+)$", re.MULTILINE)
+
+# Body commands with global side effects on later pages: \maketitle disables itself and \title,
+# \appendix turns every later section into an appendix, and the table of contents and lists
+# allocate a write stream each. Samples using them are never batched with others.
+_UNBATCHABLE = (r"\maketitle", r"\appendix", r"\tableofcontents", r"\listoffigures", r"\listoftables")
+
+# pypdfium2 is not thread-safe; compile threads split PDFs one at a time
+_PDFIUM_LOCK = threading.Lock()
+
+BEGIN_DOCUMENT = r"\begin{document}"
+END_DOCUMENT = r"\end{document}"
+
+# Outcome of compiling one template: status is "ok", "error" or "timeout"
+CompileResult = namedtuple("CompileResult", ["index", "pdf_path", "status", "error", "seconds"])
+
+def sample_name(index):
+    """Output stem of the index-th template, matching its .tex file name."""
+    return os.path.splitext(template_filename(index))[0]
+
+def log_error(log_path, max_lines=5):
+    """First TeX error lines ("! ...") of a log file, or None."""
+    try:
+        with open(log_path, encoding="utf-8", errors="replace") as f:
+            lines = [line.rstrip() for line in f if line.startswith("!")]
+    except OSError:
+        return None
+    return "\n".join(lines[:max_lines]) or None
+
+def static_preamble(base_id):
+    """Leading preamble lines of a base template that contain no slot.
+
+    This is the part every document drawn from that base template shares
+    verbatim, so it can be dumped once into a precompiled format.
+    """
+    head = BASE_TEMPLATES[base_id].segments[0]
+    end = head.find(r"\begin{document}")
+    if end != -1:
+        head = head[:end]
+    return head[:head.rfind("\n") + 1]
+
+class FormatCache:
+    """Precompiled TeX formats keyed by the hash of the engine version and the preamble they were dumped from.
+
+    Formats persist in cache_dir across runs and may be shared by concurrent
+    builds; a changed preamble or an upgraded engine hashes to a new name,
+    so stale formats are never picked up.
+    """
+
+    def __init__(self, cache_dir, engine="pdflatex", timeout=120):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.engine = engine
+        self.timeout = timeout
+        self.version = engine_version(engine)
+        self._failed = set()
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # Environment that lets the engine find the cached formats by name
+        self.env = dict(os.environ)
+        self.env["TEXFORMATS"] = self.cache_dir + os.pathsep + self.env.get("TEXFORMATS", "")
+
+    def format_name(self, preamble):
+        digest = hashlib.sha256(f"{self.version}\n{preamble}".encode("utf-8")).hexdigest()[:16]
+        return f"{self.engine}-{digest}"
+
+    def get(self, preamble):
+        """Name of the format for preamble, dumping it on first use; None if it cannot be built."""
+        if r"\documentclass" not in preamble:
+            return None
+        name = self.format_name(preamble)
+        fmt_path = os.path.join(self.cache_dir, name + ".fmt")
+        if os.path.exists(fmt_path):
+            return name
+        with self._lock:
+            if name in self._failed:
+                return None
+            if not os.path.exists(fmt_path) and not self._dump(name, preamble):
+                self._failed.add(name)
+                return None
+        return name
+
+    def _dump(self, name, preamble):
+        # Dump under a job name of this process and thread, then move the format into place in
+        # one step: another build sharing cache_dir either sees no format or a complete one
+        job = f"{name}-{os.getpid()}-{threading.get_ident()}"
+        job_path = os.path.join(self.cache_dir, job)
+        with open(job_path + ".tex", "w", encoding="utf-8") as f:
+            f.write(preamble + "\\dump\n")
+        command = [self.engine, "-ini", "-interaction=nonstopmode", "-halt-on-error",
+                   f"-jobname={job}", f"&{self.engine}", job + ".tex"]
+        try:
+            proc = subprocess.run(
+                command, cwd=self.cache_dir, stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=self.timeout,
+            )
+            if proc.returncode != 0 or not os.path.exists(job_path + ".fmt"):
+                return False
+            os.replace(job_path + ".fmt", os.path.join(self.cache_dir, name + ".fmt"))
+            return True
+        except subprocess.TimeoutExpired:
+            return False
+        finally:
+            for suffix in (".tex", ".log", ".fmt"):
+                if os.path.exists(job_path + suffix):
+                    os.remove(job_path + suffix)
+
+def engine_version(engine):
+    """First line of engine --version, or "" if the engine cannot be run."""
+    try:
+        proc = subprocess.run([engine, "--version"], stdin=subprocess.DEVNULL,
+                              capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired):
+        return ""
+    return proc.stdout.partition("\n")[0].strip()
+
+def prepare_job(source, work_dir, engine="pdflatex", fmt=None):
+    """Write source as the job of work_dir and return the engine command line to run there.
+
+    work_dir is reused between calls: stale outputs of the previous job are
+    removed instead of recreating the directory. With fmt, source must omit
+    the preamble lines that were dumped into that format.
+    """
+    for suffix in _JOB_SUFFIXES:
+        path = os.path.join(work_dir, JOB_NAME + suffix)
+        if os.path.exists(path):
+            os.remove(path)
+    with open(os.path.join(work_dir, JOB_NAME + ".tex"), "w", encoding="utf-8") as f:
+        f.write(source)
+    command = [engine, "-interaction=nonstopmode", "-halt-on-error", JOB_NAME + ".tex"]
+    if fmt is not None:
+        command.insert(1, f"-fmt={fmt}")
+    return command
+
+def job_outcome(work_dir, engine, returncode):
+    """(status, error, pdf_path) of a finished job in work_dir."""
+    pdf_path = os.path.join(work_dir, JOB_NAME + ".pdf")
+    if returncode != 0 or not os.path.exists(pdf_path):
+        error = log_error(os.path.join(work_dir, JOB_NAME + ".log"))
+        return "error", error or f"{engine} exited with code {returncode}", None
+    return "ok", None, pdf_path
+
+def with_format(formats, base_id, text):
+    """(source, fmt, env) for a document, using its base template's format from formats if any."""
+    if formats is None:
+        return text, None, None
+    preamble = static_preamble(base_id)
+    if not text.startswith(preamble):
+        return text, None, None
+    fmt = formats.get(preamble)
+    if fmt is None:
+        return text, None, None
+    return text[len(preamble):], fmt, formats.env
+
+def compile_source(source, work_dir, engine="pdflatex", timeout=60, fmt=None, env=None):
+    """Compile a LaTeX source inside work_dir; return (status, error, pdf_path)."""
+    command = prepare_job(source, work_dir, engine, fmt)
+    try:
+        proc = subprocess.run(
+            command, cwd=work_dir, env=env, stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        return "timeout", f"{engine} exceeded {timeout}s", None
+    return job_outcome(work_dir, engine, proc.returncode)
+
+def batch_source(records):
+    """One document with the body of every record on its own pages.
+
+    All records must share the same preamble. After each body the number of
+    pages shipped so far is written to the log for sample_pages, and every
+    counter is set back to its value at the start of the document, so each
+    sample's pages are numbered as in a standalone compile.
+    """
+    text = records[0].text
+    parts = [text[:text.find(BEGIN_DOCUMENT) + len(BEGIN_DOCUMENT)], "\n", _SAVE_COUNTERS]
+    for record in records:
+        begin = record.text.find(BEGIN_DOCUMENT) + len(BEGIN_DOCUMENT)
+        body = record.text[begin:record.text.rfind(END_DOCUMENT)]
+        parts.append(body)
+        parts.append(_SAMPLE_MARK.format(record.index))
+    parts.append(text[text.rfind(END_DOCUMENT):])
+    return "".join(parts)
+
+def batchable(record):
+    """Whether record can share a batched document: its body leaves no global state behind."""
+    body = record.text[record.text.find(BEGIN_DOCUMENT):]
+    return not any(command in body for command in _UNBATCHABLE)
+
+def sample_pages(log_path):
+    """Map sample index -> range of its 0-based pages, from a batched document's log."""
+    try:
+        with open(log_path, encoding="utf-8", errors="replace") as f:
+            log = f.read()
+    except OSError:
+        return {}
+    pages, shipped = {}, 0
+    for match in _SAMPLE_LOG.finditer(log):
+        index, total = int(match.group(1)), int(match.group(2))
+        pages[index] = range(shipped, total)
+        shipped = total
+    return pages
+
+def split_pdf(pdf_path, page_ranges, out_paths):
+    """Write each range of pages of pdf_path to its own PDF file."""
+    import pypdfium2 as pdfium
+
+    with _PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            for pages, out_path in zip(page_ranges, out_paths):
+                part = pdfium.PdfDocument.new()
+                part.import_pages(pdf, list(pages))
+                part.save(out_path)
+                part.close()
+        finally:
+            pdf.close()
+
+class CompilePool:
+    """Bounded pool of TeX workers, each with its own persistent scratch directory.
+
+    With boxes, every slot is wrapped in position markers and the page-space
+    box of each slot is saved next to its PDF (see boxes.py). Box mode does
+    not use the render cache, which only stores PDFs.
+
+    metrics (instrument.Metrics) receives "compile" latencies per base
+    template, render cache hits, failures by their first error line and the
+    depth of the compile queue.
+    """
+
+    def __init__(self, workers=os.cpu_count(), engine="pdflatex", timeout=60, format_cache_dir=None,
+                 render_cache_dir=None, render_cache_bytes=DEFAULT_MAX_BYTES, boxes=False, metrics=None):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine: {engine}")
+        if shutil.which(engine) is None:
+            raise RuntimeError(f"{engine} not found on PATH; install TeX (see install.sh)")
+        self.workers = workers
+        self.engine = engine
+        self.timeout = timeout
+        self.formats = None if format_cache_dir is None else FormatCache(format_cache_dir, engine)
+        self.boxes = boxes
+        self.metrics = metrics
+        if boxes or render_cache_dir is None:
+            self.cache = None
+        else:
+            self.cache = RenderCache(render_cache_dir, render_cache_bytes)
+        self._root = tempfile.mkdtemp(prefix="synthlatex-")
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def _work_dir(self):
+        if not hasattr(self._local, "work_dir"):
+            self._local.work_dir = tempfile.mkdtemp(dir=self._root)
+        return self._local.work_dir
+
+    def _with_format(self, base_id, text):
+        return with_format(self.formats, base_id, text)
+
+    def _from_cache(self, record, out_dir):
+        """CompileResult for a record whose exact source was compiled before, else None."""
+        if self.cache is None:
+            return None
+        started = time.perf_counter()
+        target = os.path.join(out_dir, sample_name(record.index) + ".pdf")
+        if not self.cache.get(RenderCache.key(record.text, self.engine), target):
+            return None
+        result = CompileResult(record.index, target, "ok", None, time.perf_counter() - started)
+        self._observe("cache_hit", record, result)
+        return result
+
+    def _to_cache(self, record, pdf_path):
+        if self.cache is not None:
+            self.cache.put(RenderCache.key(record.text, self.engine), pdf_path)
+
+    def _compile(self, record, out_dir):
+        cached = self._from_cache(record, out_dir)
+        if cached is not None:
+            return cached
+        return self._compile_fresh(record, out_dir)
+
+    def _observe(self, stage, record, result):
+        if self.metrics is not None:
+            self.metrics.observe(stage, result.seconds, record.base_id)
+            if result.status != "ok":
+                self.metrics.failure(stage, f"{result.status}: {result.error}")
+
+    def _profiled(self, stage):
+        """Profiling region of stage; its latency is observed from the CompileResults instead."""
+        if self.metrics is None or stage != self.metrics.profile_stage:
+            return nullcontext()
+        return self.metrics.profiler.region()
+
+    def _marked(self, record):
+        """record with its slots wrapped in position markers when boxes are on."""
+        if not self.boxes:
+            return record
+        return record._replace(text=mark_slots(record.text, record.slots, record.index))
+
+    def _compile_fresh(self, record, out_dir):
+        with self._profiled("compile"):
+            result = self._compile_one(record, out_dir)
+        self._observe("compile", record, result)
+        return result
+
+    def _compile_alone(self, record, out_dir):
+        return [self._compile_fresh(record, out_dir)]
+
+    def _compile_one(self, record, out_dir):
+        started = time.perf_counter()
+        source, fmt, env = self._with_format(record.base_id, self._marked(record).text)
+        status, error, pdf_path = compile_source(source, self._work_dir(), self.engine, self.timeout, fmt, env)
+        if pdf_path is not None:
+            target = os.path.join(out_dir, sample_name(record.index) + ".pdf")
+            if self.boxes:
+                positions = parse_positions(os.path.join(self._work_dir(), JOB_NAME + POSITIONS_SUFFIX))
+                write_boxes(os.path.join(out_dir, sample_name(record.index) + BOXES_SUFFIX), positions, record.index)
+            shutil.move(pdf_path, target)
+            pdf_path = target
+            self._to_cache(record, pdf_path)
+        return CompileResult(record.index, pdf_path, status, error, time.perf_counter() - started)
+
+    def compile(self, records, out_dir):
+        """Compile template records into out_dir, yielding CompileResults in input order.
+
+        At most 2 * workers records are in flight, so memory stays bounded for
+        arbitrarily long record streams.
+        """
+        os.makedirs(out_dir, exist_ok=True)
+        pending = deque()
+        for record in records:
+            pending.append(self._executor.submit(self._compile, record, out_dir))
+            if self.metrics is not None:
+                self.metrics.gauge("compile_queue", len(pending))
+            if len(pending) >= 2 * self.workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def _compile_batch(self, records, out_dir):
+        """Compile records sharing one preamble as pages of a single document.
+
+        Falls back to one compile per record if the batch fails, so a single
+        bad sample does not cost the whole batch.
+        """
+        with self._profiled("compile"):
+            results = self._compile_shared(records, out_dir)
+        if results is None:
+            return [self._compile_fresh(record, out_dir) for record in records]
+        for record, result in zip(records, results):
+            self._observe("compile", record, result)
+        return results
+
+    def _compile_shared(self, records, out_dir):
+        """CompileResults of records compiled as one document, or None if the batch failed."""
+        started = time.perf_counter()
+        text, fmt, env = self._with_format(records[0].base_id, batch_source([self._marked(r) for r in records]))
+        status, error, pdf_path = compile_source(
+            text, self._work_dir(), self.engine, self.timeout * len(records), fmt, env,
+        )
+        if status != "ok":
+            return None
+        page_ranges = sample_pages(os.path.join(os.path.dirname(pdf_path), JOB_NAME + ".log"))
+        if any(record.index not in page_ranges for record in records):
+            return None
+        seconds = (time.perf_counter() - started) / len(records)
+        results, ranges, targets = [], [], []
+        for record in records:
+            if not page_ranges[record.index]:
+                results.append(CompileResult(record.index, None, "error", "sample produced no pages", seconds))
+                continue
+            target = os.path.join(out_dir, sample_name(record.index) + ".pdf")
+            ranges.append(page_ranges[record.index])
+            targets.append(target)
+            results.append(CompileResult(record.index, target, "ok", None, seconds))
+        split_pdf(pdf_path, ranges, targets)
+        if self.boxes:
+            positions = parse_positions(os.path.join(self._work_dir(), JOB_NAME + POSITIONS_SUFFIX))
+            for result in results:
+                if result.pdf_path is not None:
+                    write_boxes(os.path.join(out_dir, sample_name(result.index) + BOXES_SUFFIX), positions,
+                                result.index, page_ranges[result.index].start)
+        # Split PDFs are not cached: the cache key is the record's standalone source, and a
+        # page split out of a batch is not guaranteed to match its standalone compile
+        return results
+
+    def compile_batched(self, records, out_dir, batch_size=100):
+        """Compile records batch_size at a time per shared preamble, one TeX run per batch.
+
+        Yields CompileResults batch by batch, so not in input order. Counters
+        such as page, section and equation numbers restart with every sample
+        of a batch. Records that are not batchable (title pages, appendices,
+        tables of contents) are compiled on their own.
+        """
+        os.makedirs(out_dir, exist_ok=True)
+        groups = {}
+        pending = deque()
+        for record in records:
+            cached = self._from_cache(record, out_dir)
+            if cached is not None:
+                yield cached
+                continue
+            submitted = None
+            if not batchable(record):
+                submitted = self._executor.submit(self._compile_alone, record, out_dir)
+            else:
+                preamble = record.text[:record.text.find(BEGIN_DOCUMENT)]
+                group = groups.setdefault(preamble, [])
+                group.append(record)
+                if len(group) >= batch_size:
+                    submitted = self._executor.submit(self._compile_batch, groups.pop(preamble), out_dir)
+            if submitted is not None:
+                pending.append(submitted)
+                if self.metrics is not None:
+                    self.metrics.gauge("compile_queue", len(pending))
+            if len(pending) >= 2 * self.workers:
+                yield from pending.popleft().result()
+        for group in groups.values():
+            pending.append(self._executor.submit(self._compile_batch, group, out_dir))
+        while pending:
+            yield from pending.popleft().result()
+
+    def close(self):
+        self._executor.shutdown()
+        shutil.rmtree(self._root, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def compile_templates(records, out_dir, workers=os.cpu_count(), engine="pdflatex", timeout=60,
+                      format_cache_dir=None, render_cache_dir=None):
+    """Compile template records into out_dir; return the list of CompileResults."""
+    with CompilePool(workers, engine, timeout, format_cache_dir, render_cache_dir) as pool:
+        return list(pool.compile(records, out_dir))
+
+class _Checkpoint:
+    """Skips the records a build manifest holds and records the final outcome of the others.
+
+    A sample is final when its compile fails or, with rasterized, when its
+    pages are rasterized; otherwise when it is compiled.
+    """
+
+    def __init__(self, manifest, rasterized):
+        self.manifest = manifest
+        self.rasterized = rasterized
+        self.skipped = 0
+        self._inflight = {}
+        self._block, self._done = None, set()
+
+    def wanted(self, record):
+        """Whether record still has to be rendered; done ids are looked up one shard at a time."""
+        block = record.index // SHARD_SIZE
+        if block != self._block:
+            self._block, self._done = block, self.manifest.done(block * SHARD_SIZE, (block + 1) * SHARD_SIZE)
+        if record.index in self._done:
+            self.skipped += 1
+            return False
+        self._inflight[record.index] = (record.base_id, record.structure_ids)
+        return True
+
+    def result(self, result):
+        # Told apart by field rather than class: run as a script, this module's CompileResult
+        # is not the one src.pipeline imports
+        compiled = not hasattr(result, "image_paths")
+        if compiled and result.status == "ok" and self.rasterized:
+            return
+        base_id, structure_ids = self._inflight.pop(result.index)
+        self.manifest.add(result.index, base_id, structure_ids, sample_name(result.index) + ".pdf",
+                          result.status, result.error)
+
+    def results(self, results):
+        for result in results:
+            self.result(result)
+            yield result
+
+def _report_failure(result, failed):
+    """Print and collect a failed stage result."""
+    if result.status != "ok":
+        failed.append(result)
+        print(f"{sample_name(result.index)}: {result.status}: {result.error}")
+
+def _report_failures(results, failed):
+    """Pass stage results through, printing and collecting the failed ones."""
+    for result in results:
+        _report_failure(result, failed)
+        yield result
+
+def _augmentations(value):
+    from .augment import AUGMENTATIONS
+
+    names = AUGMENTATIONS if value == "all" else tuple(name for name in value.split(",") if name)
+    unknown = sorted(set(names) - set(AUGMENTATIONS))
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown augmentations: {', '.join(unknown)}")
+    return names
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate random LaTeX templates and compile them to PDF.")
+    parser.add_argument("--count", type=int, required=True, help="Number of templates to compile")
+    parser.add_argument("--out-dir", required=True, help="Directory for the PDFs")
+    parser.add_argument("--seed", type=int, default=0, help="Master seed of the generated templates")
+    parser.add_argument("--start", type=int, default=0, help="Index of the first template")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of concurrent TeX processes")
+    parser.add_argument("--engine", choices=ENGINES, default="pdflatex", help="TeX engine")
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds before a compile is killed")
+    parser.add_argument("--format-cache", help="Directory of precompiled preamble formats to build and reuse")
+    parser.add_argument("--batch-size", type=int, default=0,
+                        help="Compile up to this many samples sharing a preamble per TeX run (0: one run each)")
+    parser.add_argument("--corpus", help="UTF-8 text file whose lines fill the {TEXT_HERE} slots before compiling")
+    parser.add_argument("--max-chars", type=int, default=80, help="Longest snippet placed in a slot")
+    parser.add_argument("--max-words", type=int, help="Fill slots with runs of at most this many words of a line")
+    parser.add_argument("--render-cache", help="Directory of compiled PDFs keyed by source hash, reused across runs")
+    parser.add_argument("--render-cache-gb", type=float, default=DEFAULT_MAX_BYTES / 2 ** 30,
+                        help="Size limit of the render cache before least recently used PDFs are evicted")
+    parser.add_argument("--image-dir", help="Also rasterize every compiled page into this directory")
+    parser.add_argument("--dpi", type=int, default=150, help="Rasterization resolution")
+    parser.add_argument("--image-format", choices=["png", "jpeg"], default="png", help="Page image format")
+    parser.add_argument("--raster-workers", type=int, default=os.cpu_count(), help="Number of rasterizer processes")
+    parser.add_argument("--augment", type=_augmentations, metavar="NAMES",
+                        help="Degrade the page images with these comma-separated augmentations, or all of them "
+                             "with 'all': texture, bleed, rotate, blur, noise, jpeg. Images become grayscale")
+    parser.add_argument("--augment-strength", type=float, default=1.0, help="Scale of every augmentation magnitude")
+    parser.add_argument("--augment-batch", type=int, default=4, help="Pages augmented together by a rasterizer")
+    parser.add_argument("--weights", help="JSON file of base, structure and style weights and category quotas; quotas are "
+                             f"exact per shard of {SHARD_SIZE} templates, so over --start/--count only when "
+                             "both are multiples of it")
+    parser.add_argument("--boxes", action="store_true",
+                        help="Mark every slot and save its page-space bounding box next to the PDF (and images)")
+    parser.add_argument("--annotations", action="store_true",
+                        help="Save the labels of the compiled sources as columns to annotations.npz in --out-dir")
+    parser.add_argument("--pipeline", choices=["pool", "async"], default="pool",
+                        help="Pull records through thread and process pools, or run all stages concurrently "
+                             "on asyncio with bounded queues")
+    parser.add_argument("--generate-workers", type=int, default=1,
+                        help="Generation and filling processes of the async pipeline")
+    parser.add_argument("--queue-size", type=int,
+                        help="Items buffered between async pipeline stages (default: 2 * --workers)")
+    parser.add_argument("--max-repeats", type=int,
+                        help="Skip templates whose skeleton (base, structures, slot styles) was rendered this "
+                             "many times already; 1 drops every repeat")
+    parser.add_argument("--coverage", metavar="PATH",
+                        help="Write skeleton and (base, structure) coverage statistics of the run as JSON")
+    parser.add_argument("--catalogue", metavar="PATH", help="JSON catalogue of structures and base templates "
+                                                            "to use instead of the built-in catalogue.json")
+    parser.add_argument("--resume", action="store_true",
+                        help="Record every finished document in build.sqlite in --out-dir and skip the ones a "
+                             "previous run with the same settings completed")
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    if args.boxes and args.render_cache is not None:
+        parser.error("--boxes cannot be combined with --render-cache")
+    if args.pipeline == "async" and (args.render_cache is not None or args.batch_size > 1):
+        parser.error("--pipeline async supports neither --render-cache nor --batch-size")
+    if args.augment is not None and args.image_dir is None:
+        parser.error("--augment needs --image-dir")
+    with instrument.from_args(args) as metrics:
+        _render(args, metrics)
+
+def _render(args, metrics):
+    if args.catalogue is not None:
+        from .template_generator import use_catalogue
+
+        use_catalogue(args.catalogue)
+    sampler = None
+    if args.weights is not None:
+        from .sampling import load_sampler, quota_warning
+
+        sampler = load_sampler(args.weights)
+        warning = quota_warning(sampler, args.start, args.count)
+        if warning is not None:
+            print(warning, file=sys.stderr)
+    corpus = None
+    if args.corpus is not None:
+        from .corpus import MmapCorpus
+
+        corpus = MmapCorpus(args.corpus, args.max_chars, args.max_words)
+    builder = None
+    if args.annotations:
+        from .annotations import AnnotationBuilder
+
+        builder = AnnotationBuilder()
+    augmenter = None
+    if args.augment is not None:
+        from .augment import Augmenter
+
+        augmenter = Augmenter(args.seed, args.augment, args.augment_strength, args.augment_batch)
+    skeletons = None
+    if args.max_repeats is not None or args.coverage is not None:
+        from .dedup import SkeletonIndex
+
+        skeletons = SkeletonIndex(args.max_repeats)
+    failed = []
+    started = time.perf_counter()
+    with ExitStack() as stack:
+        checkpoint = None
+        if args.resume:
+            checkpoint = _Checkpoint(stack.enter_context(_open_manifest(args, sampler)), args.image_dir is not None)
+        if args.pipeline == "async":
+            _render_async(args, sampler, corpus, builder, skeletons, augmenter, checkpoint, failed, metrics)
+            cache = None
+        else:
+            cache = _render_pooled(args, sampler, corpus, builder, skeletons, augmenter, checkpoint, failed,
+                                   metrics)
+    if builder is not None:
+        from .annotations import ANNOTATIONS_NAME, save_annotations
+
+        columns = builder.columns()
+        if augmenter is not None:
+            columns.update(augmenter.columns(columns["index"]))
+        save_annotations(os.path.join(args.out_dir, ANNOTATIONS_NAME), columns)
+    elapsed = time.perf_counter() - started
+    count = args.count - (checkpoint.skipped if checkpoint is not None else 0)
+    count -= skeletons.skipped if skeletons is not None else 0
+    print(f"Rendered {count - len(failed)}/{count} documents in {elapsed:.1f}s "
+          f"({count / max(elapsed, 1e-9):.1f} docs/s)")
+    if checkpoint is not None:
+        print(f"Resumed: {checkpoint.skipped} documents were already complete")
+    if skeletons is not None:
+        coverage = skeletons.coverage()
+        print(f"Skeletons: {coverage['distinct_skeletons']} distinct, {skeletons.skipped} repeats skipped, "
+              f"{coverage['compatible_pairs_fraction']:.1%} of compatible (base, structure) pairs seen")
+        if args.coverage is not None:
+            with open(args.coverage, "w", encoding="utf-8") as f:
+                json.dump(coverage, f, indent=2)
+    if cache is not None:
+        print(f"Render cache: {cache.hits} hits, {cache.misses} misses")
+
+def _open_manifest(args, sampler):
+    """Build manifest in --out-dir for the settings that determine what is rendered."""
+    from .manifest import BuildManifest
+
+    from . import template_generator
+
+    config = {"kind": "render", "seed": args.seed, "catalogue": template_generator.CATALOGUE_DIGEST,
+              "sampling": None if sampler is None else sampler.config}
+    for name in ("engine", "boxes", "batch_size", "corpus", "max_chars", "max_words", "image_dir", "dpi",
+                 "image_format", "max_repeats", "augment", "augment_strength"):
+        config[name] = getattr(args, name)
+    return BuildManifest.open(args.out_dir, config)
+
+def _render_pooled(args, sampler, corpus, builder, skeletons, augmenter, checkpoint, failed, metrics):
+    """Pull records through CompilePool and RasterPool; return the render cache, if any."""
+    records = iter_templates(args.seed, args.count, args.start, sampler, metrics)
+    if skeletons is not None:
+        records = skeletons.filter(records)
+    if corpus is not None:
+        from .fill import fill_records
+
+        records = fill_records(records, corpus, args.seed, metrics=metrics)
+    if builder is not None:
+        records = builder.tap(records)
+    if checkpoint is not None:
+        records = filter(checkpoint.wanted, records)
+    with ExitStack() as stack:
+        pool = stack.enter_context(CompilePool(
+            args.workers, args.engine, args.timeout, args.format_cache,
+            args.render_cache, int(args.render_cache_gb * 2 ** 30), args.boxes, metrics,
+        ))
+        if args.batch_size > 1:
+            results = pool.compile_batched(records, args.out_dir, args.batch_size)
+        else:
+            results = pool.compile(records, args.out_dir)
+        results = _report_failures(results, failed)
+        if checkpoint is not None:
+            results = checkpoint.results(results)
+        if args.image_dir is not None:
+            from .rasterize import RasterPool
+
+            rasterizer = stack.enter_context(RasterPool(args.raster_workers, args.dpi, args.image_format,
+                                                        metrics=metrics, augmenter=augmenter))
+            results = _report_failures(rasterizer.rasterize(results, args.image_dir), failed)
+            if checkpoint is not None:
+                results = checkpoint.results(results)
+        for _ in results:
+            pass
+    return pool.cache
+
+def _render_async(args, sampler, corpus, builder, skeletons, augmenter, checkpoint, failed, metrics):
+    """Run every stage concurrently on the asyncio pipeline."""
+    from .pipeline import RenderPipeline
+
+    pipeline = RenderPipeline(
+        args.out_dir, args.workers, args.generate_workers, args.raster_workers, args.engine, args.timeout,
+        args.format_cache, args.boxes, args.image_dir, args.dpi, args.image_format,
+        queue_size=args.queue_size, metrics=metrics, augmenter=augmenter,
+    )
+    def add_records(records):
+        for record in records:
+            builder.add(record)
+
+    on_records = add_records if builder is not None else None
+
+    def on_result(result):
+        _report_failure(result, failed)
+        if checkpoint is not None:
+            checkpoint.result(result)
+
+    pipeline.render(args.seed, args.count, args.start, sampler, corpus, on_records, on_result,
+                    checkpoint and checkpoint.wanted, skeletons and skeletons.admit)
+
+if __name__ == "__main__":
+    main()
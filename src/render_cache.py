@@ -0,0 +1,96 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_BYTES = 10 * 2 ** 30
+
+def _place(src, dst):
+    """Hard-link src to dst, copying when linking is not possible."""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+class RenderCache:
+    """Content-addressed on-disk cache of compiled PDFs with LRU eviction.
+
+    Entries are keyed by the hash of the exact source that was compiled (and
+    the engine), so identical templates are never compiled twice. Recency is
+    kept in file modification times, which lets a cache directory survive
+    across runs; once the total size exceeds max_bytes the least recently used
+    entries are deleted.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        found = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith(".pdf"):
+                    stat = os.stat(os.path.join(root, name))
+                    found.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._size += size
+
+    @staticmethod
+    def key(source, engine="pdflatex"):
+        return hashlib.sha256(f"{engine}\0{source}".encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".pdf")
+
+    def get(self, key, target):
+        """Place the cached PDF for key at target; return False on a miss."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return False
+            path = self.path(key)
+            try:
+                _place(path, target)
+                os.utime(path)
+            except FileNotFoundError:  # evicted by another process sharing the directory
+                self._size -= self._entries.pop(key)
+                self.misses += 1
+                return False
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True
+
+    def put(self, key, pdf_path):
+        """Store a compiled PDF under key and evict old entries beyond max_bytes."""
+        path = self.path(key)
+        with self._lock:
+            if key in self._entries:
+                return
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            os.close(fd)
+            shutil.copyfile(pdf_path, tmp_path)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+            self._entries[key] = size
+            self._size += size
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._size -= old_size
+                try:
+                    os.remove(self.path(old_key))
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,244 @@
+import json
+
+from .template_generator import (
+    BASE_TEMPLATES,
+    CATEGORIES,
+    COMPATIBLE_STRUCTURES,
+    PLAIN_STYLE,
+    SHARD_SIZE,
+    STRUCTURE_CATEGORIES,
+    STRUCTURES,
+    STYLE_NAMES,
+    TEXT_MODE_STYLES,
+    TEXT_STYLES,
+)
+
+# Number of sections of a template, drawn uniformly like sample_template does
+MIN_SECTIONS, MAX_SECTIONS = 1, 7
+
+class AliasTable:
+    """Walker/Vose alias table: O(1) weighted draws from a fixed list of items.
+
+    Building is O(n); every draw takes a single rng.random() call, so it works
+    with random.Random and keeps shard RNG streams short.
+    """
+
+    def __init__(self, items, weights):
+        self.items = list(items)
+        n = len(self.items)
+        total = float(sum(weights))
+        if n == 0 or len(weights) != n or total <= 0 or min(weights) < 0:
+            raise ValueError("alias table needs non-negative weights with a positive sum, one per item")
+        scaled = [w * n / total for w in weights]
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+
+    def __len__(self):
+        return len(self.items)
+
+    def sample(self, rng):
+        u = rng.random() * len(self.items)
+        i = min(int(u), len(self.items) - 1)
+        return self.items[i if u - i < self.prob[i] else self.alias[i]]
+
+def _weights(config, names, default=1.0):
+    """Per-item weights from a {name: weight} mapping, default for unnamed items."""
+    unknown = set(config) - set(names)
+    if unknown:
+        raise ValueError(f"Unknown weight keys: {', '.join(sorted(unknown))}")
+    return [float(config.get(name, default)) for name in names]
+
+class WeightedSampler:
+    """Draws base templates, structures and text styles from configurable weights.
+
+    base_weights and structure_weights map 1-based ids to weights; structure
+    weights may also be keyed by category, which multiplies every structure
+    of that category. style_weights map STYLE_NAMES and "plain" to weights;
+    by default half the slots stay plain, like choose_text_style. With safe,
+    structures are drawn only from those the base template supports.
+    """
+
+    def __init__(self, base_weights=None, structure_weights=None, style_weights=None, safe=True):
+        self.config = {
+            "bases": dict(base_weights or {}),
+            "structures": dict(structure_weights or {}),
+            "styles": dict(style_weights or {}),
+            "safe": safe,
+        }
+        self.base_weights = _weights(self.config["bases"], [str(i + 1) for i in range(len(BASE_TEMPLATES))])
+        self.bases = AliasTable(range(len(BASE_TEMPLATES)), self.base_weights)
+
+        by_category = {k: v for k, v in self.config["structures"].items() if k in CATEGORIES}
+        by_id = {k: v for k, v in self.config["structures"].items() if k not in CATEGORIES}
+        self.structure_weights = [
+            w * float(by_category.get(category, 1.0))
+            for w, category in zip(_weights(by_id, [str(i + 1) for i in range(len(STRUCTURES))]), STRUCTURE_CATEGORIES)
+        ]
+        self.candidates = [
+            COMPATIBLE_STRUCTURES[base_id] if safe else tuple(range(len(STRUCTURES)))
+            for base_id in range(len(BASE_TEMPLATES))
+        ]
+        self.structures = [self._structure_table(candidates) for candidates in self.candidates]
+        for base_id in range(len(BASE_TEMPLATES)):
+            if self.structures[base_id] is None and self.base_weights[base_id] > 0:
+                raise ValueError(f"Base template {base_id + 1} has no structure with a positive weight")
+
+        names = [PLAIN_STYLE] + STYLE_NAMES
+        defaults = dict(zip(names, [float(len(STYLE_NAMES))] + [1.0] * len(STYLE_NAMES)))
+        defaults.update(self.config["styles"])
+        choices = list(zip(TEXT_STYLES, TEXT_MODE_STYLES))
+        self.styles = AliasTable([("", "")] + choices, _weights(defaults, names))
+
+    def _structure_table(self, candidates):
+        """Alias table over the candidates with a positive weight, or None if there are none."""
+        candidates = [i for i in candidates if self.structure_weights[i] > 0]
+        if not candidates:
+            return None
+        return AliasTable(candidates, [self.structure_weights[i] for i in candidates])
+
+    def shard(self, rng, n):
+        """Sampler to use for the next n templates; weighted draws need no plan."""
+        return self
+
+    def draw(self, rng):
+        """(base_id, structure_ids) of one template."""
+        base_id = self.bases.sample(rng)
+        table = self.structures[base_id]
+        num_sections = rng.randint(MIN_SECTIONS, MAX_SECTIONS)
+        return base_id, tuple(table.sample(rng) for _ in range(num_sections))
+
+    def style(self, rng, math=False):
+        """(prefix, suffix) of one slot."""
+        style = self.styles.sample(rng)
+        if style == ("", ""):
+            return style
+        return style[0] if math else style[1]
+
+def apportion(total, shares):
+    """Split total into integer counts proportional to shares (largest remainder)."""
+    weight = float(sum(shares.values()))
+    exact = {key: total * share / weight for key, share in shares.items()}
+    counts = {key: int(value) for key, value in exact.items()}
+    by_remainder = sorted(shares, key=lambda key: counts[key] - exact[key])
+    for key in by_remainder[:total - sum(counts.values())]:
+        counts[key] += 1
+    return counts
+
+class StratifiedSampler(WeightedSampler):
+    """WeightedSampler that meets exact per-category section quotas.
+
+    quotas maps categories (see template_generator.CATEGORIES) to shares;
+    categories left out are not sampled. For every shard, base templates and
+    section counts are drawn first; the shard's sections are then split into
+    categories in exactly the quota proportions and every section draws a
+    structure of its category. Sections of the most constrained base
+    templates are assigned first; a section whose base supports none of the
+    categories still open takes an allowed one, the only case in which a
+    quota is missed.
+
+    Plans cover whole shards of SHARD_SIZE templates so that a record does
+    not depend on how its batch is split into runs; a batch that starts or
+    stops inside a shard gets only part of that shard's plan, so quotas are
+    exact only over whole shards (see quota_warning).
+    """
+
+    def __init__(self, quotas, base_weights=None, structure_weights=None, style_weights=None, safe=True):
+        super().__init__(base_weights, structure_weights, style_weights, safe)
+        unknown = set(quotas) - set(CATEGORIES)
+        if unknown:
+            raise ValueError(f"Unknown categories: {', '.join(sorted(unknown))}")
+        self.quotas = {category: float(share) for category, share in quotas.items() if share > 0}
+        if not self.quotas:
+            raise ValueError("quotas need at least one category with a positive share")
+        self.config["quotas"] = dict(quotas)
+        self.by_category = [
+            {category: self._structure_table([i for i in candidates if STRUCTURE_CATEGORIES[i] == category])
+             for category in self.quotas}
+            for candidates in self.candidates
+        ]
+        self.allowed = [tuple(c for c, table in tables.items() if table is not None) for tables in self.by_category]
+        for base_id, allowed in enumerate(self.allowed):
+            if not allowed and self.base_weights[base_id] > 0:
+                raise ValueError(f"Base template {base_id + 1} supports none of the quota categories")
+
+    def shard(self, rng, n):
+        """Plan n templates whose sections meet the quotas exactly."""
+        bases = [self.bases.sample(rng) for _ in range(n)]
+        counts = [rng.randint(MIN_SECTIONS, MAX_SECTIONS) for _ in range(n)]
+        owners = [base_id for base_id, count in zip(bases, counts) for _ in range(count)]
+        remaining = apportion(len(owners), self.quotas)
+
+        categories = [None] * len(owners)
+        order = sorted(range(len(owners)), key=lambda i: (len(self.allowed[owners[i]]), rng.random()))
+        for i in order:
+            allowed = self.allowed[owners[i]]
+            open_categories = [c for c in allowed if remaining[c] > 0]
+            if open_categories:
+                u = rng.random() * sum(remaining[c] for c in open_categories)
+                for category in open_categories:
+                    u -= remaining[category]
+                    if u < 0:
+                        break
+                remaining[category] -= 1
+            else:  # quotas cannot be met exactly for this base; keep the sample valid
+                category = allowed[int(rng.random() * len(allowed))]
+            categories[i] = category
+
+        structures = [self.by_category[base_id][category].sample(rng) for base_id, category in zip(owners, categories)]
+        plan, position = [], 0
+        for base_id, count in zip(bases, counts):
+            plan.append((base_id, tuple(structures[position:position + count])))
+            position += count
+        return _ShardPlan(self, plan)
+
+class _ShardPlan:
+    """Pre-drawn (base_id, structure_ids) of one shard, handed out in order."""
+
+    def __init__(self, sampler, plan):
+        self.style = sampler.style
+        self._plan = iter(plan)
+
+    def draw(self, rng):
+        return next(self._plan)
+
+def quota_warning(sampler, start, count):
+    """Warning for a batch of count templates from start whose quotas cannot hold exactly, else None."""
+    stop = start + count
+    if not isinstance(sampler, StratifiedSampler) or count == 0:
+        return None
+    if start % SHARD_SIZE == 0 and stop % SHARD_SIZE == 0:
+        return None
+    return (f"warning: quotas are planned per shard of {SHARD_SIZE} templates; with a batch of "
+            f"[{start}, {stop}) they hold only approximately, as the batch does not start and stop on "
+            f"a multiple of {SHARD_SIZE}")
+
+def load_sampler(path):
+    """Build a sampler from a JSON file such as
+
+        {"bases": {"1": 2, "12": 0},
+         "structures": {"9": 3, "theorem": 0.5},
+         "styles": {"plain": 9, "bold": 2},
+         "quotas": {"table": 1, "equation": 1, "list": 1},
+         "safe": true}
+
+    Every key is optional; with "quotas" the sampler is stratified.
+    """
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    weights = dict(
+        base_weights=config.get("bases"),
+        structure_weights=config.get("structures"),
+        style_weights=config.get("styles"),
+        safe=config.get("safe", True),
+    )
+    if config.get("quotas"):
+        return StratifiedSampler(config["quotas"], **weights)
+    return WeightedSampler(**weights)
@@ -1,601 +1,714 @@
+import os
+import re
+import sys
+import json
 import random
+import marshal
+import hashlib
 import argparse
-
-def apply_text_style(text_placeholder):
-    """Apply random text styles 50% of the time; otherwise, return plain text."""
-    if random.random() < 0.5:  # 50% chance for plain text
-        return text_placeholder
-    styles = [
-        r"\textbf{{{}}}".format(text_placeholder),  # Bold
-        r"\textit{{{}}}".format(text_placeholder),  # Italic
-        r"\underline{{{}}}".format(text_placeholder),  # Underline
-        r"\texttt{{{}}}".format(text_placeholder),  # Typewriter
-        r"\textsc{{{}}}".format(text_placeholder),  # Small caps
-        r"Prefix-{{{}}}-Suffix".format(text_placeholder),  # Prefix and suffix
-        r"\textbf{{\textit{{{}}}}}".format(text_placeholder),  # Bold italic (fixed)
-        r"{{{}}} superscript^{{sup}}".format(text_placeholder),  # Superscript
-        r"{{{}}} subscript_{{sub}}".format(text_placeholder),  # Subscript
-    ]
-    return random.choice(styles)
-
-def generate_random_template(output_path):
-    """Generate a random LaTeX template with at least 50 structures and 30 base templates."""
-    structures = [
-    # 1-3: Headings
-    r"\section{{{}}}".format(apply_text_style("{TEXT_HERE}")),
-    r"\subsection{{{}}}".format(apply_text_style("{TEXT_HERE}")),
-    r"\subsubsection{{{}}}".format(apply_text_style("{TEXT_HERE}")),
-
-    # 4-8: Lists
-    r"\begin{{itemize}}\n    \item {{{}}}\n    \item {{{}}}\n\end{{itemize}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\begin{{enumerate}}\n    \item {{{}}}\n    \item {{{}}}\n\end{{enumerate}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\begin{{description}}\n    \item[{{{}}}] {{{}}}\n\end{{description}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\begin{{itemize}}\n    \item {{{}}}\n    \begin{{enumerate}}\n        \item {{{}}}\n    \end{{enumerate}}\n\end{{itemize}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\begin{{enumerate}}\n    \item {{{}}}\n    \begin{{itemize}}\n        \item {{{}}}\n    \end{{itemize}}\n\end{{enumerate}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-
-    # 9-15: Tables
-    r"\begin{{tabular}}{{|c|c|}}\n\hline\n    {{{}}} & {{{}}} \\\\\n\hline\n\end{{tabular}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\begin{{tabular}}{{||l|r||}}\n\hline\n    {{{}}} & {{{}}} \\\\\n    {{{}}} & {{{}}} \\\\\n\hline\n\end{{tabular}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}"),
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\begin{{tabular}}{{|c|c|c|}}\n\hline\n    {{{}}} & {{{}}} & {{{}}} \\\\\n\hline\n\end{{tabular}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\begin{{table}}[h]\n\centering\n    \begin{{tabular}}{{|c|c|}}\n    \hline\n        {{{}}} & {{{}}} \\\\\n    \hline\n    \end{{tabular}}\n    \caption{{{}}}\n\end{{table}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\begin{{table}}[h]\n\centering\n    \begin{{tabular}}{{|c|c|c|}}\n    \hline\n        \multicolumn{{2}}{{|c|}}{{{}}} & {{{}}} \\\\\n    \hline\n        {{{}}} & {{{}}} & {{{}}} \\\\\n    \hline\n    \end{{tabular}}\n\end{{table}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}"),
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\begin{{tabular}}{{|c|c|c|}}\n\hline\n    \multirow{{2}}{{*}}{{{}}} & {{{}}} & {{{}}} \\\\\n    \cline{{2-3}}\n     & {{{}}} & {{{}}} \\\\\n\hline\n\end{{tabular}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}"),
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\begin{{tabular}}{{|l|c|r|}}\n\hline\n    {{{}}} & \multicolumn{{2}}{{|c|}}{{{}}} \\\\\n\hline\n    {{{}}} & {{{}}} & {{{}}} \\\\\n\hline\n\end{{tabular}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}"),
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-
-    # 16-22: Equations
-    r"Equation: ${{{}}}$".format(apply_text_style("{TEXT_HERE}")),
-    r"Equation: $\frac{{{}}}{{{}}}$".format(apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")),
-    r"Equation: ${{}} = {{}}$".format(apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")),
-    r"\begin{{equation}}\n    {{{}}} = {{{}}}^2\n\end{{equation}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\begin{{equation}}\n    \sqrt{{{}}} = {{{}}}\n\end{{equation}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\begin{{align}}\n    {{{}}} &= {{{}}} \\\\\n    {{{}}} &= {{{}}}\n\end{{align}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}"),
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\begin{{align*}}\n    {{{}}} + {{{}}} &= {{{}}} \\\\\n    {{{}}} &= \int {{{}}} \,dx\n\end{{align*}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}"),
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-
-    # 23-27: Multi-column layouts
-    r"\begin{{multicols}}{{2}}\n    {{{}}}\n    \columnbreak\n    {{{}}}\n\end{{multicols}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\begin{{multicols}}{{3}}\n    {{{}}}\n    \columnbreak\n    {{{}}}\n    \columnbreak\n    {{{}}}\n\end{{multicols}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\begin{{multicols}}{{2}}\n    {{{}}}\n    \begin{{itemize}}\n        \item {{{}}}\n    \end{{itemize}}\n    \columnbreak\n    {{{}}}\n\end{{multicols}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\begin{{multicols}}{{2}}\n    {{{}}}\n    \begin{{tabular}}{{|c|}}\n    \hline\n        {{{}}}\n    \hline\n    \end{{tabular}}\n    \columnbreak\n    {{{}}}\n\end{{multicols}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\begin{{multicols}}{{3}}\n    {{{}}}\n    \columnbreak\n    {{{}}}\n    \begin{{equation}}\n        {{{}}}\n    \end{{equation}}\n    \columnbreak\n    {{{}}}\n\end{{multicols}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-
-    # 28-35: Nested structures
-    r"\section{{{}}}\n    {{{}}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\section{{{}}}\n    \begin{{itemize}}\n        \item {{{}}}\n    \end{{itemize}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\subsection{{{}}}\n    \begin{{tabular}}{{|c|c|}}\n    \hline\n        {{{}}} & {{{}}} \\\\\n    \hline\n    \end{{tabular}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\begin{{center}}\n    {{{}}}\n    \begin{{equation}}\n        {{{}}} = {{{}}}\n    \end{{equation}}\n\end{{center}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\begin{{itemize}}\n    \item {{{}}}\n    \begin{{align}}\n        {{{}}} &= {{{}}}\n    \end{{align}}\n\end{{itemize}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\begin{{tabular}}{{|c|}}\n\hline\n    {{{}}}\n    \begin{{itemize}}\n        \item {{{}}}\n    \end{{itemize}}\n\hline\n\end{{tabular}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\section{{{}}}\n\begin{{center}}\n    {{{}}}\n\end{{center}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\begin{{description}}\n    \item[{{{}}}] {{{}}}\n    \begin{{equation}}\n        {{{}}}\n    \end{{equation}}\n\end{{description}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-
-    # 36-40: Figures and boxes
-    r"\begin{{figure}}[h]\n\centering\n    \fbox{{{}}}\n    \caption{{{}}}\n\end{{figure}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\begin{{figure}}[h]\n\centering\n    {{{}}}\n    \caption{{{}}}\n\end{{figure}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\fbox{{{}}}".format(apply_text_style("{TEXT_HERE}")),
-    r"\framebox{{{}}}\n{{{}}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\begin{{center}}\n    \fbox{{{}}}\n\end{{center}}".format(apply_text_style("{TEXT_HERE}")),
-
-    # 41-45: Theorem-like environments
-    r"\begin{{theorem}}\n    {{{}}}\n\end{{theorem}}".format(apply_text_style("{TEXT_HERE}")),
-    r"\begin{{proof}}\n    {{{}}}\n\end{{proof}}".format(apply_text_style("{TEXT_HERE}")),
-    r"\begin{{theorem}}\n    {{{}}}\n    \begin{{proof}}\n        {{{}}}\n    \end{{proof}}\n\end{{theorem}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\begin{{lemma}}\n    {{{}}}\n\end{{lemma}}".format(apply_text_style("{TEXT_HERE}")),
-    r"\begin{{proposition}}\n    {{{}}}\n\end{{proposition}}".format(apply_text_style("{TEXT_HERE}")),
-
-    # 46-50: Miscellaneous
-    r"\textbf{{{}}}\n{{{}}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\textit{{{}}}\n\begin{{center}}\n    {{{}}}\n\end{{center}}".format(
-        apply_text_style("{TEXT_HERE}"), apply_text_style("{TEXT_HERE}")
-    ),
-    r"\begin{{flushleft}}\n    {{{}}}\n\end{{flushleft}}".format(apply_text_style("{TEXT_HERE}")),
-    r"\begin{{flushright}}\n    {{{}}}\n\end{{flushright}}".format(apply_text_style("{TEXT_HERE}")),
-    r"\begin{{quote}}\n    {{{}}}\n\end{{quote}}".format(apply_text_style("{TEXT_HERE}"))
-    ]
-
-    # Verify we have at least 50 structures
-    assert len(structures) >= 50, f"Only {len(structures)} structures defined, need at least 50"
-
-    # Randomly choose number of sections (1 to 7 for variety)
-    num_sections = random.randint(1, 7)
-    content = "\n\n".join(random.choices(structures, k=num_sections))
-
-    # 30 distinct base templates
-    base_templates = [
-        # 1: Basic article
-        r"""
-    \documentclass{{article}}
-    \usepackage[utf8]{{inputenc}}
-    \usepackage{{geometry}}
-    \geometry{{a4paper}}
-    \begin{{document}}
-    """ + content + r"""
-    \end{{document}}
-    """,
-
-        # 2: Article with math and theorems
-        r"""
-    \documentclass{{article}}
-    \usepackage[utf8]{{inputenc}}
-    \usepackage{{amsmath, amssymb, amsthm}}
-    \usepackage{{multirow}}
-    \newtheorem{{theorem}}{{Theorem}}
-    \newtheorem{{proof}}{{Proof}}
-    \newtheorem{{lemma}}{{Lemma}}
-    \newtheorem{{proposition}}{{Proposition}}
-    \usepackage{{geometry}}
-    \geometry{{a4paper}}
-    \begin{{document}}
-    """ + content + r"""
-    \end{{document}}
-    """,
-
-        # 3: Multi-column article
-        r"""
-    \documentclass{{article}}
-    \usepackage[utf8]{{inputenc}}
-    \usepackage{{multicol}}
-    \usepackage{{geometry}}
-    \geometry{{a4paper}}
-    \begin{{document}}
-    """ + content + r"""
-    \end{{document}}
-    """,
-
-        # 4: Report with title page
-        r"""
-    \documentclass{{report}}
-    \usepackage[utf8]{{inputenc}}
-    \usepackage{{geometry}}
-    \geometry{{a4paper}}
-    \begin{{document}}
-    \title{{{}}}
-    \author{{{}}}
-    \date{{{}}}
-    \maketitle
-    """.format(
-            apply_text_style("{TEXT_HERE}"),
-            apply_text_style("{TEXT_HERE}"),
-            apply_text_style("{TEXT_HERE}")
-        ) + content + r"""
-    \end{{document}}
-    """,
-
-        # 5: Book with chapter
-        r"""
-    \documentclass{{book}}
-    \usepackage[utf8]{{inputenc}}
-    \usepackage{{geometry}}
-    \geometry{{a4paper}}
-    \begin{{document}}
-    \chapter{{{}}}
-    """.format(apply_text_style("{TEXT_HERE}")) + content + r"""
-    \end{{document}}
-    """,
-
-        # 6: Article with fancy headers
-        r"""
-    \documentclass{{article}}
-    \usepackage[utf8]{{inputenc}}
-    \usepackage{{fancyhdr}}
-    \usepackage{{geometry}}
-    \geometry{{a4paper}}
-    \pagestyle{{fancy}}
-    \fancyhead[L]{{{}}}
-    \fancyhead[R]{{{}}}
-    \begin{{document}}
-    """.format(
-            apply_text_style("{TEXT_HERE}"),
-            apply_text_style("{TEXT_HERE}")
-        ) + content + r"""
-    \end{{document}}
-    """,
-
-        # 7: Two-column article
-        r"""
-    \documentclass[twocolumn]{{article}}
-    \usepackage[utf8]{{inputenc}}
-    \usepackage{{geometry}}
-    \geometry{{a4paper}}
-    \begin{{document}}
-    """ + content + r"""
-    \end{{document}}
-    """,
-
-        # 8: Article with colored text
-        r"""
-    \documentclass{{article}}
-    \usepackage[utf8]{{inputenc}}
-    \usepackage{{xcolor}}
-    \usepackage{{geometry}}
-    \geometry{{a4paper}}
-    \begin{{document}}
-    \color{{blue}}
-    """ + content + r"""
-    \end{{document}}
-    """,
-
-        # 9: Report with table of contents
-        r"""
-    \documentclass{{report}}
-    \usepackage[utf8]{{inputenc}}
-    \usepackage{{geometry}}
-    \geometry{{a4paper}}
-    \begin{{document}}
-    \tableofcontents
-    \newpage
-    """ + content + r"""
-    \end{{document}}
-    """,
-
-        # 10: Book with front matter
-        r"""
-    \documentclass{{book}}
-    \usepackage[utf8]{{inputenc}}
-    \usepackage{{geometry}}
-    \geometry{{a4paper}}
-    \begin{{document}}
-    \frontmatter
-    \title{{{}}}
-    \maketitle
-    \mainmatter
-    """.format(apply_text_style("{TEXT_HERE}")) + content + r"""
-    \end{{document}}
-    """,
-
-        # 11: Article with bibliography
-        r"""
-    \documentclass{{article}}
-    \usepackage[utf8]{{inputenc}}
-    \usepackage{{geometry}}
-    \geometry{{a4paper}}
-    \begin{{document}}
-    """ + content + r"""
-    \begin{{thebibliography}}{{9}}
-    \bibitem{{{}}} {{{}}}
-    \end{{thebibliography}}
-    \end{{document}}
-    """.format(
-            apply_text_style("{TEXT_HERE}"),
-            apply_text_style("{TEXT_HERE}")
-        ),
-
-        # 12: Minimal class
-        r"""
-    \documentclass{{minimal}}
-    \usepackage[utf8]{{inputenc}}
-    \begin{{document}}
-    """ + content + r"""
-    \end{{document}}
-    """,
-
-        # 13: Letter class
-        r"""
-    \documentclass{{letter}}
-    \usepackage[utf8]{{inputenc}}
-    \begin{{document}}
-    \signature{{{}}}
-    \address{{{}}}
-    \begin{{letter}}{{{}}}
-    \opening{{{}}}
-    """.format(
-            apply_text_style("{TEXT_HERE}"),
-            apply_text_style("{TEXT_HERE}"),
-            apply_text_style("{TEXT_HERE}"),
-            apply_text_style("{TEXT_HERE}")
-        ) + content + r"""
-    \closing{{{}}}
-    \end{{letter}}
-    \end{{document}}
-    """.format(apply_text_style("{TEXT_HERE}")),
-
-        # 14: Article with boxed title
-        r"""
-    \documentclass{{article}}
-    \usepackage[utf8]{{inputenc}}
-    \usepackage{{geometry}}
-    \geometry{{a4paper}}
-    \begin{{document}}
-    \fbox{{\textbf{{{}}}}}
-    """.format(apply_text_style("{TEXT_HERE}")) + content + r"""
-    \end{{document}}
-    """,
-
-        # 15: Article with custom margins
-        r"""
-    \documentclass{{article}}
-    \usepackage[utf8]{{inputenc}}
-    \usepackage{{geometry}}
-    \geometry{{a4paper, margin=0.5in}}
-    \begin{{document}}
-    """ + content + r"""
-    \end{{document}}
-    """,
-
-        # 16: Article with landscape orientation
-        r"""
-    \documentclass{{article}}
-    \usepackage[utf8]{{inputenc}}
-    \usepackage[landscape]{{geometry}}
-    \geometry{{a4paper}}
-    \begin{{document}}
-    """ + content + r"""
-    \end{{document}}
-    """,
-
-        # 17: Memoir class with chapter
-        r"""
-    \documentclass{{memoir}}
-    \usepackage[utf8]{{inputenc}}
-    \usepackage{{geometry}}
-    \geometry{{a4paper}}
-    \begin{{document}}
-    \chapter{{{}}}
-    """.format(apply_text_style("{TEXT_HERE}")) + content + r"""
-    \end{{document}}
-    """,
-
-        # 18: Article with header and footer
-        r"""
-    \documentclass{{article}}
-    \usepackage[utf8]{{inputenc}}
-    \usepackage{{fancyhdr}}
-    \usepackage{{geometry}}
-    \geometry{{a4paper}}
-    \pagestyle{{fancy}}
-    \fancyhead[C]{{{}}}
-    \fancyfoot[C]{{{}}}
-    \begin{{document}}
-    """.format(
-            apply_text_style("{TEXT_HERE}"),
-            apply_text_style("{TEXT_HERE}")
-        ) + content + r"""
-    \end{{document}}
-    """,
-
-        # 19: Poster-like article
-        r"""
-    \documentclass{{article}}
-    \usepackage[utf8]{{inputenc}}
-    \usepackage{{geometry}}
-    \geometry{{a0paper}}
-    \begin{{document}}
-    """ + content + r"""
-    \end{{document}}
-    """,
-
-        # 20: Article with watermark
-        r"""
-    \documentclass{{article}}
-    \usepackage[utf8]{{inputenc}}
-    \usepackage{{draftwatermark}}
-    \SetWatermarkText{{{}}}
-    \usepackage{{geometry}}
-    \geometry{{a4paper}}
-    \begin{{document}}
-    """.format(apply_text_style("{TEXT_HERE}")) + content + r"""
-    \end{{document}}
-    """,
-
-        # 21: Article with custom font size
-        r"""
-    \documentclass[12pt]{{article}}
-    \usepackage[utf8]{{inputenc}}
-    \usepackage{{geometry}}
-    \geometry{{a4paper}}
-    \begin{{document}}
-    """ + content + r"""
-    \end{{document}}
-    """,
-
-        # 22: Beamer slide (presentation)
-        r"""
-    \documentclass{{beamer}}
-    \usepackage[utf8]{{inputenc}}
-    \begin{{document}}
-    \begin{{frame}}
-    \frametitle{{{}}}
-    """.format(apply_text_style("{TEXT_HERE}")) + content + r"""
-    \end{{frame}}
-    \end{{document}}
-    """,
-
-        # 23: Article with abstract
-        r"""
-    \documentclass{{article}}
-    \usepackage[utf8]{{inputenc}}
-    \usepackage{{geometry}}
-    \geometry{{a4paper}}
-    \begin{{document}}
-    \begin{{abstract}}
-    {{{}}}
-    \end{{abstract}}
-    """.format(apply_text_style("{TEXT_HERE}")) + content + r"""
-    \end{{document}}
-    """,
-
-        # 24: Article with custom section numbering
-        r"""
-    \documentclass{{article}}
-    \usepackage[utf8]{{inputenc}}
-    \renewcommand{{\thesection}}{{\Roman{{section}}}}
-    \usepackage{{geometry}}
-    \geometry{{a4paper}}
-    \begin{{document}}
-    """ + content + r"""
-    \end{{document}}
-    """,
-
-        # 25: Article with boxed content
-        r"""
-    \documentclass{{article}}
-    \usepackage[utf8]{{inputenc}}
-    \usepackage{{boxedminipage}}
-    \usepackage{{geometry}}
-    \geometry{{a4paper}}
-    \begin{{document}}
-    \begin{{boxedminipage}}{{\textwidth}}
-    """ + content + r"""
-    \end{{boxedminipage}}
-    \end{{document}}
-    """,
-
-        # 26: Article with rotated text
-        r"""
-    \documentclass{{article}}
-    \usepackage[utf8]{{inputenc}}
-    \usepackage{{rotating}}
-    \usepackage{{geometry}}
-    \geometry{{a4paper}}
-    \begin{{document}}
-    \begin{{sideways}}
-    {{{}}}
-    \end{{sideways}}
-    """.format(apply_text_style("{TEXT_HERE}")) + content + r"""
-    \end{{document}}
-    """,
-
-        # 27: Article with custom line spacing
-        r"""
-    \documentclass{{article}}
-    \usepackage[utf8]{{inputenc}}
-    \usepackage{{setspace}}
-    \doublespacing
-    \usepackage{{geometry}}
-    \geometry{{a4paper}}
-    \begin{{document}}
-    """ + content + r"""
-    \end{{document}}
-    """,
-
-        # 28: Article with background color
-        r"""
-    \documentclass{{article}}
-    \usepackage[utf8]{{inputenc}}
-    \usepackage{{xcolor}}
-    \usepackage{{geometry}}
-    \geometry{{a4paper}}
-    \pagecolor{{lightgray}}
-    \begin{{document}}
-    """ + content + r"""
-    \end{{document}}
-    """,
-
-        # 29: Article with custom page numbering
-        r"""
-    \documentclass{{article}}
-    \usepackage[utf8]{{inputenc}}
-    \pagenumbering{{roman}}
-    \usepackage{{geometry}}
-    \geometry{{a4paper}}
-    \begin{{document}}
-    """ + content + r"""
-    \end{{document}}
-    """,
-
-        # 30: Article with appendix
-        r"""
-    \documentclass{{article}}
-    \usepackage[utf8]{{inputenc}}
-    \usepackage{{geometry}}
-    \geometry{{a4paper}}
-    \begin{{document}}
-    """ + content + r"""
-    \appendix
-    \section{{{}}}
-    \end{{document}}
-    """.format(apply_text_style("{TEXT_HERE}"))
+from collections import namedtuple
+from contextlib import nullcontext
+from string import Formatter
+
+TEXT_HERE = "{TEXT_HERE}"
+
+# Templates per shard; every shard draws from its own seeded RNG
+SHARD_SIZE = 1000
+
+# Templates per packed output file
+PACKED_SHARD_SIZE = 100000
+
+# Field name marking where the sampled structures go inside a base template
+CONTENT = "content"
+
+# Text styles as (prefix, suffix) pairs wrapped around a placeholder
+TEXT_STYLES = [
+    (r"\textbf{", "}"),  # Bold
+    (r"\textit{", "}"),  # Italic
+    (r"\underline{", "}"),  # Underline
+    (r"\texttt{", "}"),  # Typewriter
+    (r"\textsc{", "}"),  # Small caps
+    ("Prefix-{", "}-Suffix"),  # Prefix and suffix
+    (r"\textbf{\textit{", "}}"),  # Bold italic (fixed)
+    ("{", "} superscript^{sup}"),  # Superscript
+    ("{", "} subscript_{sub}"),  # Subscript
+]
+
+# Names of TEXT_STYLES, used to configure style weights; "plain" is an unstyled slot
+STYLE_NAMES = ["bold", "italic", "underline", "typewriter", "smallcaps", "affix", "bolditalic", "superscript",
+               "subscript"]
+PLAIN_STYLE = "plain"
+assert len(STYLE_NAMES) == len(TEXT_STYLES)
+
+# ^ and _ only work in math mode; slots in text mode use the text commands instead
+_TEXT_MODE_OVERRIDES = {
+    ("{", "} superscript^{sup}"): ("{", r"} superscript\textsuperscript{sup}"),
+    ("{", "} subscript_{sub}"): ("{", r"} subscript\textsubscript{sub}"),
+}
+TEXT_MODE_STYLES = [_TEXT_MODE_OVERRIDES.get(style, style) for style in TEXT_STYLES]
+
+# Style id of every (prefix, suffix) pair: 0 is plain, i + 1 is STYLE_NAMES[i] in math or text mode
+STYLE_IDS = {("", ""): 0}
+for _style_id, _styles in enumerate(zip(TEXT_STYLES, TEXT_MODE_STYLES), 1):
+    STYLE_IDS.update(dict.fromkeys(_styles, _style_id))
+
+# Structure and base template skeletons (see the file's "description")
+CATALOGUE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalogue.json")
+
+# Environment variable naming another catalogue file; worker processes inherit it
+CATALOGUE_ENV = "SYNTHLATEX_CATALOGUE"
+
+# Version of the compiled catalogue cache; bump it when Skeleton changes
+_CATALOGUE_CACHE_VERSION = 1
+
+# A compiled skeleton: literal segments interleaved with len(segments) - 1 fields,
+# and whether each field sits in math mode
+Skeleton = namedtuple("Skeleton", ["segments", "fields", "math"])
+
+_MATH_TOKEN = re.compile(r"\\begin\{(?:equation|align\*?)\}|\\end\{(?:equation|align\*?)\}|\$")
+
+def _fields_in_math(segments):
+    """Math mode at the end of each segment but the last, i.e. at every field."""
+    math, modes = False, []
+    for segment in segments[:-1]:
+        for token in _MATH_TOKEN.findall(segment):
+            math = token.startswith(r"\begin") or (token == "$" and not math)
+        modes.append(math)
+    return tuple(modes)
+
+def compile_skeleton(source):
+    """Split a str.format skeleton into literal segments and slot fields once."""
+    segments, fields = [], []
+    literal = ""
+    for text, field, _, _ in Formatter().parse(source):
+        literal += text
+        if field is not None:
+            segments.append(literal)
+            fields.append(field)
+            literal = ""
+    segments.append(literal)
+    return Skeleton(tuple(segments), tuple(fields), _fields_in_math(segments))
+
+def render_skeleton(skeleton, content="", rng=random, slots=None, offset=0, content_slots=(), choose_style=None,
+                    styles=None, content_styles=()):
+    """Render a compiled skeleton, styling only its own slots.
+
+    If slots is a list, the (start, end) span of every placeholder is appended
+    to it in text order, shifted by offset. content_slots are the spans inside
+    content, relative to its start. choose_style(rng, math) picks the
+    (prefix, suffix) of each slot and defaults to choose_text_style. If styles
+    is a list, the STYLE_IDS of the slots are appended to it in the same order,
+    with content_styles for those inside content.
+    """
+    choose_style = choose_style or choose_text_style
+    parts = [skeleton.segments[0]]
+    length = offset + len(parts[0])
+    for field, math, segment in zip(skeleton.fields, skeleton.math, skeleton.segments[1:]):
+        if field == CONTENT:
+            piece = content
+            if slots is not None:
+                slots.extend((start + length, end + length) for start, end in content_slots)
+            if styles is not None:
+                styles.extend(content_styles)
+        else:
+            prefix, suffix = choose_style(rng, math)
+            piece = prefix + TEXT_HERE + suffix
+            if slots is not None:
+                start = length + len(prefix)
+                slots.append((start, start + len(TEXT_HERE)))
+            if styles is not None:
+                styles.append(STYLE_IDS[prefix, suffix])
+        parts.append(piece)
+        parts.append(segment)
+        length += len(piece) + len(segment)
+    return "".join(parts)
+
+def parse_catalogue(data, path="catalogue"):
+    """(structure sources, base template sources) of the JSON text of a catalogue file."""
+    catalogue = json.loads(data)
+    sources = []
+    for key in ("structures", "base_templates"):
+        entries = catalogue.get(key)
+        if not entries:
+            raise ValueError(f"{path} defines no {key}")
+        sources.append([
+            entry["source"] if isinstance(entry["source"], str) else "\n".join(entry["source"])
+            for entry in entries
+        ])
+    return sources
+
+def load_catalogue(path=CATALOGUE_PATH):
+    """(digest, structures, base templates) of a catalogue file, compiled into Skeletons.
+
+    The compiled skeletons are cached as marshal data in __pycache__ next to
+    the file, named by a hash of its contents, so starting up only reads and
+    hashes the file. An unwritable directory just means no cache.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data + bytes([_CATALOGUE_CACHE_VERSION])).hexdigest()[:16]
+    directory, name = os.path.split(os.path.abspath(path))
+    cache = os.path.join(directory, "__pycache__", f"{os.path.splitext(name)[0]}.{digest}.marshal")
+    try:
+        with open(cache, "rb") as f:
+            compiled = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        compiled = [[tuple(compile_skeleton(source)) for source in sources]
+                    for sources in parse_catalogue(data.decode("utf-8"), path)]
+        try:
+            os.makedirs(os.path.dirname(cache), exist_ok=True)
+            partial = f"{cache}.{os.getpid()}.tmp"
+            with open(partial, "wb") as f:
+                marshal.dump(compiled, f)
+            os.replace(partial, cache)
+        except OSError:
+            pass
+    structures, bases = ([Skeleton(*skeleton) for skeleton in skeletons] for skeletons in compiled)
+    return digest, structures, bases
+
+CATALOGUE_DIGEST, STRUCTURES, BASE_TEMPLATES = load_catalogue(os.environ.get(CATALOGUE_ENV) or CATALOGUE_PATH)
+
+# Verify the built-in catalogue has at least 50 structures and 30 base templates
+if CATALOGUE_ENV not in os.environ:
+    assert len(STRUCTURES) >= 50, f"Only {len(STRUCTURES)} structures defined, need at least 50"
+    assert len(BASE_TEMPLATES) >= 30, f"Only {len(BASE_TEMPLATES)} base templates defined, need at least 30"
+
+# Feature each LaTeX construct needs from the document class, a package or a \newtheorem
+CONSTRUCT_REQUIREMENTS = {
+    r"\chapter": "chapters",
+    r"\section": "sectioning",
+    r"\subsection": "sectioning",
+    r"\subsubsection": "sectioning",
+    r"\begin{itemize}": "lists",
+    r"\begin{enumerate}": "lists",
+    r"\begin{description}": "lists",
+    r"\begin{figure}": "floats",
+    r"\begin{table}": "floats",
+    r"\caption": "floats",
+    r"\begin{equation}": "equation",
+    r"\begin{quote}": "quote",
+    r"\begin{align}": "amsmath",
+    r"\begin{align*}": "amsmath",
+    r"\begin{multicols}": "multicol",
+    r"\multirow": "multirow",
+    r"\begin{theorem}": "theorem",
+    r"\begin{lemma}": "lemma",
+    r"\begin{proposition}": "proposition",
+    r"\begin{proof}": "proof",
+}
+
+# Features each document class provides on its own
+CLASS_FEATURES = {
+    "article": {"sectioning", "lists", "floats", "equation", "quote"},
+    "report": {"chapters", "sectioning", "lists", "floats", "equation", "quote"},
+    "book": {"chapters", "sectioning", "lists", "floats", "equation", "quote"},
+    "memoir": {"chapters", "sectioning", "lists", "floats", "equation", "quote"},
+    # beamer loads amsmath and amsthm and predefines theorem-like environments;
+    # sectioning commands are not allowed inside the frame the content goes in
+    "beamer": {"lists", "floats", "equation", "quote", "amsmath", "theorem", "lemma", "proof"},
+    "letter": {"lists", "quote"},
+    "minimal": set(),
+}
+
+# Features a package provides beyond its own name
+PACKAGE_FEATURES = {"amsthm": {"proof"}}
+
+# Environments around the content that rule out features inside them
+CONTENT_ENVIRONMENT_EXCLUSIONS = {"boxedminipage": {"floats"}, "minipage": {"floats"}}
+
+_DOCUMENTCLASS = re.compile(r"\\documentclass(?:\[[^\]]*\])?\{([^}]*)\}")
+_USEPACKAGE = re.compile(r"\\usepackage(?:\[[^\]]*\])?\{([^}]*)\}")
+_NEWTHEOREM = re.compile(r"\\newtheorem\{([^}]*)\}")
+
+def skeleton_requirements(skeleton):
+    """Features the constructs of a skeleton need to compile."""
+    source = "".join(skeleton.segments)
+    return frozenset(feature for construct, feature in CONSTRUCT_REQUIREMENTS.items() if construct in source)
+
+def base_features(skeleton):
+    """Features available to the content of a base template."""
+    source = "".join(skeleton.segments)
+    features = set(CLASS_FEATURES[_DOCUMENTCLASS.search(source).group(1)])
+    for match in _USEPACKAGE.finditer(source):
+        for package in match.group(1).split(","):
+            package = package.strip()
+            features.add(package)
+            features |= PACKAGE_FEATURES.get(package, set())
+    features.update(_NEWTHEOREM.findall(source))
+    before_content = "".join(skeleton.segments[:skeleton.fields.index(CONTENT) + 1])
+    for environment, excluded in CONTENT_ENVIRONMENT_EXCLUSIONS.items():
+        if before_content.count(rf"\begin{{{environment}}}") > before_content.count(rf"\end{{{environment}}}"):
+            features -= excluded
+    return frozenset(features)
+
+
+# Layout category of a structure: the first category whose marker its source contains
+CATEGORY_MARKERS = [
+    ("theorem", (r"\begin{theorem}", r"\begin{lemma}", r"\begin{proposition}", r"\begin{proof}")),
+    ("figure", (r"\begin{figure}",)),
+    ("columns", (r"\begin{multicols}",)),
+    ("table", (r"\begin{tabular}",)),
+    ("equation", ("$", r"\begin{equation}", r"\begin{align")),
+    ("list", (r"\begin{itemize}", r"\begin{enumerate}", r"\begin{description}")),
+    ("heading", (r"\section", r"\subsection", r"\subsubsection")),
+    ("box", (r"\fbox", r"\framebox")),
+]
+TEXT_CATEGORY = "text"
+CATEGORIES = [category for category, _ in CATEGORY_MARKERS] + [TEXT_CATEGORY]
+
+def structure_category(skeleton):
+    """Layout category of a structure skeleton, one of CATEGORIES."""
+    source = "".join(skeleton.segments)
+    for category, markers in CATEGORY_MARKERS:
+        if any(marker in source for marker in markers):
+            return category
+    return TEXT_CATEGORY
+
+def catalogue_tables(structures, bases):
+    """Requirements, features, compatible structures and categories of a catalogue, checked."""
+    requirements = [skeleton_requirements(structure) for structure in structures]
+    features = [base_features(base) for base in bases]
+    # Structures each base template can hold without failing to compile
+    compatible = [
+        tuple(i for i, needed in enumerate(requirements) if needed <= provided)
+        for provided in features
     ]
-
-
-    # Verify we have at least 30 base templates
-    assert len(base_templates) >= 30, f"Only {len(base_templates)} base templates defined, need at least 30"
-
-    # Choose a random base template
-    template = random.choice(base_templates)
+    for base_id, base in enumerate(bases):
+        if not skeleton_requirements(base) <= features[base_id]:
+            raise ValueError(f"Base template {base_id + 1} cannot compile")
+        if not compatible[base_id]:
+            raise ValueError(f"Base template {base_id + 1} supports no structure")
+    categories = [structure_category(structure) for structure in structures]
+    return requirements, features, compatible, categories
+
+STRUCTURE_REQUIREMENTS, BASE_FEATURES, COMPATIBLE_STRUCTURES, STRUCTURE_CATEGORIES = catalogue_tables(
+    STRUCTURES, BASE_TEMPLATES)
+
+def use_catalogue(path):
+    """Switch this process, and the worker processes it starts, to the catalogue file at path.
+
+    The catalogue tables are replaced in place, so modules that imported them
+    by name see the new catalogue too. Call it before building samplers.
+    """
+    global CATALOGUE_DIGEST
+    path = os.path.abspath(path)
+    digest, structures, bases = load_catalogue(path)
+    tables = catalogue_tables(structures, bases)
+    os.environ[CATALOGUE_ENV] = path
+    CATALOGUE_DIGEST = digest
+    STRUCTURES[:], BASE_TEMPLATES[:] = structures, bases
+    for table, values in zip((STRUCTURE_REQUIREMENTS, BASE_FEATURES, COMPATIBLE_STRUCTURES, STRUCTURE_CATEGORIES),
+                             tables):
+        table[:] = values
+
+def missing_requirements(base_id, structure_ids):
+    """Features the structures need that the base template does not provide."""
+    missing = set()
+    for structure_id in structure_ids:
+        missing |= STRUCTURE_REQUIREMENTS[structure_id] - BASE_FEATURES[base_id]
+    return missing
+
+def choose_text_style(rng=random, math=False):
+    """Pick a random (prefix, suffix) style 50% of the time; otherwise, plain text."""
+    if rng.random() < 0.5:  # 50% chance for plain text
+        return "", ""
+    return rng.choice(TEXT_STYLES if math else TEXT_MODE_STYLES)
+
+def apply_text_style(text_placeholder, rng=random, math=False):
+    """Apply random text styles 50% of the time; otherwise, return plain text."""
+    prefix, suffix = choose_text_style(rng, math)
+    return prefix + text_placeholder + suffix
+
+# A sampled template: its batch index, catalogue choices, rendered text, the
+# (start, end) span of every slot in the text and the style id of every slot
+TemplateRecord = namedtuple("TemplateRecord", ["index", "base_id", "structure_ids", "text", "slots", "styles"])
+
+# Separator between the structures of one template
+SECTION_SEPARATOR = "\n\n"
+
+def sample_template(rng=random, index=None, safe=True, sampler=None):
+    """Sample a random LaTeX template and return it with the choices that produced it.
+
+    With safe, structures are only drawn from those the base template can
+    compile (COMPATIBLE_STRUCTURES), so no sample is doomed by a missing
+    package or an unsupported document class. A sampler from the sampling
+    module replaces the uniform choices of base, structures and styles.
+    """
+    if sampler is None:
+        # Choose a random base template first so the structures can match it
+        base_id = rng.choice(range(len(BASE_TEMPLATES)))
+        candidates = COMPATIBLE_STRUCTURES[base_id] if safe else range(len(STRUCTURES))
+
+        # Randomly choose number of sections (1 to 7 for variety)
+        num_sections = rng.randint(1, 7)
+        structure_ids = tuple(rng.choices(candidates, k=num_sections))
+        choose_style = choose_text_style
+    else:
+        base_id, structure_ids = sampler.draw(rng)
+        choose_style = sampler.style
+    pieces, content_slots, content_styles, offset = [], [], [], 0
+    for structure_id in structure_ids:
+        piece = render_skeleton(STRUCTURES[structure_id], rng=rng, slots=content_slots, offset=offset,
+                                choose_style=choose_style, styles=content_styles)
+        pieces.append(piece)
+        offset += len(piece) + len(SECTION_SEPARATOR)
+    content = SECTION_SEPARATOR.join(pieces)
+
+    # Style only the base template's own slots
+    slots, styles = [], []
+    text = render_skeleton(BASE_TEMPLATES[base_id], content, rng, slots, content_slots=content_slots,
+                           choose_style=choose_style, styles=styles, content_styles=content_styles)
+    return TemplateRecord(index, base_id, structure_ids, text, tuple(slots), tuple(styles))
+
+def render_random_template(rng=random, sampler=None):
+    """Render a random LaTeX template from the compiled structures and base templates."""
+    return sample_template(rng, sampler=sampler).text
+
+def generate_random_template(output_path, rng=random, sampler=None):
+    """Generate a random LaTeX template and write it to output_path."""
+    template = render_random_template(rng, sampler)
 
     # Write the template to file
     with open(output_path, "w", encoding="utf-8") as f:
         f.write(template)
 
+def shard_rng(seed, shard):
+    """Independent RNG of one shard, derived from the master seed and shard index."""
+    return random.Random(f"{seed}:{shard}")
+
+def template_filename(index):
+    """Deterministic file name of the index-th template of a batch."""
+    return f"template_{index:08d}.tex"
+
+def iter_shard(seed, shard, start, stop, sampler=None, metrics=None):
+    """Yield records [start, stop) of one shard; earlier ones are drawn and dropped.
+
+    A sampler is planned for the whole shard of SHARD_SIZE templates, so
+    stratified quotas hold per shard and records do not depend on stop.
+    With metrics, every sample is timed per base template as stage "generate".
+    """
+    rng = shard_rng(seed, shard)
+    if sampler is not None:
+        sampler = sampler.shard(rng, SHARD_SIZE)
+    for index in range(shard * SHARD_SIZE, stop):
+        if metrics is None:
+            record = sample_template(rng, index, sampler=sampler)
+        else:
+            with metrics.timer("generate") as timing:
+                record = sample_template(rng, index, sampler=sampler)
+                timing.key = record.base_id
+        if index >= start:
+            yield record
+
+def iter_templates(seed, n, start=0, sampler=None, metrics=None):
+    """Lazily yield n TemplateRecords starting at index start, one at a time."""
+    for task in shard_tasks(seed, start, start + n, sampler, metrics):
+        yield from iter_shard(*task)
+
+def write_templates(records, out_dir, metrics=None):
+    """File sink: write each record to out_dir under its deterministic name."""
+    paths = []
+    for record in records:
+        path = os.path.join(out_dir, template_filename(record.index))
+        with metrics.timer("write") if metrics is not None else nullcontext():
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(record.text)
+        paths.append(path)
+    return paths
+
+def _task_metrics(instrumented, metrics):
+    """(metrics, own) for a task: the caller's metrics, or fresh ones in a worker process."""
+    if metrics is not None or not instrumented:
+        return metrics, False
+    if __package__:
+        from .instrument import Metrics
+    else:  # a worker of the script, see main
+        from instrument import Metrics
+
+    return Metrics(), True
+
+def _run_tasks(function, tasks, workers, metrics, on_result=None):
+    """function(task, metrics) for every task, in order, over a process pool if workers > 1.
+
+    Worker processes return a metrics snapshot as the last element of their
+    result; it is merged into metrics as each task finishes. on_result is
+    called with every result as soon as it is in, and what it returns is
+    kept instead of the result, so bulky parts need not live until the end.
+    """
+    results = []
+    if workers <= 1:
+        for task in tasks:
+            result = function(task, metrics)
+            results.append(result if on_result is None else on_result(result))
+        return results
+    from multiprocessing import Pool
+
+    with Pool(workers) as pool:
+        for result in pool.imap(function, tasks):
+            if metrics is not None:
+                metrics.merge(result[-1])
+                metrics.gauge("tasks_pending", len(tasks) - len(results) - 1)
+            results.append(result if on_result is None else on_result(result))
+    return results
+
+def _checkpointed(tasks, manifest):
+    """Append a resume flag to (seed, shard, start, stop, ...) tasks.
+
+    The flag is None without a build manifest, else whether the manifest
+    already holds every sample of the task.
+    """
+    if manifest is None:
+        return [task + (None,) for task in tasks]
+    return [task + (manifest.count_done(task[2], task[3]) == task[3] - task[2],) for task in tasks]
+
+def _tracked(records, rows, resume):
+    """Yield records, collecting their (index, base_id, structure_ids) unless resume is None."""
+    if resume is None:
+        yield from records
+        return
+    for record in records:
+        rows.append((record.index, record.base_id, record.structure_ids))
+        yield record
+
+def _annotated(records, annotate):
+    """records and an AnnotationBuilder collecting their labels, or None if not annotate."""
+    if not annotate:
+        return records, None
+    from .annotations import AnnotationBuilder
+
+    builder = AnnotationBuilder()
+    return builder.tap(records), builder
+
+def _write_shard(task, metrics=None):
+    """Worker entry point: write one shard task to its output directory.
+
+    Returns the paths of the shard, with annotate its label columns, the
+    manifest rows of the written templates and the metrics snapshot of a
+    worker process. A shard the manifest already holds is not written again;
+    with annotate it is still sampled for its labels.
+    """
+    seed, shard, start, stop, out_dir, sampler, annotate, instrumented, resume = task
+    metrics, own = _task_metrics(instrumented, metrics)
+    rows = []
+    if resume:
+        paths = [os.path.join(out_dir, template_filename(index)) for index in range(start, stop)]
+        records, builder = _annotated(iter_shard(seed, shard, start, stop, sampler) if annotate else (), annotate)
+        for _ in records:
+            pass
+    else:
+        records, builder = _annotated(iter_shard(seed, shard, start, stop, sampler, metrics), annotate)
+        paths = write_templates(_tracked(records, rows, resume), out_dir, metrics)
+    return paths, builder and builder.columns(), rows, own and metrics.snapshot()
+
+def _save_annotations(out_dir, parts):
+    """Merge per-task label columns into out_dir's annotations file; return its name."""
+    from .annotations import ANNOTATIONS_NAME, merge_columns, save_annotations
+
+    save_annotations(os.path.join(out_dir, ANNOTATIONS_NAME), merge_columns(parts))
+    return ANNOTATIONS_NAME
+
+def shard_tasks(seed, start, stop, *extra):
+    """Split templates [start, stop) into per-shard (seed, shard, start, stop, *extra) tasks."""
+    tasks = []
+    for shard in range(start // SHARD_SIZE, (stop + SHARD_SIZE - 1) // SHARD_SIZE):
+        lo = max(start, shard * SHARD_SIZE)
+        hi = min(stop, (shard + 1) * SHARD_SIZE)
+        tasks.append((seed, shard, lo, hi) + extra)
+    return tasks
+
+def generate_templates(n, out_dir, seed=None, workers=1, start=0, sampler=None, annotate=False, metrics=None,
+                       manifest=None):
+    """Generate n templates into out_dir, named by their index starting at start.
+
+    The output depends only on (seed, index), so it is byte-identical for any
+    number of workers. With annotate, the labels of every template are saved
+    as columns to annotations.npz in out_dir. metrics (instrument.Metrics)
+    collects the timings of all workers. With a manifest
+    (manifest.BuildManifest), every written template is recorded as its shard
+    completes and shards it already holds are skipped.
+    """
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    os.makedirs(out_dir, exist_ok=True)
+    tasks = _checkpointed(shard_tasks(seed, start, start + n, out_dir, sampler, annotate, metrics is not None),
+                          manifest)
+
+    def record(result):
+        """Record the rows of a shard in the manifest and keep only its paths and label columns."""
+        paths, columns, rows, _ = result
+        if manifest is not None:
+            for (index, base_id, structure_ids), path in zip(rows, paths):
+                manifest.add(index, base_id, structure_ids, os.path.basename(path))
+        return paths, columns
+
+    results = _run_tasks(_write_shard, tasks, workers, metrics, record)
+    if annotate:
+        _save_annotations(out_dir, [columns for _, columns in results])
+    return [path for paths, _ in results for path in paths]
+
+def _write_packed_shard(task, metrics=None):
+    """Worker entry point: pack templates [start, stop) into the shard-th packed file."""
+    from .packed import shard_names, write_packed
+
+    seed, shard, start, stop, out_dir, fmt, compression, sampler, annotate, instrumented, resume = task
+    metrics, own = _task_metrics(instrumented, metrics)
+    data_name, index_name = shard_names(shard, fmt)
+    rows = []
+    if resume:
+        records, builder = _annotated(iter_templates(seed, stop - start, start, sampler) if annotate else (),
+                                      annotate)
+        for _ in records:
+            pass
+        count = stop - start
+    else:
+        records, builder = _annotated(iter_templates(seed, stop - start, start, sampler, metrics), annotate)
+        count = write_packed(
+            _tracked(records, rows, resume),
+            os.path.join(out_dir, data_name),
+            os.path.join(out_dir, index_name),
+            fmt,
+            compression,
+            metrics,
+        )
+    shard_info = {"data": data_name, "index": index_name, "count": count}
+    return shard_info, builder and builder.columns(), rows, own and metrics.snapshot()
+
+def generate_packed(n, out_dir, seed=None, workers=1, start=0, fmt="bin", compression=None,
+                    records_per_shard=PACKED_SHARD_SIZE, sampler=None, annotate=False, metrics=None, manifest=None):
+    """Generate n templates into a few large packed shard files instead of one file each.
+
+    Packed file j holds templates [start + j * records_per_shard, ...) so the
+    output is byte-identical for any number of workers; read it back with
+    packed.PackedReader. With a manifest, packed files it already holds
+    completely are not written again.
+    """
+    from .packed import write_manifest
+
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    os.makedirs(out_dir, exist_ok=True)
+    tasks = []
+    for shard, lo in enumerate(range(start, start + n, records_per_shard)):
+        hi = min(start + n, lo + records_per_shard)
+        tasks.append((seed, shard, lo, hi, out_dir, fmt, compression, sampler, annotate, metrics is not None))
+    tasks = _checkpointed(tasks, manifest)
+
+    def record(result):
+        """Record the rows of a shard in the manifest and keep only its description and label columns."""
+        shard, columns, rows, _ = result
+        if manifest is not None:
+            for index, base_id, structure_ids in rows:
+                manifest.add(index, base_id, structure_ids, shard["data"])
+        return shard, columns
+
+    results = _run_tasks(_write_packed_shard, tasks, workers, metrics, record)
+    shards = [shard for shard, _ in results]
+    annotations = _save_annotations(out_dir, [columns for _, columns in results]) if annotate else None
+    manifest = {
+        "seed": seed,
+        "start": start,
+        "count": n,
+        "format": fmt,
+        "compression": compression,
+        "records_per_shard": records_per_shard,
+        "sampling": None if sampler is None else sampler.config,
+        "annotations": annotations,
+        "shards": shards,
+    }
+    write_manifest(out_dir, manifest)
+    return manifest
+
 def main():
-    parser = argparse.ArgumentParser(description="Generate a random LaTeX template.")
-    parser.add_argument("output_path", help="Path to save the .tex file")
+    if __package__:
+        from . import instrument
+    else:  # run as a script; instrument has no package-relative imports
+        import instrument
+
+    parser = argparse.ArgumentParser(description="Generate random LaTeX templates.")
+    parser.add_argument("output_path", nargs="?", help="Path to save a single .tex file")
+    parser.add_argument("--count", type=int, help="Number of templates to generate into --out-dir")
+    parser.add_argument("--out-dir", help="Directory for batch output")
+    parser.add_argument("--start", type=int, default=0, help="Index of the first template in the batch")
+    parser.add_argument("--seed", type=int, help="Master seed for reproducible output")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes for batch output")
+    parser.add_argument("--format", choices=["tex", "jsonl", "bin"], default="tex",
+                        help="Batch output: one .tex file per template, or packed jsonl/bin shards")
+    parser.add_argument("--compression", choices=["gzip", "zstd"], help="Per-record compression of bin shards")
+    parser.add_argument("--shard-size", type=int, default=PACKED_SHARD_SIZE, help="Templates per packed shard file")
+    parser.add_argument("--weights", help="JSON file of base, structure and style weights and category quotas; quotas are "
+                             f"exact per shard of {SHARD_SIZE} templates, so over --start/--count only when "
+                             "both are multiples of it")
+    parser.add_argument("--annotations", action="store_true",
+                        help="Also save base, structure, style and slot labels as columns to annotations.npz")
+    parser.add_argument("--resume", action="store_true",
+                        help="Record every written template in build.sqlite in --out-dir and skip the shards a "
+                             "previous run with the same settings completed")
+    parser.add_argument("--catalogue", metavar="PATH", help="JSON catalogue of structures and base templates "
+                                                            "to use instead of the built-in catalogue.json")
+    instrument.add_arguments(parser)
     args = parser.parse_args()
-    generate_random_template(args.output_path)
+    if not __package__:
+        # The modules behind these options import this one relative to the package
+        packaged = [option for option, used in (("--format " + args.format, args.format != "tex"),
+                                                ("--annotations", args.annotations),
+                                                ("--weights", args.weights is not None),
+                                                ("--resume", args.resume)) if used]
+        if packaged:
+            parser.error(f"{', '.join(packaged)}: not available in a script run; use python -m src.template_generator")
+
+    if args.catalogue is not None:
+        try:
+            use_catalogue(args.catalogue)
+        except (OSError, ValueError, KeyError) as e:
+            parser.error(f"cannot load catalogue {args.catalogue}: {e}")
+
+    sampler = None
+    if args.weights is not None:
+        from .sampling import load_sampler, quota_warning
+
+        sampler = load_sampler(args.weights)
+
+    if args.count is None:
+        if args.output_path is None:
+            parser.error("either output_path or --count/--out-dir is required")
+        rng = random if args.seed is None else random.Random(args.seed)
+        if sampler is not None:
+            sampler = sampler.shard(rng, 1)
+        generate_random_template(args.output_path, rng, sampler)
+        return
+    if args.out_dir is None:
+        parser.error("--count requires --out-dir")
+    if args.count < 0:
+        parser.error("--count must be non-negative")
+    if args.compression is not None and args.format != "bin":
+        parser.error("--compression requires --format bin")
+    if args.shard_size <= 0:
+        parser.error("--shard-size must be positive")
+    if sampler is not None:
+        warning = quota_warning(sampler, args.start, args.count)
+        if warning is not None:
+            print(warning, file=sys.stderr)
+    seed, manifest = args.seed, None
+    if args.resume:
+        from .manifest import BuildManifest, build_seed
+
+        seed = build_seed(args.out_dir, seed)
+        config = {"kind": "templates", "seed": seed, "format": args.format, "catalogue": CATALOGUE_DIGEST,
+                  "sampling": None if sampler is None else sampler.config}
+        if args.format != "tex":  # packed file names depend on where the shards start
+            config.update(start=args.start, compression=args.compression, records_per_shard=args.shard_size)
+        try:
+            manifest = BuildManifest.open(args.out_dir, config)
+        except ValueError as e:
+            parser.error(str(e))
+    with instrument.from_args(args) as metrics, manifest if manifest is not None else nullcontext():
+        if args.format == "tex":
+            generate_templates(args.count, args.out_dir, seed=seed, workers=args.workers, start=args.start,
+                               sampler=sampler, annotate=args.annotations, metrics=metrics, manifest=manifest)
+        else:
+            generate_packed(args.count, args.out_dir, seed=seed, workers=args.workers, start=args.start,
+                            fmt=args.format, compression=args.compression, records_per_shard=args.shard_size,
+                            sampler=sampler, annotate=args.annotations, metrics=metrics, manifest=manifest)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,143 @@
+import re
+import json
+import argparse
+
+import numpy as np
+
+from .template_generator import (
+    BASE_FEATURES,
+    BASE_TEMPLATES,
+    COMPATIBLE_STRUCTURES,
+    STRUCTURE_REQUIREMENTS,
+    STRUCTURES,
+)
+
+FEATURES = sorted(set().union(*STRUCTURE_REQUIREMENTS, *BASE_FEATURES))
+
+# Row ends and horizontal rules inside a tabular body
+_TABULAR_BREAK = re.compile(r"\\\\|\\hline|\\cline\{[^}]*\}")
+
+def _tabular_bodies(text):
+    """Bodies of the tabular environments in text, without their column specification."""
+    for match in re.finditer(r"\\begin\{tabular\}", text):
+        position, depth = len(text) - len(text[match.end():].lstrip()), 0
+        while position < len(text):  # skip the column specification, which nests braces
+            depth += {"{": 1, "}": -1}.get(text[position], 0)
+            position += 1
+            if depth == 0:
+                break
+        end = text.find(r"\end{tabular}", position)
+        yield text[position:end if end != -1 else len(text)]
+
+def source_defects(skeleton):
+    """Errors TeX raises on a skeleton whatever fills its slots, as messages; empty if none is found.
+
+    Checks that every tabular row followed by \\hline or \\cline is ended
+    with \\\\; otherwise the rule is a "Misplaced \\noalign".
+    """
+    defects = []
+    for body in _tabular_bodies("x".join(skeleton.segments)):
+        last = 0
+        for match in _TABULAR_BREAK.finditer(body):
+            row = body[last:match.start()].strip()
+            if match.group() != "\\\\" and row:
+                defects.append(f"row not ended by \\\\ before {match.group()}: {row[:40]!r}")
+            last = match.end()
+    return defects
+
+def defective_sources():
+    """(structures, bases): source_defects of every structure and base template that has some."""
+    return tuple({i: defects for i, skeleton in enumerate(skeletons) if (defects := source_defects(skeleton))}
+                 for skeletons in (STRUCTURES, BASE_TEMPLATES))
+
+def feature_matrices():
+    """Boolean (structures, features) needs and (bases, features) provides matrices."""
+    needs = np.array([[f in r for f in FEATURES] for r in STRUCTURE_REQUIREMENTS], dtype=bool)
+    provides = np.array([[f in p for f in FEATURES] for p in BASE_FEATURES], dtype=bool)
+    return needs, provides
+
+def draw_samples(rng, n, safe=False):
+    """Draw base ids, section counts and flat structure ids for n samples like sample_template."""
+    bases = rng.integers(0, len(BASE_TEMPLATES), size=n)
+    counts = rng.integers(1, 8, size=n)
+    owners = np.repeat(bases, counts)
+    if safe:
+        lengths = np.array([len(c) for c in COMPATIBLE_STRUCTURES])
+        table = np.zeros((len(BASE_TEMPLATES), lengths.max()), dtype=np.int64)
+        for base_id, candidates in enumerate(COMPATIBLE_STRUCTURES):
+            table[base_id, :len(candidates)] = candidates
+        picks = (rng.random(len(owners)) * lengths[owners]).astype(np.int64)
+        structures = table[owners, picks]
+    else:
+        structures = rng.integers(0, len(STRUCTURES), size=len(owners))
+    return bases, counts, owners, structures
+
+def validate(n=1000000, seed=0, safe=False):
+    """Check n sampled (base, structures) combinations against the requirements table.
+
+    A sample also fails if its base template or one of its structures has
+    source_defects, which the requirements table cannot express.
+
+    Everything is done on flat arrays: one row per section, reduced back to
+    one row per sample with reduceat, so a million samples take about a second.
+    """
+    rng = np.random.default_rng(seed)
+    needs, provides = feature_matrices()
+    bases, counts, owners, structures = draw_samples(rng, n, safe)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    # (sections, features): features a section needs that its base lacks
+    missing = needs[structures] & ~provides[owners]
+    sample_missing = np.logical_or.reduceat(missing, starts, axis=0)
+    defective_structures, defective_bases = defective_sources()
+    broken_structures = np.isin(np.arange(len(STRUCTURES)), list(defective_structures))
+    broken_bases = np.isin(np.arange(len(BASE_TEMPLATES)), list(defective_bases))
+    defective = np.logical_or.reduceat(broken_structures[structures], starts) | broken_bases[bases]
+    failed = sample_missing.any(axis=1) | defective
+
+    per_base = np.bincount(bases, weights=failed, minlength=len(BASE_TEMPLATES))
+    totals = np.bincount(bases, minlength=len(BASE_TEMPLATES))
+    return {
+        "samples": n,
+        "seed": seed,
+        "safe": safe,
+        "failed": int(failed.sum()),
+        "failure_rate": float(failed.mean()),
+        "failure_rate_per_base": {
+            base_id + 1: float(per_base[base_id] / totals[base_id]) for base_id in range(len(BASE_TEMPLATES)) if totals[base_id]
+        },
+        "missing_features": {
+            feature: int(count) for feature, count in zip(FEATURES, sample_missing.sum(axis=0)) if count
+        },
+        "defective_sources": int(defective.sum()),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Check sampled templates against the compile-safety requirements table.")
+    parser.add_argument("--count", type=int, default=1000000, help="Number of samples to check")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    reports = [validate(args.count, args.seed, safe) for safe in (False, True)]
+    defective_structures, defective_bases = defective_sources()
+    if args.json:
+        print(json.dumps(reports, indent=2))
+        return
+    for report in reports:
+        sampler = "safe" if report["safe"] else "unconstrained"
+        print(f"{sampler}: {report['failed']} of {report['samples']} samples would fail ({report['failure_rate']:.2%})")
+        for feature, count in sorted(report["missing_features"].items(), key=lambda item: -item[1]):
+            print(f"  missing {feature}: {count}")
+        if report["defective_sources"]:
+            print(f"  defective sources: {report['defective_sources']}")
+    for kind, defects in (("Structure", defective_structures), ("Base template", defective_bases)):
+        for i, messages in defects.items():
+            print(f"{kind} {i + 1}: " + "; ".join(messages))
+    worst = sorted(reports[0]["failure_rate_per_base"].items(), key=lambda item: -item[1])[:5]
+    print("Worst base templates without the safe sampler: " + ", ".join(f"{b} ({r:.0%})" for b, r in worst))
+    if reports[1]["failed"]:
+        raise SystemExit("The safe sampler produced incompatible samples")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+import numpy as np
+from PIL import Image
+
+from src.augment import AUGMENTATIONS, Augmenter
+
+def _page(rng, height, width):
+    """Grayscale page with ink scattered everywhere, up to its last row and column."""
+    pixels = np.full((height, width), 255, dtype=np.uint8)
+    pixels[rng.integers(0, height, 400), rng.integers(0, width, 400)] = 0
+    pixels[:, -1] = 0
+    pixels[-1, :] = 0
+    return Image.fromarray(pixels)
+
+def test_page_does_not_depend_on_its_batch():
+    rng = np.random.default_rng(0)
+    large = _page(rng, 300, 260)
+    augmenter = Augmenter(seed=0, augmentations=AUGMENTATIONS, batch_size=2)
+    params = augmenter.params(range(2000))
+    # A sample drawing each augmentation, and one drawing rotation and blur together
+    indices = [int(np.flatnonzero(values)[0]) for values in params.values()]
+    indices.append(int(np.flatnonzero((params["rotate_degrees"] != 0) & (params["blur_sigma"] != 0))[0]))
+    # Alone, a page whose size is a multiple of 8 fills its buffer: anything beyond it is white
+    for small in (_page(rng, 96, 80), _page(rng, 101, 83)):
+        for index in indices:
+            (_, _, alone, _), = Augmenter(seed=0, batch_size=1).augment([(index, 1, small)])
+            alone = np.array(alone)
+            (_, _, batched, _), _ = augmenter.augment([(index, 1, small), (-1, 1, large)])
+            assert np.array_equal(alone, np.array(batched)), f"sample {index} of size {small.size}"